@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+# Parole che non cambiano il significato della domanda, escluse dalla chiave.
+# Gli interrogativi restano nella chiave: "chi ha costruito la stampante?" e "perché..." hanno risposte diverse
+_STOPWORDS = frozenset("""
+a ad al allo alla ai agli alle anche ci con da dal dallo dalla dai dagli dalle del dello della dei degli delle
+di e ed gli i il in l la le lo ma mi nel nello nella nei negli nelle per po puoi può sai se su sul sullo
+sulla sui sugli sulle ti tu un una uno vorrei dimmi parlami spiegami
+""".split())
+
+# Interrogativi: due domande sono la stessa solo se chiedono la stessa cosa ("chi" contro "perché")
+_INTERROGATIVES = frozenset("""
+che chi come cos cosa perche quale quali quanto quanta quanti quante quando
+""".split())
+
+# Verbi generici: una domanda fatta solo di questi e di interrogativi ("quanto costa?") parla di qualcosa detto prima
+_GENERIC_WORDS = frozenset("""
+costa costano serve servono funziona funzionano fa fanno usa usano si sono ha hanno significa vuol dire fare
+""".split())
+
+# Domande di seguito, che dipendono dalle risposte precedenti della conversazione: "e quanto costa?", "come si usa questa?"
+_FOLLOW_UP = re.compile(r'^\W*(e|ed|ma|anche|invece|quindi|allora|poi)\b'
+                        r'|\b(questo|questa|questi|queste|quello|quella|quelli|quelle|esso|essa|essi|esse|lui|lei|loro|suo|sua|suoi|sue)\b')
+
+# Domande che dipendono dallo stato del robot o dal momento: la risposta non è riutilizzabile
+_VOLATILE = re.compile(r'\b(dove|sei|stai|vai|adesso|ora|oggi|robot|posizione|distanza|lontano|vicino)\b')
+_NON_WORD = re.compile(r'[^\w\s]')
+
+
+def normalize_question(text: str) -> str:
+    """Forma normalizzata della domanda: minuscole, senza accenti, punteggiatura e parole vuote, parole ordinate"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    tokens = {token for token in _NON_WORD.sub(' ', text).split() if token not in _STOPWORDS}
+    return ' '.join(sorted(tokens))
+
+
+class _Entry:
+    __slots__ = ('answer', 'speech', 'tokens', 'vector', 'created', 'latency')
+
+    def __init__(self, answer, speech, tokens, vector, latency):
+        self.answer = answer
+        self.speech = speech
+        self.tokens = tokens
+        self.vector = vector
+        self.created = time.time()
+        self.latency = latency
+
+
+class AnswerCache:
+    """
+    Cache locale delle risposte del bot alle domande ripetute dei visitatori.
+    La chiave è la domanda normalizzata (senza lo stato del robot, che cambia ad ogni invio); oltre alla corrispondenza
+    esatta accetta domande con parole quasi uguali (Jaccard >= similarity) o, se è fornita embed_fun, con embedding simile.
+    Le voci scadono dopo ttl secondi e le meno usate vengono espulse oltre max_entries.
+    Insieme alla risposta si conservano i testi effettivamente passati al TTS, da riprodurre identici
+    così le frasi coincidono con quelle già sintetizzate e vengono servite dalla cache TTS.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, similarity: float = 0.8,
+                 embed_fun: Callable[[str], np.ndarray] | None = None, embed_similarity: float = 0.92):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.embed_fun = embed_fun
+        self.embed_similarity = embed_similarity
+
+        self._entries = OrderedDict()  # chiave normalizzata -> _Entry, dalla meno alla più recentemente usata
+        self._lock = threading.Lock()
+
+        # Statistiche di utilizzo
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def is_cacheable(question: str) -> bool:
+        """
+        Non vanno mai in cache le domande sullo stato del robot o sul momento attuale
+        e quelle che si capiscono solo con le risposte precedenti della conversazione
+        """
+        text = question.lower()
+        if not text.strip() or _VOLATILE.search(text) or _FOLLOW_UP.search(text):
+            return False
+        # Serve almeno una parola che dica di cosa si parla, oltre agli interrogativi e ai verbi generici
+        return bool(set(normalize_question(question).split()) - _INTERROGATIVES - _GENERIC_WORDS)
+
+    def _embed(self, question):
+        if self.embed_fun is None:
+            return None
+        vector = np.asarray(self.embed_fun(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _expired(self, entry, now) -> bool:
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def _find(self, key, tokens, vector, now):
+        """Cerca la voce per chiave esatta, poi per embedding o per somiglianza delle parole, da chiamare con self._lock acquisito"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            return key, entry
+
+        best_key, best_score = None, 0.0
+        interrogatives = tokens & _INTERROGATIVES
+        for other_key, other in self._entries.items():
+            if self._expired(other, now) or other.tokens & _INTERROGATIVES != interrogatives:
+                continue
+            if vector is not None and other.vector is not None:
+                score = float(np.dot(vector, other.vector))
+                threshold = self.embed_similarity
+            else:
+                union = len(tokens | other.tokens)
+                score = len(tokens & other.tokens) / union if union else 0.0
+                threshold = self.similarity
+            if score >= threshold and score > best_score:
+                best_key, best_score = other_key, score
+        return (best_key, self._entries[best_key]) if best_key is not None else (None, None)
+
+    def get(self, question: str) -> tuple[str, list[str]] | None:
+        """Restituisce la risposta in cache per la domanda e i testi pronunciati, o None"""
+        key = normalize_question(question)
+        if not key or not self.is_cacheable(question):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            found_key, entry = self._find(key, set(key.split()), vector, now)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[found_key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(found_key)
+            self.hits += 1
+            self.saved_seconds += entry.latency
+            return entry.answer, list(entry.speech)
+
+    def put(self, question: str, answer: str, speech: list[str] = (), latency: float = 0.0):
+        """
+        Memorizza la risposta e i testi inviati al TTS nell'ordine (speech), latency è il tempo impiegato
+        dal bot remoto e viene contato come risparmiato ad ogni hit
+        """
+        key = normalize_question(question)
+        if not answer or not key or not self.is_cacheable(question):
+            return
+        entry = _Entry(answer, tuple(speech), set(key.split()), self._embed(question), latency)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self):
+        """Elimina le voci scadute"""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if self._expired(entry, now)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+            }
@@ -1,99 +1,320 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import logging
 import os
 import queue
 import threading
+import time
 import wave
+from collections import deque
 
 import numpy as np
-import sounddevice as sd
-from piper.voice import PiperVoice
 from typing import Callable
 
+try:
+    from .AudioSink import AudioSink, LocalDeviceSink, NullSink, SocketIOSink, WavFileSink
+    from .Metrics import metrics
+    from .TTSCache import TTSCache
+    from .Tracer import current_trace, tracer
+    from .text_utils import split_sentences
+except ImportError:
+    from AudioSink import AudioSink, LocalDeviceSink, NullSink, SocketIOSink, WavFileSink
+    from Metrics import metrics
+    from TTSCache import TTSCache
+    from Tracer import current_trace, tracer
+    from text_utils import split_sentences
+
+log = logging.getLogger('ifab.tts')
+
 # Singleton per il modello TTS
 _tts_instance = None
 _tts_lock = threading.Lock()
 
 
+# Marcatore di fine utterance nella coda di riproduzione
+_UTTERANCE_END = object()
+
+
+class Utterance:
+    """Una richiesta di riproduzione (testo o wav), con evento di completamento e possibilità di annullamento"""
+
+    def __init__(self, text: str | None = None, room: str | None = None):
+        self.text = text
+        self.room = room  # Sessione del frontend a cui è destinato l'audio, None per tutte
+        self.request_time = time.perf_counter()
+        self.first_audio_time = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self.trace_id = current_trace()  # Interazione che ha chiesto la riproduzione, la sintesi avviene in altri thread
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Attende la fine della riproduzione, restituisce False in caso di timeout"""
+        return self.done.wait(timeout=timeout)
+
+    @property
+    def ttfa(self) -> float | None:
+        """Time-to-first-audio in secondi, None se la riproduzione non è ancora iniziata"""
+        if self.first_audio_time is None:
+            return None
+        return self.first_audio_time - self.request_time
+
+
 class AudioPlayer:
-    def __init__(self, voice_model_path, startTalkCallback: Callable[[None],None]=None, stopTalkCallback: Callable[[None],None]=None):
+    def __init__(self, voice_model_path, startTalkCallback: Callable[[None],None]=None, stopTalkCallback: Callable[[None],None]=None,
+                 cache: TTSCache | None = None, synth_params: dict | None = None, lookahead: int = 2,
+                 sink: AudioSink | None = None):
         global _tts_instance
 
         # Implementazione del pattern Singleton per evitare ricaricamenti multipli del modello TTS
         with _tts_lock:
             if _tts_instance is None:
-                print(f"Caricamento del modello TTS da: {voice_model_path}")
+                from piper.voice import PiperVoice  # Import pesante (onnxruntime), solo alla creazione del primo player
+                log.info("Caricamento del modello TTS da: %s", voice_model_path)
                 _tts_instance = PiperVoice.load(voice_model_path)
-                print("└─▶ Modello TTS caricato con successo")
+                log.info("Modello TTS caricato con successo")
             else:
-                print("└─▶ Utilizzo modello TTS già caricato in memoria")
+                log.info("Utilizzo modello TTS già caricato in memoria")
 
             self.voice = _tts_instance
 
         self.startTalkCallback = startTalkCallback
         self.stopTalkCallback = stopTalkCallback
 
-        self.stream = None
+        # Cache dell'audio sintetizzato, la chiave include modello e parametri di sintesi
+        self.cache = cache
+        self.synth_params = synth_params if synth_params is not None else {}
+        self.voice_id = f"{os.path.abspath(voice_model_path)}@{self.voice.config.sample_rate}"
+
+        self.dType = np.int16
+        self.blockItemSize = 4096
+        self.silence_sound = np.zeros(int(self.voice.config.sample_rate * 0.3), dtype=self.dType)
+
+        # Motore di riproduzione: un solo thread e una sola destinazione audio per tutta la vita del player,
+        # la coda contiene tuple (utterance, blocco audio | marcatore)
+        self.sink = None
+        self.set_sink(sink if sink is not None else LocalDeviceSink(blocksize=self.blockItemSize))
         self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._active = set()  # Utterance accodate e non ancora concluse
+        self._last_utterance = None
         self.thread = threading.Thread(target=self._play_audio)
         self.thread.daemon = True
         self.thread.start()
-        self.dType = np.int16
-        self.blockItemSize = 4096
-        self.silence_sound = np.zeros(int(self.voice.config.sample_rate * 0.3), dtype=self.dType)
 
-    def _ensure_stream_open(self):
-        if self.stream is None or not self.stream.active:
-            self.stream = sd.OutputStream(
-                samplerate=self.voice.config.sample_rate,
-                channels=1,
-                dtype=self.dType,
-                blocksize=self.blockItemSize,
-                latency='low'
-            )
-            self.stream.start()
+        # Pipeline di sintesi: un thread produttore sintetizza le frasi in anticipo sulla riproduzione,
+        # al massimo 'lookahead' frasi sintetizzate e non ancora riprodotte
+        self.lookahead = max(1, lookahead)
+        self.synth_queue = queue.Queue()
+        self.synth_thread = threading.Thread(target=self._synth_worker)
+        self.synth_thread.daemon = True
+        self.synth_thread.start()
+
+        # Tempo fra la richiesta di play_text e l'inizio della riproduzione (time-to-first-audio)
+        self.ttfa_history = deque(maxlen=100)
+
+        # Metriche: fattore real-time della sintesi (<1 più veloce del parlato), time-to-first-audio e resa della cache
+        self.rtf_histogram = metrics.histogram('ifab_tts_real_time_factor', "Tempo di sintesi diviso per la durata dell'audio sintetizzato",
+                                               buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0))
+        self.ttfa_histogram = metrics.histogram('ifab_tts_first_audio_seconds', "Tempo fra la richiesta di riproduzione e il primo audio")
+        metrics.gauge('ifab_tts_cache_hit_ratio', "Frazione delle frasi servite dalla cache TTS",
+                      fun=lambda: self.cache.stats()['hit_rate'] if self.cache is not None else None)
+
+    def set_sink(self, sink: AudioSink):
+        """
+        Cambia la destinazione dell'audio (casse locali, file, browser...), anche a riproduzione avviata:
+        i blocchi successivi vanno alla nuova, la vecchia viene chiusa dal thread di riproduzione
+        dopo l'audio già in coda, così non viene mai chiusa a metà di una scrittura
+        """
+        sink.open(self.voice.config.sample_rate, channels=1, dtype=self.dType)
+        old_sink, self.sink = self.sink, sink
+        if old_sink is not None:
+            if self.thread.is_alive():
+                self.queue.put((None, old_sink.close))
+            else:
+                old_sink.close()
 
     def _play_audio(self):
+        """Thread di riproduzione, unico per tutta la vita del player"""
+        speaking = None  # Utterance di cui è già stata segnalata la partenza
         while True:
-            audio_data = self.queue.get()
-            if audio_data is None:
+            item = self.queue.get()
+            if item is None:
                 break
-            if self.startTalkCallback:
-                self.startTalkCallback()
-            self._ensure_stream_open()
-            self.stream.write(audio_data)
-        if self.stream:
-            # if self.stopTalkCallback:
-            #     self.stopTalkCallback()
-            self.stream.stop()
-            self.stream.close()
-            self.stream = None
-
-    def play_wav_from_memory(self, wav_data):
-        index = 0
-        toSend = len(wav_data) - 1 // np.dtype(self.dType).itemsize
-        while toSend > 0:
-            int_data = np.frombuffer(wav_data, dtype=np.int16, count=min(self.blockItemSize, toSend // np.dtype(self.dType).itemsize), offset=index)
-            self.queue.put(int_data)
-            index += self.blockItemSize * np.dtype(self.dType).itemsize
-            toSend -= self.blockItemSize * np.dtype(self.dType).itemsize
-
-    def play_text(self, text):
-        for audio_bytes in self.voice.synthesize_stream_raw(text):
-            int_data = np.frombuffer(audio_bytes, dtype=np.int16)
-            self.queue.put(int_data)
+            utterance, payload = item
+
+            if payload is _UTTERANCE_END:
+                if not utterance.cancelled and utterance.first_audio_time is not None:
+                    self._write(utterance, self.silence_sound)  # Coda di silenzio per svuotare il buffer del dispositivo
+                    self.sink.end_utterance(utterance.room)
+                self._finish(utterance)
+                if speaking is utterance:
+                    speaking = None
+                    if self.stopTalkCallback and self.queue.empty():
+                        self.stopTalkCallback()
+                continue
+            if callable(payload):  # Marcatore della pipeline di sintesi, non audio
+                payload()
+                continue
+            if utterance.cancelled:
+                continue  # Audio scartato da cancel()
+
+            if utterance.first_audio_time is None:
+                utterance.first_audio_time = time.perf_counter()
+                self._report_ttfa(utterance)
+            if speaking is not utterance:
+                speaking = utterance
+                if self.startTalkCallback:
+                    self.startTalkCallback()
+            self._write(utterance, payload)
+
+        self.sink.close()
+
+    def _write(self, utterance: Utterance, audio_data: np.ndarray):
+        """Scrive l'audio a blocchi, così un cancel() interrompe la riproduzione entro un blocco"""
+        try:
+            for start in range(0, len(audio_data), self.blockItemSize):
+                if utterance.cancelled:
+                    return
+                self.sink.write(audio_data[start:start + self.blockItemSize], utterance.room)
+        except Exception as e:
+            log.error("Errore durante la riproduzione audio: %s", e)
+
+    def _finish(self, utterance: Utterance):
+        with self._lock:
+            self._active.discard(utterance)
+        if utterance.first_audio_time is not None:
+            tracer.record('tts.playback', utterance.first_audio_time, time.perf_counter(), trace_id=utterance.trace_id, cancelled=utterance.cancelled)
+        utterance.done.set()
+
+    def _submit(self, utterance: Utterance, sentences: list[str] | None = None, samples: np.ndarray | None = None) -> Utterance:
+        with self._lock:
+            self._active.add(utterance)
+            self._last_utterance = utterance
+        self.synth_queue.put((utterance, sentences, samples))
+        return utterance
+
+    def play_wav_from_memory(self, wav_data, room: str | None = None) -> Utterance:
+        """Accoda un wav (PCM 16 bit mono) già in memoria, rispettando l'ordine con i testi accodati"""
+        itemsize = np.dtype(self.dType).itemsize
+        samples = np.frombuffer(wav_data, dtype=self.dType, count=len(wav_data) // itemsize)
+        return self._submit(Utterance(room=room), samples=samples)
+
+    def _synthesize(self, text):
+        """Genera i blocchi PCM del testo, dalla cache se presente, altrimenti sintetizzandoli e salvandoli in cache"""
+        key = TTSCache.make_key(text, self.voice_id, self.synth_params) if self.cache is not None else None
+        if key is not None:
+            pcm = self.cache.get(key)
+            if pcm is not None:
+                yield np.frombuffer(pcm, dtype=self.dType)
+                return
+
+        chunks = []
+        synth_time = 0.0  # Solo il tempo di sintesi, non l'attesa del consumatore fra un blocco e l'altro
+        start_time = time.perf_counter()
+        for audio_bytes in self.voice.synthesize_stream_raw(text, **self.synth_params):
+            synth_time += time.perf_counter() - start_time
+            chunks.append(audio_bytes)
+            yield np.frombuffer(audio_bytes, dtype=self.dType)
+            start_time = time.perf_counter()
+        audio_seconds = sum(len(chunk) for chunk in chunks) / np.dtype(self.dType).itemsize / self.voice.config.sample_rate
+        if audio_seconds > 0:
+            self.rtf_histogram.observe(synth_time / audio_seconds)
+        if key is not None:
+            self.cache.put(key, b"".join(chunks))
+
+    def _synth_worker(self):
+        """Thread produttore: sintetizza le frasi delle richieste in ordine, rispettando il lookahead"""
+        while True:
+            utterance, sentences, samples = self.synth_queue.get()
+            try:
+                if samples is not None and not utterance.cancelled:
+                    self.queue.put((utterance, samples))
+                budget = threading.Semaphore(self.lookahead)
+                for sentence in sentences or []:
+                    budget.acquire()  # Attende che la riproduzione consumi una frase prima di sintetizzarne altre
+                    if utterance.cancelled:
+                        break
+                    with tracer.span('tts.synth', trace_id=utterance.trace_id, chars=len(sentence)):
+                        for int_data in self._synthesize(sentence):
+                            self.queue.put((utterance, int_data))
+                    self.queue.put((utterance, budget.release))  # Rilasciato dal thread di riproduzione a fine frase
+            except Exception as e:
+                log.error("Errore durante la sintesi vocale: %s", e)
+            finally:
+                self.queue.put((utterance, _UTTERANCE_END))
+                self.synth_queue.task_done()
+
+    def _report_ttfa(self, utterance: Utterance):
+        if utterance.text is None:
+            return  # Wav già pronti, non misurano la sintesi
+        self.ttfa_history.append(utterance.ttfa)
+        self.ttfa_histogram.observe(utterance.ttfa)
+        tracer.record('tts.first_audio', utterance.request_time, utterance.first_audio_time, trace_id=utterance.trace_id)
+        log.info("TTS time-to-first-audio: %.0f ms", utterance.ttfa * 1000)
+
+    def ttfa_stats(self) -> dict:
+        """Statistiche sul time-to-first-audio delle ultime richieste, in secondi"""
+        history = list(self.ttfa_history)
+        if not history:
+            return {'count': 0, 'last': None, 'mean': None, 'max': None}
+        return {'count': len(history), 'last': history[-1], 'mean': sum(history) / len(history), 'max': max(history)}
+
+    def play_text(self, text, room: str | None = None) -> Utterance:
+        """
+        Accoda il testo alla pipeline di sintesi: la prima frase parte subito, le successive sono sintetizzate durante la riproduzione.
+        room: sessione del frontend che riceve l'audio con la destinazione Socket.IO, None per tutte
+        """
+        utterance = Utterance(text, room)
+        return self._submit(utterance, sentences=split_sentences(text))
+
+    def prewarm(self, texts: list[str]) -> threading.Thread | None:
+        """Sintetizza in background le frasi ricorrenti, così la prima riproduzione parte subito dalla cache"""
+        if self.cache is None:
+            return None
+
+        def worker():
+            # Stessa suddivisione in frasi di play_text, così le chiavi in cache coincidono
+            sentences = [sentence for text in texts for sentence in split_sentences(text)]
+            for sentence in dict.fromkeys(sentences):  # Rimuove i duplicati mantenendo l'ordine
+                if TTSCache.make_key(sentence, self.voice_id, self.synth_params) in self.cache:
+                    continue
+                for _ in self._synthesize(sentence):
+                    pass
+            log.info("Cache TTS pre-caricata con %d frasi", len(texts))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+    def cancel(self, room: str | None = None):
+        """Barge-in: interrompe la frase in riproduzione e scarta l'audio in coda della sessione room, o di tutte se None"""
+        with self._lock:
+            pending = [utterance for utterance in self._active if room is None or utterance.room == room]
+        for utterance in pending:
+            utterance.cancelled = True
+        if pending:
+            self.sink.flush(room)
+            log.info("TTS interrotto, %d richieste scartate", len(pending))
 
     def is_playing(self):
-        return self.stream is not None and self.stream.active
+        with self._lock:
+            return bool(self._active)
+
+    def waitEndBuffer(self, utterance: Utterance | None = None, timeout: float | None = None) -> bool:
+        """Attende la fine della riproduzione di una utterance, o di tutte quelle accodate finora"""
+        if utterance is None:
+            with self._lock:
+                utterance = self._last_utterance
+        if utterance is None:
+            return True
+        return utterance.wait(timeout=timeout)
 
-    def waitEndBuffer(self):
-        self.queue.put(self.silence_sound)
+    def close(self):
+        """Ferma il motore di riproduzione e chiude la destinazione audio"""
+        self.cancel()
         self.queue.put(None)
-        self.thread.join()
-        self.thread = threading.Thread(target=self._play_audio)
-        self.thread.daemon = True
-        self.thread.start()
+        self.thread.join(timeout=2)
 
 
 def open_wave(wave_file):
@@ -110,9 +331,29 @@ def audioPlayer_argsAdd(parser: argparse.ArgumentParser) -> argparse.ArgumentPar
     audioLibPath = os.path.join(os.path.dirname(__file__))
     audioPlayerParser.add_argument("--tts_model", type=str, help="Path to the Piper-TTS voice model '*.onnx' [default '%(default)s']",
                                    default=os.path.relpath(os.path.join(audioLibPath, "../tts-model", "it_IT-paola-medium.onnx")))
+    audioPlayerParser.add_argument("--tts_sink", type=str, default="device", choices=["device", "wav", "null", "socketio"],
+                                   help="Destinazione dell'audio TTS: casse locali, file wav, nessuna o browser via Socket.IO [default '%(default)s']")
+    audioPlayerParser.add_argument("--tts_wav_path", type=str, default="tts-output.wav", help="File di uscita per --tts_sink wav [default '%(default)s']")
+    audioPlayerParser.add_argument("--tts_lookahead", type=int, default=2, help="Numero massimo di frasi sintetizzate in anticipo sulla riproduzione [default '%(default)s']")
+    audioPlayerParser.add_argument("--tts_cache_dir", type=str, help="Cartella per la cache su disco dell'audio sintetizzato, '' per disabilitarla [default '%(default)s']",
+                                   default=os.path.relpath(os.path.join(audioLibPath, "../tts-cache")))
+    audioPlayerParser.add_argument("--tts_cache_mb", type=int, default=64, help="Dimensione massima in MB della cache TTS in memoria, 0 per disabilitare la cache [default '%(default)s']")
+    audioPlayerParser.add_argument("--tts_cache_disk_mb", type=int, default=512, help="Dimensione massima in MB della cache TTS su disco [default '%(default)s']")
     return audioPlayerParser
 
 
 def audioPlayer_useArgs(args: argparse.Namespace, **kargs) -> AudioPlayer:
-    player = AudioPlayer(args.tts_model, **kargs)
+    cache = None
+    if args.tts_cache_mb > 0:
+        cache = TTSCache(max_memory_bytes=args.tts_cache_mb * 1024 ** 2, cache_dir=args.tts_cache_dir or None,
+                         max_disk_bytes=args.tts_cache_disk_mb * 1024 ** 2)
+    # La destinazione Socket.IO richiede il server, va impostata con set_sink() dopo la creazione dell'app
+    match args.tts_sink:
+        case "wav":
+            sink = WavFileSink(args.tts_wav_path)
+        case "null" | "socketio":
+            sink = NullSink()
+        case _:
+            sink = None
+    player = AudioPlayer(args.tts_model, cache=cache, lookahead=args.tts_lookahead, sink=sink, **kargs)
     return player
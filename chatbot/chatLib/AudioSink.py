@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import abc
+import threading
+import time
+import wave
+
+import numpy as np
+
+
+class AudioSink(abc.ABC):
+    """
+    Destinazione dell'audio prodotto dal TTS.
+    Il motore di riproduzione chiama open() una volta, write() per ogni blocco PCM,
+    end_utterance() a fine frase, flush() su barge-in e close() allo spegnimento.
+    room è la sessione del frontend che ha chiesto l'audio (None: tutte), usata solo dalle destinazioni nel browser.
+    """
+
+    def __init__(self):
+        self.sample_rate = None
+        self.channels = 1
+        self.dtype = np.int16
+
+    def open(self, sample_rate: int, channels: int = 1, dtype=np.int16):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = dtype
+
+    @abc.abstractmethod
+    def write(self, samples: np.ndarray, room: str | None = None):
+        """Riproduce o inoltra un blocco PCM"""
+
+    def end_utterance(self, room: str | None = None):
+        """Fine di una richiesta di riproduzione"""
+        pass
+
+    def flush(self, room: str | None = None):
+        """Scarta l'audio eventualmente bufferizzato a valle (barge-in)"""
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalDeviceSink(AudioSink):
+    """Riproduzione sulle casse locali tramite sounddevice, lo stream resta aperto fra una frase e l'altra"""
+
+    def __init__(self, blocksize: int = 4096, latency='low'):
+        super().__init__()
+        self.blocksize = blocksize
+        self.latency = latency
+        self.stream = None
+
+    def _ensure_stream_open(self):
+        """Apre lo stream alla prima scrittura, o lo riapre solo se il dispositivo lo ha fermato"""
+        import sounddevice as sd  # Import ritardato: PortAudio serve solo se si usano le casse locali
+
+        if self.stream is None or not self.stream.active:
+            if self.stream is not None:
+                try:
+                    self.stream.close()
+                except Exception:
+                    pass
+            self.stream = sd.OutputStream(
+                samplerate=self.sample_rate,
+                channels=self.channels,
+                dtype=self.dtype,
+                blocksize=self.blocksize,
+                latency=self.latency
+            )
+            self.stream.start()
+
+    def write(self, samples: np.ndarray, room: str | None = None):
+        self._ensure_stream_open()
+        self.stream.write(samples)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+class WavFileSink(AudioSink):
+    """Scrive tutto l'audio in un unico file wav, utile per test e benchmark senza scheda audio"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.wav = None
+
+    def open(self, sample_rate: int, channels: int = 1, dtype=np.int16):
+        super().open(sample_rate, channels, dtype)
+        self.wav = wave.open(self.path, 'wb')
+        self.wav.setnchannels(channels)
+        self.wav.setsampwidth(np.dtype(dtype).itemsize)
+        self.wav.setframerate(sample_rate)
+
+    def write(self, samples: np.ndarray, room: str | None = None):
+        self.wav.writeframes(samples.tobytes())
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+
+class NullSink(AudioSink):
+    """Scarta l'audio contando i campioni, per misurare il throughput della sintesi"""
+
+    def __init__(self):
+        super().__init__()
+        self.samples_written = 0
+
+    def write(self, samples: np.ndarray, room: str | None = None):
+        self.samples_written += len(samples)
+
+    @property
+    def seconds_written(self) -> float:
+        return self.samples_written / self.sample_rate if self.sample_rate else 0.0
+
+
+class SocketIOSink(AudioSink):
+    """
+    Invia l'audio al browser via Socket.IO man mano che viene prodotto, solo alla sessione che lo ha chiesto
+    (room della richiesta, altrimenti la room del sink; senza nessuna delle due a tutti i browser).
+    Eventi emessi:
+        'tts-audio': {'seq', 'sample_rate', 'channels', 'encoding': 'pcm16', 'data': bytes}
+        'tts-end':   fine di una richiesta di riproduzione
+        'tts-flush': il client deve scartare l'audio in coda (barge-in)
+    Con realtime=True l'invio è cadenzato sul tempo reale, con al massimo 'lead' secondi di anticipo,
+    così la faccia del robot e il barge-in restano sincronizzati con quello che il browser sta suonando.
+    """
+
+    def __init__(self, socketio, room: str | None = None, realtime: bool = True, lead: float = 0.5):
+        super().__init__()
+        self.socketio = socketio
+        self.room = room
+        self.realtime = realtime
+        self.lead = lead
+        self._seq = 0
+        self._clock_start = None
+        self._sent_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _emit(self, event, data, room):
+        room = room if room is not None else self.room
+        if room is not None:
+            self.socketio.emit(event, data, to=room)
+        else:
+            self.socketio.emit(event, data)
+
+    def write(self, samples: np.ndarray, room: str | None = None):
+        with self._lock:
+            now = time.monotonic()
+            if self._clock_start is None or now - self._clock_start > self._sent_seconds:
+                # Il client ha già suonato tutto, riparte il conteggio
+                self._clock_start = now
+                self._sent_seconds = 0.0
+            self._seq += 1
+            seq = self._seq
+            self._sent_seconds += len(samples) / (self.sample_rate * self.channels)
+            wait = self._sent_seconds - self.lead - (now - self._clock_start)
+
+        self._emit('tts-audio', {'seq': seq, 'sample_rate': self.sample_rate, 'channels': self.channels,
+                                 'encoding': 'pcm16', 'data': samples.astype(np.int16, copy=False).tobytes()}, room)
+        if self.realtime and wait > 0:
+            time.sleep(wait)
+
+    def end_utterance(self, room: str | None = None):
+        self._emit('tts-end', {'seq': self._seq}, room)
+
+    def flush(self, room: str | None = None):
+        with self._lock:
+            self._clock_start = None
+            self._sent_seconds = 0.0
+        self._emit('tts-flush', {'seq': self._seq}, room)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import difflib
+import math
+import re
+import unicodedata
+
+# Verbi di movimento, anche all'infinito: esclusi dall'indice dei target e usati per riconoscere "non andare al laser".
+# Niente "va", "porta", "torna": sono anche indicativi o nomi ("il laser va acceso", "la porta del laser")
+_MOTION_WORDS = frozenset("""
+vai andare andiamo vada portami portarmi accompagnami accompagna accompagnarmi dirigiti dirigersi raggiungi
+raggiungere spostati sposta spostarti muoviti muovi tornare ritorna corri guidami
+""".split())
+
+# Forme imperative dei verbi di movimento: una frase è un comando solo se comincia con una di queste
+_IMPERATIVE_WORDS = frozenset("""
+vai andiamo vada portami accompagnami accompagna dirigiti raggiungi spostati sposta muoviti muovi ritorna corri guidami
+""".split())
+
+# Vocativi e intercalari ammessi prima dell'imperativo ("robot, vai al laser", "ok vai alla CNC")
+_LEADING_WORDS = frozenset("""
+robot ok okay ciao ehi hey allora dai senti per favore ora adesso
+""".split())
+
+# Negazioni: "non andare al laser" non deve muovere il robot
+_NEGATION_WORDS = frozenset(("non", "no", "mai"))
+
+# Parole da ignorare nell'indice dei target (articoli, preposizioni e i verbi delle frasi 'say')
+_STOPWORDS = frozenset("""
+a ad al allo alla ai agli alle da dal dallo dalla dai dagli dalle del dello della dei degli delle di e in l la le lo il i gli
+mi ti nel nello nella verso fino sul sullo sulla per un una uno vado sto andando dirigo mi me ora adesso subito ti prego
+""".split())
+
+# Destinazione "nessun target": il robot torna al centro del tavolo
+_HOME_WORDS = frozenset(("centro", "base", "casa", "partenza"))
+_NON_WORD = re.compile(r'[^\w\s]')
+
+
+def _tokens(text: str) -> list[str]:
+    """Parole in minuscolo senza accenti e punteggiatura"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', text).split()
+
+
+class IntentRouter:
+    """
+    Riconoscimento locale dei comandi di movimento ("vai al laser", "portami alla stampante 3D"),
+    costruito dai pulsanti {key, text, say} della configurazione.
+    L'indice parola -> target è calcolato una volta, con un peso IDF per parola così che le parole
+    comuni a più target ("zona") contino meno; le parole non trovate vengono corrette con un confronto
+    approssimato sul vocabolario, per tollerare gli errori di trascrizione.
+    """
+
+    def __init__(self, targets: list[dict], fuzzy_cutoff: float = 0.8, min_score: float = 0.5,
+                 home_say: str = "Torno al centro del tavolo"):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.min_score = min_score
+        self.targets = {}  # key -> pulsante di configurazione
+        self.index = {}  # parola -> insieme di key
+        for target in targets:
+            key = target['key']
+            self.targets[key] = target
+            words = _tokens(f"{key} {target.get('text', '')} {target.get('say', '')}")
+            for word in words:
+                if word not in _STOPWORDS and word not in _MOTION_WORDS:
+                    self.index.setdefault(word, set()).add(key)
+        # Peso delle parole: 1 se identifica un solo target, meno se è condivisa
+        self.weights = {word: 1.0 / len(keys) for word, keys in self.index.items()}
+        self.vocabulary = list(self.index)
+        self.home = {'key': None, 'text': "Centro", 'say': home_say}
+
+    def _lookup(self, word: str) -> str | None:
+        """Parola del vocabolario corrispondente, esatta o approssimata"""
+        if word in self.index:
+            return word
+        if len(word) < 4:
+            return None  # Parole brevi: la correzione approssimata darebbe troppi falsi positivi
+        matches = difflib.get_close_matches(word, self.vocabulary, n=1, cutoff=self.fuzzy_cutoff)
+        return matches[0] if matches else None
+
+    def match(self, utterance: str) -> dict | None:
+        """
+        Restituisce il pulsante del target richiesto se la frase è un comando di movimento non ambiguo, altrimenti None.
+        Un falso positivo muove il robot: la frase deve cominciare con un imperativo di movimento, al più preceduto
+        da un vocativo o un intercalare, e non contenere negazioni. Affermazioni e domande vanno al bot.
+        """
+        words = _tokens(utterance)
+        start = 0
+        while start < len(words) and words[start] in _LEADING_WORDS:
+            start += 1
+        if start == len(words) or words[start] not in _IMPERATIVE_WORDS:
+            return None  # "il pezzo va nella stampante 3D", "puoi andare al laser?"
+        if _NEGATION_WORDS.intersection(words):
+            return None  # "vai al laser, anzi non andare", "vai al laser? no, aspetta"
+
+        scores = {}
+        for word in words:
+            if word in _STOPWORDS or word in _MOTION_WORDS:
+                continue
+            vocabulary_word = self._lookup(word)
+            if vocabulary_word is None:
+                continue
+            for key in self.index[vocabulary_word]:
+                scores[key] = scores.get(key, 0.0) + self.weights[vocabulary_word]
+
+        if not scores:
+            return self.home if _HOME_WORDS.intersection(words) else None
+        ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_key, best_score = ranking[0]
+        if best_score < self.min_score:
+            return None
+        if len(ranking) > 1 and math.isclose(ranking[1][1], best_score):
+            return None  # Ambiguo, meglio chiedere al bot
+        return self.targets[best_key]
+
+
+if __name__ == '__main__':
+    # Verifica rapida del riconoscimento con i pulsanti di esempio della configurazione
+    router = IntentRouter([
+        {"key": "saldatura", "text": "Zona saldatura", "say": "Vado a saldare"},
+        {"key": "laser", "text": "Tagliatrice Laser", "say": "Vado dalla Tagliatrice Laser"},
+        {"key": "3d", "text": "Stampante 3D", "say": "Vado verso la Stampante 3D"},
+        {"key": "cnc", "text": "CNC", "say": "Mi dirigo verso la CNC"},
+    ])
+    cases = {
+        "vai al laser": "laser",
+        "portami alla stampante 3D": "3d",
+        "Robot, accompagnami alla zona saldatura": "saldatura",
+        "vai alla tagliatrice lasr": "laser",  # Errore di trascrizione
+        "vai al laser?": "laser",  # Imperativo con il punto di domanda aggiunto dalla trascrizione
+        "ritorna alla base": None,  # Nessun target: centro del tavolo
+        "ok, vai alla CNC": "cnc",
+        "cos'è la CNC?": 'bot',  # Nessun verbo di movimento
+        "non andare al laser": 'bot',
+        "no, vai al laser": 'bot',
+        "vai al laser, anzi non andare": 'bot',
+        "non devi mai andare alla CNC": 'bot',
+        "come si usa il laser? vai piano": 'bot',
+        "puoi andare alla stampante 3D?": 'bot',
+        "come va il laser": 'bot',
+        "quando vai alla CNC": 'bot',
+        # Affermazioni con verbi di movimento all'indicativo o parole ambigue
+        "il laser va acceso prima di tagliare": 'bot',
+        "mi piace la porta del laser": 'bot',
+        "il pezzo va nella stampante 3D": 'bot',
+        "ho visto che torna la CNC": 'bot',
+        "la CNC sposta la fresa": 'bot',
+    }
+    failures = 0
+    for utterance, expected in cases.items():
+        target = router.match(utterance)
+        result = 'bot' if target is None else target['key']  # 'bot': la frase va inviata al bot
+        ok = result == expected
+        failures += not ok
+        print(f"{'OK ' if ok else 'ERR'} {utterance!r:45} -> {result!r} (atteso {expected!r})")
+    if failures:
+        raise SystemExit(f"{failures} casi errati")
+    print("Tutti i casi corretti")
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import math
+import threading
+import time
+from typing import Callable
+
+# Bucket predefiniti in secondi, dai pochi millisecondi della visione ai secondi del bot
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    Famiglia di metriche con etichette opzionali. Gli aggiornamenti non prendono lock: in CPython ogni
+    incremento è un'operazione breve sotto GIL, con più thread scrittori si può al più perdere un incremento
+    raro, accettabile per il monitoraggio e senza costi sul ciclo della visione.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()  # Solo per creare un figlio nuovo, non per aggiornarlo
+
+    def labels(self, *values):
+        """Metrica figlia per i valori delle etichette, creata al primo uso"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """(suffisso, etichette, valore) di tutti i figli"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Contatore monotono, il nome deve terminare con _total"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def samples(self):
+        return [('', _format_labels(self.labelnames, key), child.value) for key, child in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    """Valore istantaneo, impostato dal codice o calcolato al momento della lettura da fun"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 fun: Callable[[], float | dict[tuple, float]] | None = None):
+        super().__init__(name, documentation, labelnames)
+        self.fun = fun  # Senza etichette restituisce un numero, con etichette un dizionario {valori etichette: numero}
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def samples(self):
+        if self.fun is None:
+            return [('', _format_labels(self.labelnames, key), child.value) for key, child in list(self._children.items())]
+        try:
+            values = self.fun()
+        except Exception:
+            return []  # Un sottosistema non ancora pronto non deve rompere l'intera pagina /metrics
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            return [('', '', values)]
+        return [('', _format_labels(self.labelnames, key if isinstance(key, tuple) else (key,)), value) for key, value in values.items()]
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def samples(self):
+        samples = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), list(child.counts)):
+                cumulative += count
+                samples.append(('_bucket', _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"'), cumulative))
+            samples.append(('_sum', _format_labels(self.labelnames, key), child.sum))
+            samples.append(('_count', _format_labels(self.labelnames, key), child.count))
+        return samples
+
+
+class RateMeter:
+    """Frequenza degli eventi (es. FPS) su una finestra scorrevole, aggiornata da un solo thread senza lock"""
+
+    def __init__(self, window: float = 2.0):
+        self.window = window
+        self._start = time.perf_counter()
+        self._events = 0
+        self.rate = 0.0
+
+    def tick(self):
+        self._events += 1
+        now = time.perf_counter()
+        elapsed = now - self._start
+        if elapsed >= self.window:
+            self.rate = self._events / elapsed
+            self._start, self._events = now, 0
+
+
+class Registry:
+    """Insieme delle metriche del processo, esportate nel formato testuale di Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None or type(metric) is not cls:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = (), fun=None) -> Gauge:
+        gauge = self._get_or_create(Gauge, name, documentation, labelnames)
+        if fun is not None:
+            gauge.fun = fun  # Un oggetto ricreato (es. nuovo player) sostituisce la funzione di lettura
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Registro condiviso da tutti i sottosistemi del processo
+metrics = Registry()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate
+from typing import Callable
+
+from flask import Response, request
+
+try:
+    import brotli  # Opzionale: senza il pacchetto si servono solo le varianti gzip e non compresse
+except ImportError:
+    brotli = None
+
+
+class CachedPage:
+    """
+    Pagina HTML generata una sola volta e tenuta in memoria, già compressa in gzip (e brotli se disponibile).
+    Viene rigenerata solo quando cambia uno dei file sorgente (controllati al massimo ogni check_interval secondi)
+    o quando viene chiamato invalidate().
+    """
+
+    def __init__(self, render: Callable[[], str], sources: Callable[[], list[str]], check_interval: float = 1.0):
+        self.render = render
+        self.sources = sources  # Funzione che restituisce i file da cui dipende la pagina
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._variants = None  # encoding -> bytes
+        self._etag = None
+        self._last_modified = None
+        self._mtimes = None
+        self._last_check = 0.0
+
+    def _source_mtimes(self) -> tuple:
+        mtimes = []
+        for path in self.sources():
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)  # Anche la comparsa o la scomparsa di un file cambia la pagina
+        return tuple(mtimes)
+
+    def invalidate(self):
+        with self._lock:
+            self._variants = None
+
+    def _build(self, mtimes):
+        body = self.render().encode('utf-8')
+        variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+        self._variants = variants
+        self._etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        self._last_modified = max([m for m in mtimes if m is not None], default=time.time())
+        self._mtimes = mtimes
+
+    def _current(self):
+        """Restituisce varianti, ETag e data di modifica aggiornati, rigenerando la pagina se necessario"""
+        now = time.monotonic()
+        with self._lock:
+            if self._variants is None or now - self._last_check > self.check_interval:
+                self._last_check = now
+                mtimes = self._source_mtimes()
+                if self._variants is None or mtimes != self._mtimes:
+                    self._build(mtimes)
+            return self._variants, self._etag, self._last_modified
+
+    def response(self) -> Response:
+        """Risposta Flask per la richiesta corrente: 304 se il client ha già la pagina, altrimenti la variante compressa accettata"""
+        variants, etag, last_modified = self._current()
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(last_modified, usegmt=True),
+            'Cache-Control': 'no-cache',  # Il browser riusa la sua copia dopo la convalida con ETag
+            'Vary': 'Accept-Encoding',
+        }
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status=304, headers=headers)
+
+        accepted = request.headers.get('Accept-Encoding', '')
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and encoding in accepted:
+                headers['Content-Encoding'] = encoding
+                return Response(variants[encoding], mimetype='text/html', headers=headers)
+        return Response(variants['identity'], mimetype='text/html', headers=headers)
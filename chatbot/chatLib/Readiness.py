@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, Callable
+
+try:
+    from .util import StyleBox, messageBox
+except ImportError:
+    from util import StyleBox, messageBox
+
+PENDING = 'pending'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class _Subsystem:
+    __slots__ = ('name', 'label', 'state', 'detail', 'value', 'started', 'finished', 'ready_event', 'required', 'loader')
+
+    def __init__(self, name: str, label: str, required: bool):
+        self.name = name
+        self.label = label
+        self.required = required  # Se False il sistema è pronto anche senza (es. camera assente)
+        self.state = PENDING
+        self.detail = ''
+        self.value = None
+        self.started = None
+        self.finished = None
+        self.ready_event = threading.Event()
+        self.loader = None  # (loader, args, kwargs) passati a start(), per ripetere il caricamento fallito
+
+
+class Readiness:
+    """
+    Stato di avvio dei sottosistemi (TTS, STT, camera, bot...), caricati in parallelo in thread separati.
+    Ogni sottosistema passa da 'pending' a 'loading' e poi a 'ready' o 'failed'; il sistema è pronto quando
+    lo sono tutti i sottosistemi richiesti; un sottosistema non richiesto e fallito lascia il sistema in modalità degradata.
+    I caricamenti falliti avviati con start() possono essere ripetuti con retry(). Misura il tempo alla prima pagina servita e il tempo alla prontezza,
+    a partire da start_time (di norma l'avvio del processo, prima degli import pesanti).
+    """
+
+    def __init__(self, start_time: float | None = None):
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.time_to_first_page = None
+        self.time_to_ready = None
+        self._subsystems = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.ready_event = threading.Event()
+
+    def register(self, name: str, label: str, required: bool = True):
+        with self._lock:
+            self._subsystems[name] = _Subsystem(name, label, required)
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """listener(snapshot) viene chiamato ad ogni cambio di stato"""
+        self._listeners.append(listener)
+
+    def _notify(self):
+        snapshot = self.snapshot()
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                messageBox("Errore avvio", f"Errore nella notifica dello stato di avvio: {e}", StyleBox.Error)
+
+    def update(self, name: str, state: str | None = None, detail: str | None = None, value: Any = None):
+        """Aggiorna stato e descrizione di un sottosistema"""
+        now = time.perf_counter()
+        with self._lock:
+            subsystem = self._subsystems[name]
+            if state is not None and state != subsystem.state:
+                subsystem.state = state
+                if state == LOADING:
+                    subsystem.started = now
+                    subsystem.finished = None
+                    subsystem.ready_event.clear()
+                elif state in (READY, FAILED):
+                    subsystem.finished = now
+            if detail is not None:
+                subsystem.detail = detail
+            if value is not None:
+                subsystem.value = value
+            if subsystem.state in (READY, FAILED):
+                subsystem.ready_event.set()
+            all_ready = all(s.state == READY or (not s.required and s.state == FAILED) for s in self._subsystems.values())
+            became_ready = all_ready and self.time_to_ready is None
+            if became_ready:
+                self.time_to_ready = now - self.start_time
+        if became_ready:
+            self.ready_event.set()
+            messageBox("Avvio completato", "\n".join(f"{s['label']}: {s['state']} in {s['seconds']:.1f} s" for s in self.snapshot()['subsystems'])
+                       + f"\n└─▶ Sistema pronto in {self.time_to_ready:.1f} s", StyleBox.Bold)
+        self._notify()
+
+    def start(self, name: str, loader: Callable[..., Any], *args, **kwargs) -> threading.Thread:
+        """
+        Carica il sottosistema in un thread: il valore restituito da loader viene memorizzato e il sottosistema
+        segnato come pronto, un'eccezione lo segna come fallito. loader può chiamare update() per riportare l'avanzamento.
+        """
+
+        with self._lock:
+            self._subsystems[name].loader = (loader, args, kwargs)
+
+        def run():
+            self.update(name, LOADING)
+            try:
+                value = loader(*args, **kwargs)
+            except Exception as e:
+                messageBox(f"Errore avvio {name}", f"{e}\n{traceback.format_exc()}", StyleBox.Error)
+                self.update(name, FAILED, detail=str(e))
+                return
+            self.update(name, READY, detail='', value=value)
+
+        thread = threading.Thread(target=run, daemon=True, name=f"startup-{name}")
+        thread.start()
+        return thread
+
+    def retry(self, name: str) -> bool:
+        """Ripete il caricamento di un sottosistema fallito avviato con start(); False se non è ripetibile"""
+        with self._lock:
+            subsystem = self._subsystems.get(name)
+            if subsystem is None or subsystem.state != FAILED or subsystem.loader is None:
+                return False
+            subsystem.state = PENDING  # Evita che due richieste ravvicinate avviino due caricamenti
+            subsystem.ready_event.clear()
+            loader, args, kwargs = subsystem.loader
+        messageBox("Avvio", f"Nuovo tentativo di caricamento: {subsystem.label}", StyleBox.Light)
+        self.start(name, loader, *args, **kwargs)
+        return True
+
+    def get(self, name: str) -> Any:
+        """Valore del sottosistema se pronto, altrimenti None"""
+        subsystem = self._subsystems.get(name)
+        return subsystem.value if subsystem is not None and subsystem.state == READY else None
+
+    def wait(self, name: str, timeout: float | None = None) -> Any:
+        """Attende il sottosistema e ne restituisce il valore, None se fallito o in timeout"""
+        self._subsystems[name].ready_event.wait(timeout=timeout)
+        return self.get(name)
+
+    def is_ready(self) -> bool:
+        return self.ready_event.is_set()
+
+    def page_served(self):
+        """Da chiamare quando il server risponde alla prima pagina"""
+        if self.time_to_first_page is None:
+            self.time_to_first_page = time.perf_counter() - self.start_time
+            messageBox("Avvio", f"Prima pagina servita dopo {self.time_to_first_page:.2f} s", StyleBox.Light)
+
+    def snapshot(self) -> dict:
+        now = time.perf_counter()
+        with self._lock:
+            subsystems = [{
+                'name': s.name,
+                'label': s.label,
+                'state': s.state,
+                'detail': s.detail,
+                'required': s.required,
+                'retryable': s.state == FAILED and s.loader is not None,
+                'seconds': ((s.finished or now) - s.started) if s.started is not None else 0.0,
+            } for s in self._subsystems.values()]
+        return {
+            'ready': self.is_ready(),
+            'elapsed': now - self.start_time,
+            'time_to_first_page': self.time_to_first_page,
+            'time_to_ready': self.time_to_ready,
+            'degraded': [s['label'] for s in subsystems if s['state'] == FAILED and not s['required']],
+            'subsystems': subsystems,
+        }
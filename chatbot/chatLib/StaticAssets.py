@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # Opzionale: senza il pacchetto si servono solo le varianti gzip e non compresse
+except ImportError:
+    brotli = None
+
+# Estensioni testuali che vale la pena comprimere, immagini e audio sono già compressi
+_COMPRESSIBLE = ('.css', '.js', '.html', '.svg', '.json', '.txt', '.map', '.ico')
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+# Riferimenti alle risorse locali nelle pagine HTML: href="/css/x.css", src="/js/x.js"
+_ASSET_REF = re.compile(r'(href|src)="/((?:css|js|libs|images)/[^"?#]+)"')
+
+
+class StaticAssets:
+    """
+    Risorse statiche del frontend servite con hash del contenuto e varianti precompresse.
+    Le pagine HTML puntano a "/js/script.js?v=<hash>": se la versione richiesta coincide con quella attuale
+    la risposta è marcata immutabile e il browser non la richiede più, altrimenti viene convalidata con l'ETag.
+    Le varianti .gz (e .br se è installato brotli) sono scritte una volta in cache_dir e rigenerate quando
+    il file originale è più recente.
+    """
+
+    def __init__(self, root: str, cache_dir: str, min_size: int = 512):
+        self.root = os.path.abspath(root)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.min_size = min_size  # Sotto questa dimensione la compressione non ripaga
+        self._hashes = {}  # percorso relativo -> (mtime, dimensione, hash)
+        self._lock = threading.Lock()
+
+    def files(self) -> list[str]:
+        """Percorsi assoluti di tutte le risorse servite"""
+        paths = []
+        for folder, _, names in os.walk(self.root):
+            paths.extend(os.path.join(folder, name) for name in names)
+        return paths
+
+    def version(self, rel: str) -> str | None:
+        """Hash del contenuto del file, ricalcolato solo se cambia data di modifica o dimensione"""
+        path = safe_join(self.root, rel)
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        with self._lock:
+            cached = self._hashes.get(rel)
+            if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+                return cached[2]
+        with open(path, 'rb') as file:
+            digest = hashlib.sha1(file.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[rel] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def url(self, rel: str) -> str:
+        digest = self.version(rel)
+        return f'/{rel}?v={digest}' if digest else f'/{rel}'
+
+    def versioned_html(self, html: str) -> str:
+        """Aggiunge l'hash del contenuto ai riferimenti alle risorse locali della pagina"""
+        return _ASSET_REF.sub(lambda m: f'{m.group(1)}="{self.url(m.group(2))}"', html)
+
+    def _variant(self, rel: str, path: str, encoding: str) -> str | None:
+        """Percorso della variante compressa, generata se manca o è più vecchia del file originale"""
+        if not path.endswith(_COMPRESSIBLE) or os.path.getsize(path) < self.min_size:
+            return None
+        if encoding == 'br' and brotli is None:
+            return None
+        target = os.path.join(self.cache_dir, rel + ('.br' if encoding == 'br' else '.gz'))
+        if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+            with open(path, 'rb') as file:
+                data = file.read()
+            data = brotli.compress(data, quality=11) if encoding == 'br' else gzip.compress(data, compresslevel=9)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f'{target}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as file:
+                file.write(data)
+            os.replace(tmp, target)  # Scrittura atomica: una richiesta concorrente non legge mai un file a metà
+        return target
+
+    def precompress(self) -> int:
+        """Genera all'avvio tutte le varianti compresse, restituisce il numero di file compressi"""
+        count = 0
+        for path in self.files():
+            rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+            for encoding in ('gzip', 'br'):
+                if self._variant(rel, path, encoding):
+                    count += 1
+        return count
+
+    def send(self, rel: str):
+        """Risposta Flask per la risorsa: variante compressa accettata dal browser, cache immutabile se la versione è attuale"""
+        path = safe_join(self.root, rel)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        digest = self.version(rel)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        # Le richieste parziali vengono servite sul file originale, gli offset si riferiscono al contenuto non compresso
+        file_path, encoding = path, None
+        if 'Range' not in request.headers:
+            accepted = request.headers.get('Accept-Encoding', '')
+            for candidate in ('br', 'gzip'):
+                if candidate in accepted:
+                    variant = self._variant(rel, path, candidate)
+                    if variant:
+                        file_path, encoding = variant, candidate
+                        break
+
+        response = send_file(file_path, mimetype=mimetype, conditional=True,
+                             etag=f'{digest}-{encoding}' if encoding else digest, last_modified=os.path.getmtime(path))
+        response.headers['Cache-Control'] = _IMMUTABLE if digest and request.args.get('v') == digest else 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
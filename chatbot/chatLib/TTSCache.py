@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger('ifab.tts')
+
+
+class TTSCache:
+    """
+    Cache LRU dell'audio PCM sintetizzato dal TTS.
+    Le voci vivono in memoria entro un budget in byte, quelle espulse (e quelle nuove se è
+    configurata una cartella) vengono salvate su disco e ricaricate in memoria al primo accesso.
+    """
+
+    def __init__(self, max_memory_bytes: int = 64 * 1024 ** 2, cache_dir: str | None = None, max_disk_bytes: int = 512 * 1024 ** 2):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = cache_dir
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._mem = OrderedDict()  # key -> bytes PCM, ordinati dal meno al più recentemente usato
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+
+        # Statistiche di utilizzo
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, voice_id: str, params: dict | None = None) -> str:
+        """Chiave della cache: testo normalizzato (spazi compattati), modello vocale e parametri di sintesi"""
+        normalized = " ".join(text.split())
+        payload = json.dumps({'text': normalized, 'voice': voice_id, 'params': params or {}}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def get(self, key: str) -> bytes | None:
+        """Restituisce il PCM associato alla chiave, o None se non presente"""
+        with self._lock:
+            pcm = self._mem.get(key)
+            if pcm is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return pcm
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    pcm = f.read()
+                os.utime(path)  # Aggiorna la data di accesso per l'espulsione LRU su disco
+            except FileNotFoundError:
+                pcm = None  # Frase mai salvata su disco, caso normale
+            except OSError as e:
+                log.warning("Errore nella lettura della cache TTS da disco: %s", e)
+                pcm = None
+            if pcm is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._store_memory(key, pcm)
+                return pcm
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._mem:
+                return True
+        return bool(self.cache_dir) and os.path.exists(self._disk_path(key))
+
+    def put(self, key: str, pcm: bytes):
+        """Inserisce il PCM in cache, salvandolo anche su disco se configurato"""
+        if not pcm:
+            return
+        with self._lock:
+            self._store_memory(key, pcm)
+        if self.cache_dir:
+            self._store_disk(key, pcm)
+
+    def _store_memory(self, key: str, pcm: bytes):
+        """Inserisce in memoria ed espelle le voci meno usate oltre il budget, da chiamare con self._lock acquisito"""
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old)
+        if len(pcm) > self.max_memory_bytes:
+            return  # Troppo grande per la memoria, rimane solo su disco
+        self._mem[key] = pcm
+        self._mem_bytes += len(pcm)
+        while self._mem_bytes > self.max_memory_bytes:
+            evicted_key, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted)
+            if self.cache_dir and not os.path.exists(self._disk_path(evicted_key)):
+                self._store_disk(evicted_key, evicted)
+
+    def _store_disk(self, key: str, pcm: bytes):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(pcm)
+            os.replace(tmp_path, path)  # Scrittura atomica, un lettore non vede mai file parziali
+        except OSError as e:
+            log.warning("Errore nel salvataggio della cache TTS su disco: %s", e)
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        """Elimina i file meno recentemente usati oltre il budget su disco"""
+        try:
+            entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.pcm')]
+            entries = [(os.path.getmtime(p), os.path.getsize(p), p) for p in entries]
+        except OSError as e:
+            log.warning("Errore nella lettura della cartella della cache TTS: %s", e)
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                log.warning("Errore nell'eliminazione di %s dalla cache TTS: %s", path, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._mem),
+                'memory_bytes': self._mem_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
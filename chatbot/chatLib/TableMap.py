@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+import time
+from typing import Callable
+
+# Namespace Socket.IO della mappa: separato dalla chat, i browser che guardano la mappa non aprono conversazioni
+NAMESPACE = '/table'
+
+
+class TableMapStream:
+    """
+    Mappa 2D del tavolo per il frontend, alimentata dagli snapshot della visione.
+    Ai browser collegati viene inviato solo ciò che è cambiato rispetto all'ultimo invio: marker spostati oltre
+    una soglia, marker comparsi, marker non più visti da stale_after secondi e il target corrente del robot.
+    Gli invii sono limitati a 'rate' al secondo; senza browser collegati gli snapshot vengono ignorati.
+
+    Eventi emessi sul namespace '/table':
+        'table-init'  {'table': {...}, 'targets': {...}, 'markers': {...}, 'target': ...}  alla connessione e al cambio di configurazione
+        'table-delta' {'seq', 'upd': {chiave: [x, y, theta]}, 'del': [chiavi], 'target'?}  solo se qualcosa è cambiato
+    """
+
+    def __init__(self, socketio, rate: float = 10.0, position_epsilon: float = 0.003, angle_epsilon: float = 0.02,
+                 stale_after: float = 2.0, target_fun: Callable[[], str | None] | None = None):
+        self.socketio = socketio
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self.position_epsilon = position_epsilon  # Metri
+        self.angle_epsilon = angle_epsilon  # Radianti
+        self.stale_after = stale_after
+        self.target_fun = target_fun  # Chiave del target corrente del robot, per disegnare il percorso
+        self.viewers = 0
+        self._table = {}
+        self._targets = {}
+        self._sent = {}  # chiave -> [x, y, theta] come visto dai browser
+        self._seen = {}  # chiave -> istante dell'ultimo avvistamento
+        self._target = None
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def set_table(self, width: float, height: float, bounds: tuple, targets: dict[str, str]):
+        """Geometria del tavolo, area raggiungibile e nomi dei target (chiave -> testo), reinviati ai browser collegati"""
+        with self._lock:
+            self._table = {'width': width, 'height': height, 'bounds': list(bounds)}
+            self._targets = dict(targets)
+        if self.viewers:
+            self.socketio.emit('table-init', self.keyframe(), namespace=NAMESPACE)
+
+    def keyframe(self) -> dict:
+        """Stato completo, per un browser appena collegato"""
+        with self._lock:
+            return {'table': self._table, 'targets': self._targets, 'markers': dict(self._sent), 'target': self._target}
+
+    def connect(self, sid):
+        self.viewers += 1
+        self.socketio.emit('table-init', self.keyframe(), namespace=NAMESPACE, to=sid)
+
+    def disconnect(self):
+        self.viewers = max(0, self.viewers - 1)
+
+    @staticmethod
+    def _pose(marker: dict) -> list:
+        # Millimetri e centesimi di radiante bastano alla mappa e accorciano il JSON
+        return [round(marker['position'][0], 3), round(marker['position'][1], 3), round(marker['angle'], 2)]
+
+    def _changed(self, old: list, new: list) -> bool:
+        angle = abs((new[2] - old[2] + math.pi) % (2 * math.pi) - math.pi)
+        return math.dist(old[:2], new[:2]) > self.position_epsilon or angle > self.angle_epsilon
+
+    def update(self, snapshot):
+        """Sottoscrittore del bus dello stato del tavolo: calcola e invia la differenza, al massimo 'rate' volte al secondo"""
+        if not self.viewers:
+            return
+        wait = self._last_emit + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)  # Nel thread del sottoscrittore: intanto il bus conserva solo lo snapshot più recente
+            return
+
+        now = time.monotonic()
+        state = snapshot.state
+        markers = dict(state.get('markers', {}))
+        if state.get('robot'):
+            markers['robot'] = state['robot']
+
+        upd = {}
+        with self._lock:
+            for key, marker in markers.items():
+                pose = self._pose(marker)
+                self._seen[key] = now
+                old = self._sent.get(key)
+                if old is None or self._changed(old, pose):
+                    upd[key] = self._sent[key] = pose
+            removed = [key for key, seen in self._seen.items() if now - seen > self.stale_after]
+            for key in removed:
+                del self._seen[key]
+                self._sent.pop(key, None)
+            delta = {'seq': snapshot.seq, 'upd': upd, 'del': removed}
+            target = self.target_fun() if self.target_fun else None
+            if target != self._target:
+                self._target = delta['target'] = target
+
+        self._last_emit = now
+        if upd or removed or 'target' in delta:
+            self.socketio.emit('table-delta', delta, namespace=NAMESPACE)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Interazione in corso nel thread/task corrente, le span senza trace_id esplicito vengono attribuite a questa
+_current_trace = contextvars.ContextVar('ifab_trace', default=None)
+
+
+def current_trace() -> str | None:
+    return _current_trace.get()
+
+
+class Span:
+    """Intervallo di tempo di una fase dell'interazione, chiuso con end() o all'uscita dal blocco with"""
+    __slots__ = ('tracer', 'name', 'trace_id', 'start', 'end_time', 'thread', 'args')
+
+    def __init__(self, tracer, name: str, trace_id: str | None, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.start = time.perf_counter()
+        self.end_time = None
+        self.thread = threading.current_thread().name
+        self.args = args
+
+    def end(self, **args):
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        self.args.update(args)
+        if self.trace_id is not None:
+            self.tracer._append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = repr(exc)
+        self.end()
+        return False
+
+
+class Tracer:
+    """
+    Tracciamento leggero delle interazioni microfono -> bot -> TTS -> robot.
+    Ogni interazione ha un trace_id, le fasi registrano span in un buffer circolare in memoria
+    esportabile nel formato Chrome trace (chrome://tracing, Perfetto): un processo per interazione,
+    una riga per thread, così il percorso critico è visibile a colpo d'occhio.
+    Le span senza interazione attiva non vengono registrate, i percorsi ad alta frequenza (visione) non pagano nulla.
+    """
+
+    def __init__(self, capacity: int = 4096, max_traces: int = 256):
+        self.enabled = True
+        self._events = deque(maxlen=capacity)  # Span concluse, le più vecchie vengono scartate
+        self._traces = OrderedDict()  # trace_id -> (nome, istante di inizio, argomenti)
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+
+    def new_trace(self, name: str, **args) -> str | None:
+        """Apre una nuova interazione, da rendere attiva con use()"""
+        if not self.enabled:
+            return None
+        trace_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._traces[trace_id] = (name, time.perf_counter(), args)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace_id
+
+    @contextmanager
+    def use(self, trace_id: str | None):
+        """Rende attiva l'interazione nel blocco, per i thread e le callback che non ereditano il contesto"""
+        token = _current_trace.set(trace_id)
+        try:
+            yield trace_id
+        finally:
+            _current_trace.reset(token)
+
+    def span(self, name: str, trace_id: str | None = None, **args) -> Span:
+        """Span che parte ora, da usare con with o da chiudere con end()"""
+        return Span(self, name, trace_id if trace_id is not None else _current_trace.get(), args)
+
+    def record(self, name: str, start: float, end: float, trace_id: str | None = None, **args):
+        """Registra una span già misurata, start ed end in secondi di time.perf_counter()"""
+        span = Span(self, name, trace_id if trace_id is not None else _current_trace.get(), args)
+        span.start, span.end_time = start, end
+        if span.trace_id is not None:
+            self._append(span)
+
+    def _append(self, span: Span):
+        if self.enabled:
+            with self._lock:
+                self._events.append(span)
+
+    def spans(self, trace_id: str | None = None) -> list[Span]:
+        with self._lock:
+            return [span for span in self._events if trace_id is None or span.trace_id == trace_id]
+
+    def summary(self, trace_id: str) -> dict:
+        """Durata di ogni fase dell'interazione in millisecondi, in ordine di inizio"""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+        spans = sorted(self.spans(trace_id), key=lambda span: span.start)
+        if trace is None or not spans:
+            return {}
+        origin = trace[1]
+        return {
+            'trace_id': trace_id,
+            'name': trace[0],
+            'total_ms': (max(span.end_time for span in spans) - origin) * 1000,
+            'stages': [{'name': span.name, 'offset_ms': (span.start - origin) * 1000,
+                        'duration_ms': (span.end_time - span.start) * 1000} for span in spans],
+        }
+
+    def chrome_trace(self, trace_id: str | None = None) -> dict:
+        """Esporta le span nel formato JSON di Chrome trace"""
+        with self._lock:
+            traces = dict(self._traces)
+        spans = self.spans(trace_id)
+        pids = {}  # trace_id -> pid del processo che rappresenta l'interazione
+        tids = {}  # (pid, nome del thread) -> tid
+        events = []
+        for span in spans:
+            if span.trace_id not in pids:
+                pid = pids[span.trace_id] = len(pids) + 1
+                name, _, args = traces.get(span.trace_id, ('interazione', None, {}))
+                label = f"{name} {span.trace_id}" + (f" ({args['text'][:40]})" if 'text' in args else '')
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': label}})
+            pid = pids[span.trace_id]
+            if (pid, span.thread) not in tids:
+                tid = tids[(pid, span.thread)] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': span.thread}})
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': span.start * 1e6,
+                'dur': (span.end_time - span.start) * 1e6,
+                'pid': pid,
+                'tid': tids[(pid, span.thread)],
+                'args': {'trace_id': span.trace_id, **{key: str(value) for key, value in span.args.items()}},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'host_pid': os.getpid()}}
+
+
+# Istanza condivisa da tutti i sottosistemi del processo
+tracer = Tracer()
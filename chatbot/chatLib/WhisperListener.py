@@ -2,15 +2,25 @@ import argparse
 import atexit
 import multiprocessing
 import os
+import threading
+import time
 import uuid
+from collections import deque
 from typing import Callable
 
-import torch
+# torch e whisperx vengono importati solo dove servono (nei processi worker), il processo principale parte senza caricarli
+try:
+    from .Metrics import metrics
+    from .Tracer import tracer
+except ImportError:
+    from Metrics import metrics
+    from Tracer import tracer
 
 
 # Sposta funzioni al livello principale del modulo
 def get_available_gpu() -> tuple[str, int]:
     """Verifica le GPU disponibili e restituisce l'indice della GPU con più memoria disponibile"""
+    import torch
     if not torch.cuda.is_available():
         print("ATTENZIONE: GPU non disponibile, utilizzo CPU")
         return "cpu", 0
@@ -43,7 +53,8 @@ def get_available_gpu() -> tuple[str, int]:
 
 
 class WhisperListener:
-    def __init__(self, model='large-v3', device='auto', compute_type='float32', batch_size=16, language='it', gpu_idx=None):
+    def __init__(self, model='large-v3', device='auto', compute_type='float32', batch_size=16, language='it', gpu_idx=None, threads=4):
+        import torch
         import whisperx
 
         self.model = model
@@ -72,7 +83,7 @@ class WhisperListener:
         self.language = language
 
         print(f"Carico/Scarico il modello '{self.model}' in '{self.device}' con '{self.compute_type}'")
-        self.model_obj = whisperx.load_model(self.model, self.device, self.gpu_idx, compute_type=self.compute_type, threads=4, language=self.language)
+        self.model_obj = whisperx.load_model(self.model, self.device, self.gpu_idx, compute_type=self.compute_type, threads=threads, language=self.language)
         print(f"└─▶ Caricamento del modello completato")
 
     def transcribe(self, audio_file) -> dict:
@@ -95,12 +106,54 @@ class WhisperListener:
 
 
 # Funzioni separate per il multiprocessing
-def wisperx_process_worker(input_queue, response_dict, condition, ready_event, model, device, compute_type, batch_size, language, gpu_idx):
+def parse_cpu_sets(spec: str | None, workers: int) -> list[list[int] | None]:
+    """
+    Converte la specifica dei core da riga di comando in una lista di CPU set, uno per worker.
+
+    Args:
+        spec: Stringa del tipo "0-3;4-7" (un gruppo per worker, separati da ';', core separati da ',' o intervalli 'a-b')
+        workers: Numero di worker totali, se i gruppi sono meno dei worker vengono riutilizzati ciclicamente
+
+    Returns:
+        list: Lista di liste di core, oppure None per i worker senza affinità
+    """
+    if not spec:
+        return [None] * workers
+    cpu_sets = []
+    for group in spec.split(';'):
+        cpus = []
+        for part in group.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                first, last = part.split('-', 1)
+                cpus.extend(range(int(first), int(last) + 1))
+            else:
+                cpus.append(int(part))
+        if cpus:
+            cpu_sets.append(sorted(set(cpus)))
+    if not cpu_sets:
+        return [None] * workers
+    return [cpu_sets[i % len(cpu_sets)] for i in range(workers)]
+
+
+def wisperx_process_worker(worker_idx, input_queue, response_dict, condition, ready_event, cpu_set,
+                           model, device, compute_type, batch_size, language, gpu_idx):
     """Funzione per il processo figlio che esegue l'analisi del file audio"""
     try:
+        import torch
+        # Vincola il processo ai core assegnati, così i worker non si contendono le stesse CPU
+        threads = 4
+        if cpu_set:
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpu_set)
+            threads = len(cpu_set)
+            torch.set_num_threads(threads)
+
         # Creiamo l'oggetto WhisperListener qui dentro il processo
         wL = WhisperListener(model=model, device=device, compute_type=compute_type,
-                             batch_size=batch_size, language=language, gpu_idx=gpu_idx)
+                             batch_size=batch_size, language=language, gpu_idx=gpu_idx, threads=threads)
         # Segnala che il modello è stato caricato con successo
         ready_event.set()
 
@@ -109,117 +162,308 @@ def wisperx_process_worker(input_queue, response_dict, condition, ready_event, m
             if request is None:
                 break
             file_path, request_id = request
-            result = wL.transcribeText(file_path)
+            start_time = time.perf_counter()  # Orologio monotono di sistema, confrontabile con quello del processo principale
+            try:
+                result = wL.transcribeText(file_path)
+            except Exception as e:
+                # Un file corrotto non deve abbattere il worker, rispondiamo con None come "nessuna trascrizione"
+                print(f"[STT worker {worker_idx}] Errore durante la trascrizione di '{file_path}': {e}")
+                result = None
             with condition:
+                response_dict[f"__timing__{request_id}"] = (start_time, time.perf_counter())
                 response_dict[request_id] = result
                 condition.notify_all()
     except Exception as e:
-        # In caso di errore, imposta l'errore nel dizionario condiviso e segnala l'evento
+        # In caso di errore, imposta l'errore nel dizionario condiviso, il supervisore del pool se ne occuperà
         with condition:
-            response_dict["__error__"] = str(e)
-            ready_event.set()
+            response_dict[f"__error__{worker_idx}"] = str(e)
             condition.notify_all()
 
 
-def thread_function(input_queue, response_dict, condition, file_path) -> str:
-    """Funzione per gestire la comunicazione tra il processo principale e il processo figlio"""
-    request_id = str(uuid.uuid4())  # Converti UUID a stringa per sicurezza
-    input_queue.put((file_path, request_id))
-    with condition:
-        condition.wait_for(lambda: request_id in response_dict)
-    return response_dict.pop(request_id)
+class _WhisperWorker:
+    """Stato lato processo principale di un singolo worker WhisperX"""
 
+    def __init__(self, idx: int, cpu_set: list[int] | None, standby: bool):
+        self.idx = idx
+        self.cpu_set = cpu_set
+        self.standby = standby  # Worker di riserva con modello già caricato, usato solo se mancano worker attivi
+        self.process = None
+        self.input_queue = None
+        self.ready_event = None
+        self.inflight = {}  # request_id -> file_path delle richieste assegnate e non ancora concluse
+        self.restarts = 0  # Riavvii totali, solo per diagnostica
+        self.restart_times = deque()  # Istanti dei riavvii recenti, per il limite nella finestra temporale
+        self.failed = False
+        self.spawn_time = 0.0
+        self.ready_time = None
 
-def wisperx_process_worker(input_queue, response_dict, condition, ready_event, model, device, compute_type, batch_size, language, gpu_idx):
-    """Funzione per il processo figlio che esegue l'analisi del file audio"""
-    try:
-        # Creiamo l'oggetto WhisperListener qui dentro il processo
-        wL = WhisperListener(model=model, device=device, compute_type=compute_type,
-                             batch_size=batch_size, language=language, gpu_idx=gpu_idx)
-        # Segnala che il modello è stato caricato con successo
-        ready_event.set()
+    def is_ready(self) -> bool:
+        return not self.failed and self.process is not None and self.process.is_alive() and self.ready_event.is_set()
 
+
+class WhisperWorkerPool:
+    """
+    Pool di processi WhisperX: dispatch delle richieste al worker meno carico,
+    riavvio automatico dei worker morti e worker di riserva pronti a subentrare.
+    """
+
+    def __init__(self, workers=1, standby=0, cpu_sets=None, max_restarts=3, restart_window=600.0, monitor_interval=1.0,
+                 transcribe_timeout=120.0, **model_kwargs):
+        if workers < 1:
+            raise ValueError("Il pool STT richiede almeno un worker")
+        self.model_kwargs = model_kwargs
+        # Attesa massima di una trascrizione: oltre, il worker è considerato bloccato e viene terminato (None per attendere senza limite)
+        self.transcribe_timeout = transcribe_timeout
+        # Un worker viene disabilitato solo se muore più di max_restarts volte in restart_window secondi:
+        # pochi crash sporadici in giorni di esposizione non devono spegnere la trascrizione
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.monitor_interval = monitor_interval
+
+        # Strutture condivise fra tutti i worker per la restituzione dei risultati
+        self.manager = multiprocessing.Manager()
+        self.response_dict = self.manager.dict()
+        self.condition = self.manager.Condition()
+        self.ctx = multiprocessing.get_context('spawn')
+
+        self._lock = threading.Lock()
+        self._owner = {}  # request_id -> worker che la sta elaborando
+        self._running = True
+
+        total = workers + standby
+        cpu_sets = cpu_sets if cpu_sets is not None else [None] * total
+        self.workers = [_WhisperWorker(i, cpu_sets[i % len(cpu_sets)], standby=i >= workers) for i in range(total)]
+
+        # Metriche: richieste in attesa o in elaborazione e durata complessiva di ogni trascrizione.
+        # Il gauge è registrato dopo self.workers, così uno scrape concorrente non trova l'attributo mancante
+        metrics.gauge('ifab_stt_queue_depth', "Trascrizioni in coda o in elaborazione nei worker STT",
+                      fun=lambda: sum(len(worker.inflight) for worker in self.workers))
+        self.latency = metrics.histogram('ifab_stt_seconds', "Durata di una trascrizione, dall'invio al worker alla risposta")
+
+        for worker in self.workers:
+            self._spawn(worker)
+
+        self._monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        self._monitor_thread.start()
+
+    def _spawn(self, worker: _WhisperWorker):
+        """Avvia (o riavvia) il processo di un worker con una coda di input nuova"""
+        worker.input_queue = self.manager.Queue()
+        worker.ready_event = self.manager.Event()
+        worker.ready_time = None
+        worker.spawn_time = time.time()
+        kw = self.model_kwargs
+        worker.process = self.ctx.Process(
+            target=wisperx_process_worker,
+            args=(worker.idx, worker.input_queue, self.response_dict, self.condition, worker.ready_event, worker.cpu_set,
+                  kw.get('model', 'large-v3'), kw.get('device', 'auto'), kw.get('compute_type', 'float32'),
+                  kw.get('batch_size', 16), kw.get('language', 'it'), kw.get('gpu_idx'))
+        )
+        worker.process.daemon = True  # Assicura che il processo figlio termini quando il processo padre termina
+        worker.process.start()
+
+    def _pick_worker(self) -> _WhisperWorker | None:
+        """Sceglie il worker meno carico: prima gli attivi pronti, poi le riserve pronte, infine qualunque worker vivo"""
+        alive = [w for w in self.workers if not w.failed]
+        for candidates in ([w for w in alive if not w.standby and w.is_ready()],
+                           [w for w in alive if w.is_ready()],
+                           alive):
+            if candidates:
+                return min(candidates, key=lambda w: len(w.inflight))
+        return None
+
+    def _dispatch(self, request_id: str, file_path: str) -> bool:
+        """Assegna la richiesta ad un worker, da chiamare con self._lock acquisito"""
+        worker = self._pick_worker()
+        if worker is None:
+            return False
+        worker.inflight[request_id] = file_path
+        self._owner[request_id] = worker
+        worker.input_queue.put((file_path, request_id))
+        return True
+
+    def _reply(self, request_id: str, result):
+        with self.condition:
+            self.response_dict[request_id] = result
+            self.condition.notify_all()
+
+    def _monitor(self):
+        """Supervisore: rileva worker morti, li riavvia e ridistribuisce le richieste rimaste in sospeso"""
+        while self._running:
+            time.sleep(self.monitor_interval)
+            with self._lock:
+                if not self._running:
+                    break
+                for worker in self.workers:
+                    if worker.ready_time is None and worker.ready_event is not None and worker.ready_event.is_set():
+                        worker.ready_time = time.time()
+                    if worker.failed or worker.process.is_alive():
+                        continue
+
+                    error = self.response_dict.pop(f"__error__{worker.idx}", None)
+                    print(f"ATTENZIONE: worker STT {worker.idx} terminato (exit code {worker.process.exitcode})" + (f": {error}" if error else ""))
+                    pending = worker.inflight
+                    worker.inflight = {}
+
+                    now = time.time()
+                    while worker.restart_times and now - worker.restart_times[0] > self.restart_window:
+                        worker.restart_times.popleft()
+                    if len(worker.restart_times) < self.max_restarts:
+                        worker.restart_times.append(now)
+                        worker.restarts += 1
+                        # Se muore un worker attivo e c'è una riserva pronta, la riserva subentra subito
+                        if not worker.standby:
+                            spare = next((w for w in self.workers if w.standby and w.is_ready()), None)
+                            if spare is not None:
+                                spare.standby, worker.standby = False, True
+                                print(f"└─▶ Worker STT di riserva {spare.idx} promosso ad attivo")
+                        print(f"└─▶ Riavvio worker STT {worker.idx} (tentativo {len(worker.restart_times)}/{self.max_restarts} "
+                              f"negli ultimi {self.restart_window:.0f} s, {worker.restarts} in totale)")
+                        self._spawn(worker)
+                    else:
+                        worker.failed = True
+                        print(f"└─▶ Worker STT {worker.idx} disabilitato dopo {self.max_restarts} riavvii in {self.restart_window:.0f} s")
+
+                    # Le richieste perse vengono ridistribuite, o chiuse con None se non resta nessun worker
+                    for request_id, file_path in pending.items():
+                        self._owner.pop(request_id, None)
+                        if not self._dispatch(request_id, file_path):
+                            self._reply(request_id, None)
+
+    def transcribe(self, file_path: str) -> str | None:
+        """Invia il file al worker meno carico e attende la trascrizione"""
+        request_id = str(uuid.uuid4())  # Converti UUID a stringa per sicurezza
+        dispatch_time = time.perf_counter()
+        with self._lock:
+            if not self._dispatch(request_id, file_path):
+                print("Nessun worker STT disponibile")
+                return None
+        with self.condition:
+            replied = self.condition.wait_for(lambda: request_id in self.response_dict, timeout=self.transcribe_timeout)
+        with self._lock:
+            worker = self._owner.pop(request_id, None)
+            if worker is not None:
+                worker.inflight.pop(request_id, None)
+            if not replied and worker is not None and worker.process.is_alive():
+                # Worker vivo ma bloccato: terminandolo il supervisore lo riavvia e ridistribuisce le altre richieste assegnate
+                print(f"ATTENZIONE: worker STT {worker.idx} senza risposta da {self.transcribe_timeout:.0f} s, terminato")
+                worker.process.terminate()
+        if not replied:
+            # Una risposta arrivata mentre il worker veniva terminato non deve restare nel dizionario condiviso
+            self.response_dict.pop(f"__timing__{request_id}", None)
+            self.response_dict.pop(request_id, None)
+            return None
+        self.latency.observe(time.perf_counter() - dispatch_time)
+        timing = self.response_dict.pop(f"__timing__{request_id}", None)
+        if timing is not None:
+            # Attesa in coda del worker e inferenza vera e propria, per capire se servono più worker o un modello più piccolo
+            tracer.record('stt.queue', dispatch_time, timing[0], worker=worker.idx if worker is not None else None)
+            tracer.record('stt.inference', timing[0], timing[1], worker=worker.idx if worker is not None else None)
+        return self.response_dict.pop(request_id)
+
+    def worker_status(self) -> list[dict]:
+        """Restituisce lo stato di ogni worker per diagnostica"""
+        with self._lock:
+            return [{
+                'worker': w.idx,
+                'pid': w.process.pid if w.process else None,
+                'cpus': w.cpu_set,
+                'standby': w.standby,
+                'alive': w.process is not None and w.process.is_alive(),
+                'ready': w.is_ready(),
+                'failed': w.failed,
+                'inflight': len(w.inflight),
+                'restarts': w.restarts,
+            } for w in self.workers]
+
+    def wait_ready(self, timeout=300, progress: Callable[[int, int], None] | None = None) -> bool:
+        """
+        Attende il caricamento del modello in tutti i worker, riportando quando ognuno è pronto.
+        progress(pronti, totale) viene chiamata ogni volta che un worker completa il caricamento.
+
+        Returns:
+            bool: True se tutti i worker non disabilitati sono pronti, False in caso di timeout o nessun worker valido
+        """
+        deadline = time.time() + timeout
+        reported = set()
         while True:
-            request = input_queue.get()
-            if request is None:
-                break
-            file_path, request_id = request
-            result = wL.transcribeText(file_path)
-            with condition:
-                response_dict[request_id] = result
-                condition.notify_all()
-    except Exception as e:
-        # In caso di errore, imposta l'errore nel dizionario condiviso e segnala l'evento
-        with condition:
-            response_dict["__error__"] = str(e)
-            ready_event.set()
-            condition.notify_all()
+            for worker in self.workers:
+                if worker.idx not in reported and worker.is_ready():
+                    reported.add(worker.idx)
+                    role = "riserva" if worker.standby else "attivo"
+                    cpus = f"CPU {worker.cpu_set}" if worker.cpu_set else "CPU non vincolate"
+                    print(f"└─▶ Worker STT {worker.idx} ({role}, {cpus}) pronto in {time.time() - worker.spawn_time:.1f} s")
+                    if progress is not None:
+                        progress(len(reported), len([w for w in self.workers if not w.failed]))
+            pending = [w for w in self.workers if not w.failed and w.idx not in reported]
+            if not pending:
+                return len(reported) > 0
+            if time.time() >= deadline:
+                for worker in pending:
+                    print(f"ATTENZIONE: worker STT {worker.idx} non pronto entro {timeout} s")
+                return False
+            time.sleep(0.1)
+
+    def terminate(self):
+        """Termina tutti i worker in modo pulito"""
+        self._running = False
+        for worker in self.workers:
+            process = worker.process
+            try:
+                # Invia un segnale None per terminare il ciclo nel worker
+                worker.input_queue.put(None)
+                # Attendi che il processo termini (con timeout)
+                process.join(timeout=2)
+                # Se il processo è ancora in esecuzione dopo il timeout, terminalo forzatamente
+                if process.is_alive():
+                    process.terminate()
+                    process.join(timeout=1)
+            except Exception as e:
+                print(f"Errore durante la terminazione del processo whisperX {worker.idx}: {e}")
+                # In caso di errori durante la chiusura, forza la terminazione
+                if process is not None and process.is_alive():
+                    try:
+                        process.terminate()
+                    except:
+                        pass
 
 
 def whisperX_spawn_process(model='large-v3', device='auto', compute_type='float32',
-                           batch_size=16, language='it', gpu_idx=None) -> tuple[Callable[[str], str], multiprocessing.Event]:
+                           batch_size=16, language='it', gpu_idx=None,
+                           workers=1, standby=0, cpu_sets=None, transcribe_timeout=120.0) -> tuple[Callable[[str], str | None], WhisperWorkerPool]:
     """
-    Funzione per spawnare un processo figlio che instanzi whisperX in un processo python differente.
+    Funzione per spawnare i processi figli che instanziano whisperX in processi python differenti.
     see: https://github.com/m-bain/whisperX/issues/1124
+
+    Returns:
+        tuple: (send_request, pool)
+               - send_request: Funzione per inviare richieste di trascrizione al worker meno carico
+               - pool: Pool dei worker, da passare a wait_for_model_loading
     """
-    # Crea un manager per la comunicazione tra processi
-    manager = multiprocessing.Manager()
-    input_queue = manager.Queue()
-    response_dict = manager.dict()
-    condition = manager.Condition()
-    ready_event = manager.Event()  # Evento per segnalare quando il modello è pronto
-
-    # Crea e avvia il processo
-    ctx = multiprocessing.get_context('spawn')
-    process = ctx.Process(
-        target=wisperx_process_worker,
-        args=(input_queue, response_dict, condition, ready_event, model, device,
-              compute_type, batch_size, language, gpu_idx)
-    )
-    process.daemon = True  # Assicura che il processo figlio termini quando il processo padre termina
-    process.start()
-
-    # Funzione per terminare il processo in modo pulito
-    def terminate_process():
-        try:
-            # Invia un segnale None per terminare il ciclo nel worker
-            input_queue.put(None)
-            # Attendi che il processo termini (con timeout)
-            process.join(timeout=2)
-            # Se il processo è ancora in esecuzione dopo il timeout, terminalo forzatamente
-            if process.is_alive():
-                process.terminate()
-                process.join(timeout=1)
-        except Exception as e:
-            print(f"Errore durante la terminazione del processo whisperX: {e}")
-            # In caso di errori durante la chiusura, forza la terminazione
-            if process.is_alive():
-                try:
-                    process.terminate()
-                except:
-                    pass
+    pool = WhisperWorkerPool(workers=workers, standby=standby, cpu_sets=cpu_sets, transcribe_timeout=transcribe_timeout,
+                             model=model, device=device, compute_type=compute_type,
+                             batch_size=batch_size, language=language, gpu_idx=gpu_idx)
 
     # Registra la funzione di terminazione con atexit per chiamarla automaticamente all'uscita
-    atexit.register(terminate_process)
-
-    # Crea una closure per inviare richieste al processo
-    def send_request(path):
-        return thread_function(input_queue, response_dict, condition, path)
+    atexit.register(pool.terminate)
 
-    return send_request, ready_event
+    return pool.transcribe, pool
 
 
-def wait_for_model_loading(ready_event, timeout=300):
+def wait_for_model_loading(ready_event, timeout=300, progress: Callable[[int, int], None] | None = None):
     """
     Attende che il modello sia caricato completamente.
 
     Args:
-        ready_event: Evento che sarà impostato quando il modello è pronto
+        ready_event: Pool dei worker (readiness riportata per worker) oppure evento impostato quando il modello è pronto
         timeout: Tempo massimo di attesa in secondi
+        progress: Funzione progress(pronti, totale) chiamata quando un worker del pool è pronto (opzionale)
 
     Returns:
         bool: True se il modello è stato caricato con successo, False in caso di timeout
     """
+    if isinstance(ready_event, WhisperWorkerPool):
+        return ready_event.wait_ready(timeout=timeout, progress=progress)
     return ready_event.wait(timeout=timeout)
 
 
@@ -234,6 +478,10 @@ def whisperListener_argsAdd(parser: argparse.ArgumentParser) -> argparse.Argumen
     whisperParser.add_argument("--language", type=str, default="it", help="Language of the audio file [default '%(default)s']")
     whisperParser.add_argument("--batch_size", type=int, default=16, help="Batch size for processing [default '%(default)s']")
     whisperParser.add_argument("--compute_type", type=str, default="float32", help="Compute type (float32 or int8) [default '%(default)s']")
+    whisperParser.add_argument("--stt_workers", type=int, default=1, help="Numero di processi WhisperX attivi [default '%(default)s']")
+    whisperParser.add_argument("--stt_standby", type=int, default=0, help="Numero di processi WhisperX di riserva, con modello già caricato [default '%(default)s']")
+    whisperParser.add_argument("--stt_timeout", type=float, default=120.0, help="Secondi massimi di attesa di una trascrizione, oltre i quali il worker viene riavviato [default '%(default)s']")
+    whisperParser.add_argument("--stt_cpus", type=str, default=None, help="CPU set per worker, es. '0-3;4-7' (un gruppo per worker) [default: nessun vincolo]")
     return whisperParser
 
 
@@ -244,10 +492,13 @@ def whisperListener_useArgs(args: argparse.Namespace):
     Returns:
         tuple: (send_func, ready_event)
                - send_func: Funzione per inviare richieste di trascrizione
-               - ready_event: Evento che sarà impostato quando il modello è pronto
+               - ready_event: Pool dei worker, pronto quando il modello è caricato in ogni worker
     """
+    workers = args.stt_workers + args.stt_standby
     send_func, ready_event = whisperX_spawn_process(
         model=args.stt_model, device=args.device, compute_type=args.compute_type,
-        gpu_idx=args.gpu_idx, batch_size=args.batch_size, language=args.language
+        gpu_idx=args.gpu_idx, batch_size=args.batch_size, language=args.language,
+        workers=args.stt_workers, standby=args.stt_standby, cpu_sets=parse_cpu_sets(args.stt_cpus, workers),
+        transcribe_timeout=args.stt_timeout
     )
     return send_func, ready_event
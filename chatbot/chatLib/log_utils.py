@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from textwrap import indent
+
+try:
+    from .Tracer import current_trace
+    from .util import StyleBox, create_box, wrapper
+except ImportError:
+    from Tracer import current_trace
+    from util import StyleBox, create_box, wrapper
+
+# Logger radice di tutto il progetto, i sottosistemi usano logging.getLogger('ifab.<nome>')
+ROOT_LOGGER = 'ifab'
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class ContextFilter(logging.Filter):
+    """Aggiunge al record, nel thread che lo genera, l'interazione tracciata in corso"""
+
+    def filter(self, record):
+        record.trace_id = current_trace()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Scarta i messaggi identici (stesso logger, livello e testo) ripetuti entro 'interval' secondi,
+    il primo messaggio successivo riporta quante ripetizioni sono state soppresse.
+    Si applica dal livello 'min_level' in su: gli errori ripetuti ad ogni frame non intasano la coda.
+    """
+
+    def __init__(self, interval: float = 5.0, min_level: int = logging.WARNING, max_keys: int = 1024):
+        super().__init__()
+        self.interval = interval
+        self.min_level = min_level
+        self.max_keys = max_keys
+        self._last = {}  # chiave -> (istante dell'ultima emissione, ripetizioni soppresse)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0 or record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._last.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._last[key] = (last, suppressed + 1)
+                return False
+            if len(self._last) >= self.max_keys:
+                self._last.clear()
+            self._last[key] = (now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.getMessage()} (ripetuto altre {suppressed} volte)"
+            record.args = None
+        return True
+
+
+class BoxFormatter(logging.Formatter):
+    """Formato console storico di messageBox: titolo e testo a capo in un riquadro"""
+
+    def format(self, record):
+        text = record.getMessage()
+        if record.exc_text:
+            text = f"{text}\n{record.exc_text}"
+        title = getattr(record, 'title', None) or f"{record.levelname} {record.name}"
+        style = getattr(record, 'style', None) or (StyleBox.Error if record.levelno >= logging.ERROR else StyleBox.Light)
+        wrapped_text = []
+        for line in (text or " ").splitlines(keepends=True):
+            if line == "\n":
+                wrapped_text.append("")
+                continue
+            wrapped_text.extend(wrapper.wrap(line) or [""])
+        return f"{title}:\n" + indent(create_box("\n".join(wrapped_text), style), "  ")
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per messaggio, per la raccolta e la ricerca dei log"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in ('title', 'trace_id', 'suppressed'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Accoda il record senza formattarlo: la formattazione (riquadri, JSON) avviene nel thread di scrittura"""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Il traceback va convertito in testo qui, l'oggetto eccezione non deve attraversare la coda
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str | int = 'INFO', log_format: str = 'box', log_file: str | None = None,
+                  rate_limit: float = 5.0) -> logging.Logger:
+    """
+    Configura il logging del progetto: chi scrive mette solo il record in una coda, un thread dedicato
+    lo formatta e lo stampa, così console e disco non rallentano mai visione e richieste HTTP.
+    @param log_format: 'box' riquadri di messageBox, 'text' una riga per messaggio, 'json' una riga JSON
+    @param log_file:   File opzionale su cui scrivere sempre in JSON
+    @param rate_limit: Secondi entro cui un avviso o errore identico non viene ripetuto, 0 per disabilitare
+    """
+    global _listener
+    with _setup_lock:
+        logger = logging.getLogger(ROOT_LOGGER)
+        if _listener is not None:
+            _listener.stop()
+            logger.handlers.clear()
+
+        console = logging.StreamHandler()
+        match log_format:
+            case 'json':
+                console.setFormatter(JsonFormatter())
+            case 'text':
+                console.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(name)s: %(message)s'))
+            case _:
+                console.setFormatter(BoxFormatter())
+        handlers = [console]
+        if log_file:
+            file_handler = logging.FileHandler(log_file, encoding='utf-8')
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+        logger.addHandler(queue_handler)
+        logger.setLevel(level if isinstance(level, int) else level.upper())
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        return logger
+
+
+def is_configured() -> bool:
+    return _listener is not None
+
+
+@atexit.register
+def _flush_logs():
+    """Alla chiusura del processo scrive i messaggi ancora in coda"""
+    if _listener is not None:
+        _listener.stop()
+
+
+""" Utility function for Argvparser"""
+
+
+def log_argsAdd(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    logParser = parser.add_argument_group("Logging")
+    logParser.add_argument('--log_level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Livello minimo dei messaggi [default '%(default)s']")
+    logParser.add_argument('--log_format', type=str, default='box', choices=['box', 'text', 'json'],
+                           help="Formato della console: 'box' riquadri, 'text' una riga, 'json' una riga JSON [default '%(default)s']")
+    logParser.add_argument('--log_file', type=str, default=None, help="File su cui scrivere i log in JSON (opzionale)")
+    logParser.add_argument('--log_rate_limit', type=float, default=5.0, help="Secondi entro cui un errore identico non viene ripetuto, 0 per disabilitare [default '%(default)s']")
+    return logParser
+
+
+def log_useArgs(args: argparse.Namespace) -> logging.Logger:
+    return setup_logging(args.log_level, args.log_format, args.log_file, args.log_rate_limit)
@@ -3,11 +3,55 @@
 import re
 
 
+# Pipeline di pulizia per il TTS: (guardia, pattern precompilato, sostituzione), applicate nell'ordine indicato.
+# La guardia è una sottostringa necessaria perché il pattern possa trovare corrispondenze: se manca il passaggio
+# viene saltato senza invocare il motore delle regex.
+_TTS_CLEANUP_PIPELINE = (
+    # Rimuovi blocchi di codice, prima del codice inline altrimenti i backtick del blocco vengono consumati a metà
+    ('```', re.compile(r'```[\s\S]*?```'), ''),
+    # Rimuovi le citazioni nel formato [n]: cite:n "Citation-n"
+    ('[', re.compile(r'\[\d+\]:\s*cite:\d+\s*"[^"]*"'), ''),
+    # Rimuovi i riferimenti alle citazioni [n]
+    ('[', re.compile(r'\[\d+\]'), ''),
+    # Rimuovi asterischi per grassetto e corsivo
+    ('**', re.compile(r'\*\*([^*]+)\*\*'), r'\1'),  # Grassetto
+    ('*', re.compile(r'\*([^*]+)\*'), r'\1'),  # Corsivo
+    # Rimuovi backtick per il codice inline
+    ('`', re.compile(r'`([^`]+)`'), r'\1'),
+    # Rimuovi formattazione per link [testo](url)
+    ('](', re.compile(r'\[([^\]]+)\]\([^)]+\)'), r'\1'),
+    # Rimuovi simboli di intestazione
+    ('#', re.compile(r'^#+\s+', flags=re.MULTILINE), ''),
+    # Modifica simboli di elenco aggiungendo un punto alla fine di ogni elemento
+    (None, re.compile(r'^[\*\-\+]\s+(.+)$', flags=re.MULTILINE), r'\1.'),
+    # Modifica numeri di elenco numerato aggiungendo un punto alla fine di ogni elemento
+    ('.', re.compile(r'^\d+\.\s+(.+)$', flags=re.MULTILINE), r'\1.'),
+    # Rimuovi linee orizzontali
+    (None, re.compile(r'^-{3,}|^\*{3,}|^_{3,}', flags=re.MULTILINE), ''),
+    # Rimuovi spazi multipli e tab (gli spazi singoli sono già corretti, non serve sostituirli)
+    (None, re.compile(r'[ \t]{2,}|\t'), ' '),
+    # Rimuovi spazi all'inizio e alla fine di ogni riga, senza toccare gli a capo: le righe vuote separano i paragrafi
+    (None, re.compile(r'^[ \t]+|[ \t]+$', flags=re.MULTILINE), ''),
+    # Rimuovi newline multipli ma preserva singoli newline per mantenere la struttura del testo
+    ('\n\n', re.compile(r'\n{2,}'), '\n'),
+    # Rimuovi spazi prima dei segni di punteggiatura
+    (None, re.compile(r'\s+([.,;:!?])'), r'\1'),
+    # Rimuovi gli a capo rimasti all'inizio e alla fine del testo (es. dopo le citazioni in coda), diventerebbero virgole
+    (None, re.compile(r'\A\s+|\s+\Z'), ''),
+    # Formatta correttamente il testo per il TTS, sostituendo gli a capo con virgole e spazi
+    ('\n', re.compile(r'\n'), ', '),
+    # Rimuovi spazi multipli che potrebbero essersi creati durante la pulizia
+    (None, re.compile(r'[ \t]{2,}|\t'), ' '),
+    # Senza più a capo, la rimozione degli spazi a inizio e fine riga coincide con lo strip() finale
+)
+
+
 def clean_markdown_for_tts(text):
     """
     Rimuove gli elementi di Markdown dal testo per renderlo adatto alla sintesi vocale.
     
     Rimuove:
+    - Blocchi di codice delimitati da ```
     - Citazioni (es. [1]: cite:1 "Citation-1")
     - Asterischi per grassetto e corsivo
     - Backtick per il codice
@@ -25,57 +69,111 @@ def clean_markdown_for_tts(text):
     if not text:
         return text
 
-    # Rimuovi le citazioni nel formato [n]: cite:n "Citation-n"
-    text = re.sub(r'\[\d+\]:\s*cite:\d+\s*"[^"]*"', '', text)
-
-    # Rimuovi i riferimenti alle citazioni [n]
-    text = re.sub(r'\[\d+\]', '', text)
-
-    # Rimuovi asterischi per grassetto e corsivo (migliorato)
-    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  # Grassetto
-    text = re.sub(r'\*([^*]+)\*', r'\1', text)  # Corsivo
+    for guard, pattern, replacement in _TTS_CLEANUP_PIPELINE:
+        if guard is None or guard in text:
+            text = pattern.sub(replacement, text)
 
-    # Rimuovi backtick per il codice inline
-    text = re.sub(r'`([^`]+)`', r'\1', text)
+    return text.strip()
 
-    # Rimuovi blocchi di codice
-    text = re.sub(r'```[\s\S]*?```', '', text)
 
-    # Rimuovi formattazione per link [testo](url)
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+_SENTENCE_END = re.compile(r'(?<=[.!?;])\s+')
 
-    # Rimuovi simboli di intestazione
-    text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
 
-    # Modifica simboli di elenco aggiungendo un punto alla fine di ogni elemento
-    text = re.sub(r'^[\*\-\+]\s+(.+?)$', r'\1.', text, flags=re.MULTILINE)
-
-    # Modifica numeri di elenco numerato aggiungendo un punto alla fine di ogni elemento
-    text = re.sub(r'^\d+\.\s+(.+?)$', r'\1.', text, flags=re.MULTILINE)
+def split_sentences(text, min_chars=30):
+    """
+    Divide il testo in frasi per la sintesi vocale a pipeline.
 
-    # Rimuovi linee orizzontali
-    text = re.sub(r'^-{3,}|^\*{3,}|^_{3,}', '', text, flags=re.MULTILINE)
+    Le frasi più corte di min_chars vengono unite alla successiva, per non spezzare
+    la prosodia su frammenti brevi (es. "Ok." o elenchi puntati di una parola).
 
-    # Rimuovi spazi multipli e tab
-    text = re.sub(r'[ \t]+', ' ', text)
+    Args:
+        text (str): Il testo già pulito per il TTS
+        min_chars (int): Lunghezza minima di una frase
 
-    # Rimuovi spazi all'inizio e alla fine di ogni riga
-    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)
+    Returns:
+        list[str]: Le frasi nell'ordine originale
+    """
+    if not text:
+        return []
+    sentences = []
+    pending = ''
+    for part in _SENTENCE_END.split(text.strip()):
+        pending = f"{pending} {part}" if pending else part
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ''
+    if pending:
+        if sentences and len(pending) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+# Fine frase in un testo che arriva a pezzi: punteggiatura non preceduta da una cifra (per non spezzare "1. "), o un a capo
+_STREAM_BOUNDARY = re.compile(r'(?<=[^\d\s][.!?;:])\s+|\n+')
+
+
+def pop_complete_sentences(buffer, min_chars=30):
+    """
+    Separa da un testo in arrivo a pezzi (risposta del bot in streaming) la parte già composta da frasi complete.
 
-    # Rimuovi newline multipli ma preserva singoli newline per mantenere la struttura del testo
-    text = re.sub(r'\n{2,}', '\n', text)
+    Args:
+        buffer (str): Il testo markdown ricevuto e non ancora inviato al TTS
+        min_chars (int): Lunghezza minima della parte completa, per non sintetizzare frammenti brevi
 
-    # Rimuovi spazi prima dei segni di punteggiatura
-    text = re.sub(r'\s+([.,;:!?])', r'\1', text)
+    Returns:
+        tuple[str, str]: Le frasi complete da inviare al TTS e il resto da tenere nel buffer
+    """
+    if buffer.count('```') % 2:
+        return '', buffer  # Blocco di codice ancora aperto, verrebbe pulito a metà
+    last = None
+    for last in _STREAM_BOUNDARY.finditer(buffer):
+        pass
+    if last is None or last.start() < min_chars:
+        return '', buffer
+    return buffer[:last.start()], buffer[last.end():]
 
-    # Formatta correttamente il testo per il TTS
-    # Prima sostituisci gli a capo con virgole e spazi
-    text = re.sub(r'\n', ', ', text)
 
-    # Rimuovi spazi multipli che potrebbero essersi creati durante la pulizia
-    text = re.sub(r'[ \t]+', ' ', text)
+class SpeechSegmenter:
+    """
+    Testo per il TTS di una risposta del bot in streaming, ricevuta a pezzi.
+    Lavora sul testo completo ricevuto fino a quel momento: la frase da escludere (es. il disclaimer dell'IA) viene
+    rimossa anche se arriva spezzata fra due pezzi, e l'inizio ancora incompleto in coda viene trattenuto.
+    segments conserva, nell'ordine, i testi puliti passati al TTS: riprodotti uguali (es. da una cache delle risposte)
+    generano le stesse frasi e quindi le stesse chiavi della cache TTS.
+    """
 
-    # Rimuovi spazi all'inizio e alla fine di ogni riga (mantenendo gli a capo)
-    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)
+    def __init__(self, exclude: str = '', min_chars: int = 30):
+        self.exclude = exclude
+        self.min_chars = min_chars
+        self.sent = 0  # Caratteri del testo visibile già passati al TTS
+        self.segments = []
+
+    def visible(self, text: str, final: bool = False) -> str:
+        """Testo senza la frase esclusa; se non è finale, senza l'eventuale inizio della frase esclusa in coda"""
+        if not self.exclude:
+            return text
+        text = text.replace(self.exclude, '')
+        if not final:
+            for n in range(min(len(self.exclude) - 1, len(text)), 0, -1):
+                if text.endswith(self.exclude[:n]):
+                    return text[:-n]
+        return text
 
-    return text.strip()
+    def feed(self, text: str, final: bool = False) -> str:
+        """
+        Args:
+            text (str): Tutta la risposta ricevuta finora
+            final (bool): True all'ultimo pezzo, il resto viene pronunciato anche se la frase non è terminata
+
+        Returns:
+            str: Il testo pulito da inviare ora al TTS, '' se nessuna frase è ancora completa
+        """
+        pending = self.visible(text, final)[self.sent:]
+        chunk, rest = (pending, '') if final else pop_complete_sentences(pending, self.min_chars)
+        self.sent += len(pending) - len(rest)
+        clean_text = clean_markdown_for_tts(chunk)
+        if clean_text:
+            self.segments.append(clean_text)
+        return clean_text
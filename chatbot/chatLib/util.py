@@ -1,8 +1,9 @@
 import argparse
+import logging
 import shutil
 import traceback
 from enum import Enum, auto
-from textwrap import TextWrapper, indent
+from textwrap import TextWrapper
 
 
 class StyleBox(Enum):
@@ -54,17 +55,25 @@ def getTermWidth(minRet: int = 0) -> int:
 wrapper = TextWrapper(width=getTermWidth(120) - 10)
 
 
+_log = logging.getLogger('ifab')
+
+
 def messageBox(who, text, style=StyleBox.Bold):
-    print(f"{who}:")
-    wrapped_text = []
+    """
+    Messaggio con titolo, inviato al logging asincrono del progetto: il riquadro viene disegnato dal thread di
+    scrittura (formato 'box' di log_utils), il chiamante si limita ad accodare il record.
+    Lo stile Error diventa un messaggio di livello ERROR, gli altri INFO.
+    """
     if not text:
         text = f"Call without text, stack trace: {traceback.format_exc()}"
-    for line in text.splitlines(keepends=True):
-        if line == "\n":
-            wrapped_text.append("")
-            continue
-        wrapped_text.extend(wrapper.wrap(line))
-    print(indent(create_box("\n".join(wrapped_text), style), "  "))
+    if not _log.handlers:
+        # Script che non hanno configurato il logging: configurazione predefinita, riquadri in console
+        try:
+            from .log_utils import setup_logging
+        except ImportError:
+            from log_utils import setup_logging
+        setup_logging()
+    _log.log(logging.ERROR if style is StyleBox.Error else logging.INFO, text, extra={'title': who, 'style': style})
 
 
 # Default format helper class
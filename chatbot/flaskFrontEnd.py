@@ -1,24 +1,51 @@
+import os
+import threading
 import time
+from collections import OrderedDict
 from typing import Callable
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO
 
 try:
     from .chatLib import AudioPlayer as ap
+    from .chatLib.AnswerCache import AnswerCache
+    from .chatLib.IntentRouter import IntentRouter
+    from .chatLib.Metrics import metrics
+    from .chatLib.PageCache import CachedPage
+    from .chatLib.Readiness import Readiness
+    from .chatLib.StaticAssets import StaticAssets
+    from .chatLib import TableMap as tm
+    from .chatLib.Tracer import tracer
     from .chatLib import WhisperListener as wl
-    from .chatLib.text_utils import clean_markdown_for_tts
+    from .chatLib import log_utils as lu
+    from .chatLib.text_utils import SpeechSegmenter, clean_markdown_for_tts
     from .chatLib.util import *
-    from .ifabChatWebSocket import IfabChatWebSocket
-    from .welcomePage import *
+    from .ifabChatAsync import IfabChatAsync
+    from .ifabChatWebSocket import IfabChatWebSocket, ConversationPool, current_reply_to
 except ImportError:
     from chatLib import AudioPlayer as ap
+    from chatLib.AnswerCache import AnswerCache
+    from chatLib.IntentRouter import IntentRouter
+    from chatLib.Metrics import metrics
+    from chatLib.PageCache import CachedPage
+    from chatLib.Readiness import Readiness
+    from chatLib.StaticAssets import StaticAssets
+    from chatLib import TableMap as tm
+    from chatLib.Tracer import tracer
     from chatLib import WhisperListener as wl
-    from chatLib.text_utils import clean_markdown_for_tts
+    from chatLib import log_utils as lu
+    from chatLib.text_utils import SpeechSegmenter, clean_markdown_for_tts
     from chatLib.util import *
-    from ifabChatWebSocket import IfabChatWebSocket
-    from welcomePage import *
+    from ifabChatAsync import IfabChatAsync
+    from ifabChatWebSocket import IfabChatWebSocket, ConversationPool, current_reply_to
+
+# Frasi fisse pronunciate dal backend, esposte per poterle pre-caricare nella cache TTS
+WELCOME_MESSAGE = 'Benvenuto! Puoi scrivere un messaggio o registrare un messaggio vocale.'
+STT_RETRY_MESSAGE = "Mi spiace ma non ho capito nulla, puoi ripetere da capo?"
+AI_DISCLAIMER = "Il contenuto generato dall'IA potrebbe essere errato"  # Rimosso dalle risposte del bot
+
 """
 Flask WebSocket server per la comunicazione con il bot 
 @param url:                 URL del bot
@@ -30,7 +57,19 @@ Flask WebSocket server per la comunicazione con il bot
 @param sttFun:              Funzione di callback per la trascrizione audio (opzionale)
                             @param sttFun(pathToAudio) -> Transcription | None
 @param ttsFun:              Funzione di callback per la sintesi vocale (opzionale)
-                            @param ttsFun(text) -> None
+                            @param ttsFun(text, room) -> None, room è la sessione Socket.IO che riceve l'audio (None per tutte)
+@param stopTtsFun:          Funzione di callback per interrompere la sintesi vocale quando l'utente inizia a parlare (opzionale)
+                            @param stopTtsFun(room) -> None, interrompe solo l'audio della sessione room
+@param pool_size:           Numero di conversazioni con il bot tenute aperte in anticipo per i nuovi browser
+@param idle_timeout:        Secondi di inattività dopo i quali la conversazione di una sessione viene chiusa
+@param async_client:        Usa il client DirectLine asyncio (tutte le conversazioni su un unico event loop) invece di un thread per socket
+@param answer_cache_size:   Numero massimo di risposte del bot tenute in cache per le domande ripetute, 0 per disabilitare
+@param answer_cache_ttl:    Secondi di validità di una risposta in cache
+@param local_commands:      Riconosce localmente i comandi di movimento ("vai al laser") e li esegue senza passare dal bot
+@param readiness:           Stato di avvio dei sottosistemi: finché non sono pronti '/' serve la pagina di benvenuto,
+                            che riceve l'avanzamento sul namespace Socket.IO '/readiness' (opzionale).
+                            I sottosistemi falliti si ricaricano con POST '/retry-subsystem/<nome>'
+@param table_map_rate:      Aggiornamenti al secondo della mappa del tavolo su '/map', alimentata con app.extensions['ifab_table_map'].update
 """
 
 
@@ -38,26 +77,58 @@ def create_app(url: str, auth: str,
                jobStation_list_top: list[dict[str, str, str, str]],
                machine_list_bot: list[dict[str, str, str, str]],
                sttFun: Callable[[str], str | None] = None,
-               ttsFun: Callable[[str], None] = None,
+               ttsFun: Callable[[str, str | None], None] = None,
                goBotFun: Callable[[str|None], None] = None,
                getBotStatusFun: Callable[[], str] = None,
-               updateBotFaceFun: Callable[[str], None] = None) -> tuple[Flask, SocketIO, IfabChatWebSocket]:
-    """Crea e restituisce l'istanza dell'app Flask, socketio e client WebSocket, con tutti i callback"""
-
-    def send_to_copilot(text: str):
-        """Invia un messaggio al bot"""
+               updateBotFaceFun: Callable[[str], None] = None,
+               stopTtsFun: Callable[[str | None], None] = None,
+               pool_size: int = 2,
+               idle_timeout: int = 600,
+               async_client: bool = True,
+               answer_cache_size: int = 256,
+               answer_cache_ttl: float = 3600,
+               local_commands: bool = True,
+               readiness: Readiness | None = None,
+               table_map_rate: float = 10.0) -> tuple[Flask, SocketIO, ConversationPool]:
+    """Crea e restituisce l'istanza dell'app Flask, socketio e pool di conversazioni con il bot, con tutti i callback"""
+
+    def send_to_copilot(text: str, chat_client: IfabChatWebSocket, sid=None):
+        """Invia un messaggio al bot senza attendere l'esito, la risposta arriva tramite i callback"""
+        on_sent = None
+        # Una risposta dalla cache non passa dalla conversazione e il bot non la vede nel suo contesto: la cache si usa
+        # solo finché la sessione non ha parlato con il bot, così una domanda di seguito non riceve una risposta scollegata
+        if answer_cache is not None and sid not in bot_history:
+            # Le domande ripetute dei visitatori hanno già una risposta, niente viaggio verso il bot
+            cached = answer_cache.get(text)
+            if cached is not None:
+                answer, speech = cached
+                stats = answer_cache.stats()
+                messageBox("Risposta dalla cache", f"{text}\n└─▶ hit rate {stats['hit_rate']:.0%}, tempo risparmiato {stats['saved_seconds']:.1f} s", StyleBox.Dash_Light)
+                backEnd_msg2UI(answer, audio_enable=False, room=sid)
+                if ttsFun:
+                    # Stessi testi della prima risposta: stesse frasi, servite dalla cache TTS senza sintesi
+                    for segment in speech:
+                        ttsFun(segment, sid)
+                return
+            # Domanda senza contesto precedente: la risposta, riconosciuta dal replyToId, può andare in cache.
+            # La cache è indicizzata sulla domanda, senza lo stato del robot
+            sent_time = time.time()
+            on_sent = lambda activity_id: remember_question(activity_id, text, sent_time)
+        bot_history.add(sid)
         if getBotStatusFun is not None:
             botStatus = getBotStatusFun()  # Chiedi al sistema preposto lo stato del bot per inviarlo al chatbot
             text = f"Stato del bot rilevato:\n{botStatus}\n\nDomanda dell'utente:\n{text}"  # Aggiungi lo stato del bot al messaggio
         messageBox("Invio messaggio al bot", text, StyleBox.Dash_Light)
         # TODO: robot thinking face ?
-        chat_client.send_message(text)
+        chat_client.send_message_nowait(text, on_sent=on_sent)
 
     # Callback per gestire l'inoltro dei messaggi dal backend (bot o stt) al frontend
     # se ho un messaggio ID, allora devo aggiornare quel baloon
-    def backEnd_msg2UI(text, message_id=None, audio_enable=True):
-        text = text.replace("Il contenuto generato dall'IA potrebbe essere errato", "")
-        """Callback function for when a message is received from the bot"""
+    # il messaggio va solo alla stanza della sessione che lo ha generato, senza stanza va a tutti i client
+    def backEnd_msg2UI(text, message_id=None, audio_enable=True, room=None) -> str | None:
+        """Callback function for when a message is received from the bot, returns the text sent to the TTS"""
+        text = text.replace(AI_DISCLAIMER, "")
+        clean_text = None
         if not message_id:  # Nessuno ID messaggio, quindi è un messaggio normale
             messageBox("Send new message to frontEnd", text, StyleBox.Dash_Light)
             message_data = {'type': 'message', 'text': text}
@@ -65,19 +136,121 @@ def create_app(url: str, auth: str,
                 # Pulisci il testo da elementi Markdown prima di inviarlo al TTS
                 clean_text = clean_markdown_for_tts(text)
                 messageBox("Send to TTS", clean_text, StyleBox.Dash_Light)
-                ttsFun(clean_text)
+                ttsFun(clean_text, room)
             # TODO: Messaggio ricevuto, fine della faccietta pensante
-            socketio.emit('message', message_data)
+            with tracer.span('ui.emit'):
+                socketio.emit('message', message_data, to=room)
         else:  #
             messageBox("Send to frontEnd audio transcription to append", text, StyleBox.Dash_Light)
             message_data = {'type': 'message', 'text': text, 'messageId': message_id}
-            socketio.emit('stt', message_data)
+            socketio.emit('stt', message_data, to=room)
         socketio.sleep(0)  # Assicurati che il messaggio venga inviato immediatamente
+        return clean_text
+
+    # Callback per le risposte del bot in streaming: il frontend aggiorna lo stesso baloon ad ogni pezzo
+    # e il TTS riceve le frasi appena sono complete, senza aspettare la fine della risposta
+    tts_streams = {}  # stream_id -> SpeechSegmenter della risposta in arrivo
+
+    def backEnd_stream2UI(stream_id, delta, text, final, room=None) -> list[str] | None:
+        """Callback function for each chunk of a streamed bot reply, returns the texts sent to the TTS once final"""
+        segmenter = tts_streams.setdefault(stream_id, SpeechSegmenter(AI_DISCLAIMER))
+        if final:
+            del tts_streams[stream_id]
+        # Il disclaimer si toglie dal testo completo, non dal singolo pezzo dove può arrivare spezzato
+        socketio.emit('message', {'type': 'message', 'text': segmenter.visible(text, final), 'streamId': stream_id, 'final': final}, to=room)
+        clean_text = segmenter.feed(text, final)
+        if ttsFun and clean_text:
+            messageBox("Send to TTS", clean_text, StyleBox.Dash_Light)
+            ttsFun(clean_text, room)
+        socketio.sleep(0)  # Assicurati che il messaggio venga inviato immediatamente
+        return segmenter.segments if final else None
 
-    def bot_err2UI(error_text):
+    def bot_err2UI(error_text, room=None):
         """Callback function for when an error occurs"""
         messageBox("Errore invio al frontend", error_text, StyleBox.Error)
-        socketio.emit('message', {'type': 'error', 'text': error_text})
+        socketio.emit('message', {'type': 'error', 'text': error_text}, to=room)
+
+    def dispatch_command(text: str, sid=None) -> bool:
+        """Esegue subito i comandi di movimento riconosciuti localmente, restituisce False se la frase va inviata al bot"""
+        if intent_router is None:
+            return False
+        start_time = time.perf_counter()
+        with tracer.span('intent.match') as span:
+            target = intent_router.match(text)
+            span.args['target'] = target['key'] if target else None
+        if target is None:
+            return False
+        messageBox("Comando locale", f"{text}\n└─▶ target '{target['key']}' riconosciuto in {(time.perf_counter() - start_time) * 1000:.2f} ms", StyleBox.Dash_Light)
+        goBotFun(target['key'])  # Invia il nuovo target al robot
+        backEnd_msg2UI(target['say'], room=sid)  # Conferma a schermo e a voce, come il click sul pulsante
+        return True
+
+    def _reply(activity_id) -> dict:
+        """Risposta in costruzione per l'activity inviata, da chiamare con replies_lock acquisito"""
+        reply = replies.get(activity_id)
+        if reply is None:
+            reply = replies[activity_id] = {'question': None, 'sent': None, 'received': None, 'answer': [], 'speech': []}
+            while len(replies) > 128:
+                replies.popitem(last=False)
+        return reply
+
+    def _store_reply(reply):
+        """Aggiorna la cache quando domanda e risposta sono entrambe note, da chiamare con replies_lock acquisito"""
+        if reply['question'] is not None and reply['answer']:
+            latency = reply['received'] - reply['sent'] if reply['received'] else 0.0
+            answer_cache.put(reply['question'], "\n\n".join(reply['answer']), reply['speech'], latency=max(latency, 0.0))
+
+    def remember_question(activity_id, question, sent_time):
+        """Domanda accettata da DirectLine con id activity_id: le risposte del bot con replyToId uguale le appartengono"""
+        if activity_id is None:
+            return
+        with replies_lock:
+            reply = _reply(activity_id)
+            reply['question'], reply['sent'] = question, sent_time
+            _store_reply(reply)  # Le risposte possono arrivare sullo stream prima dell'esito della POST
+
+    def remember_answer(answer, speech):
+        """
+        Aggiunge alla risposta in cache il messaggio del bot in consegna, con i testi pronunciati e il tempo impiegato dal bot.
+        Una risposta in più activity viene salvata intera: ogni activity con lo stesso replyToId si accoda alle precedenti
+        """
+        activity_id = current_reply_to()
+        answer = answer.replace(AI_DISCLAIMER, "").strip()
+        if answer_cache is None or activity_id is None or not answer:
+            return
+        with replies_lock:
+            reply = _reply(activity_id)
+            reply['received'] = reply['received'] or time.time()
+            reply['answer'].append(answer)
+            reply['speech'].extend(speech)
+            _store_reply(reply)
+
+    def on_bot_message(sid, text):
+        clean_text = backEnd_msg2UI(text, room=sid)
+        remember_answer(text, [clean_text] if clean_text else [])
+
+    def on_bot_stream(sid, stream_id, delta, text, final):
+        speech = backEnd_stream2UI(stream_id, delta, text, final, room=sid)
+        if final:
+            remember_answer(text, speech)
+
+    def session_client(sid) -> IfabChatWebSocket | None:
+        """Conversazione della sessione del frontend: assegnata dal pool al primo uso e riaperta se chiusa per inattività o errore"""
+        chat_client = conversation_pool.get(sid)
+        if chat_client is None:
+            chat_client = conversation_pool.acquire(sid)
+            if chat_client is None:
+                return None
+            # Registra i callback per inoltrare i messaggi del bot solo al browser proprietario della conversazione
+            chat_client.add_message_callback(lambda text: on_bot_message(sid, text))
+            chat_client.add_error_callback(lambda error_text: bot_err2UI(error_text, room=sid))
+            chat_client.add_partial_callback(lambda stream_id, delta, text, final: on_bot_stream(sid, stream_id, delta, text, final))
+        elif not chat_client.running:
+            messageBox("Riconnessione", f"Tentativo di riavvio della conversazione della sessione {sid}", StyleBox.Light)
+            if not chat_client.start_conversation():
+                return None
+            bot_history.discard(sid)  # Conversazione nuova, il bot non ricorda le domande precedenti
+        return chat_client
 
     # Mock function for STT (Speech-to-Text) processing
     def stt_mock(audio_path=None) -> str | None:
@@ -93,106 +266,188 @@ def create_app(url: str, auth: str,
         return f"Trascrizione del messaggio, Mock per {os.path.basename(audio_path)}"
 
     # Inizializzo gli oggetti e li configuro per l'interfaccia grafica
-    chat_client = IfabChatWebSocket(url, auth)  # Inizializza il client WebSocket verso il bot
+    conversation_pool = ConversationPool(url, auth, size=pool_size, idle_timeout=idle_timeout,
+                                         client_class=IfabChatAsync if async_client else IfabChatWebSocket)  # Conversazioni verso il bot, una per sessione
+    # Cache delle risposte alle domande ripetute, l'audio delle risposte viene poi servito dalla cache del TTS
+    answer_cache = AnswerCache(max_entries=answer_cache_size, ttl=answer_cache_ttl) if answer_cache_size > 0 else None
+    replies = OrderedDict()  # id dell'activity inviata -> domanda e risposta del bot in costruzione per la cache
+    replies_lock = threading.Lock()
+    bot_history = set()  # Sessioni la cui conversazione ha già scambiato messaggi con il bot
+    connected_sids = set()  # Sessioni Socket.IO collegate: solo queste possono usare una conversazione del pool
+    # Indice dei comandi di movimento costruito dai pulsanti, per non fare il giro dal bot per "vai al laser"
+    intent_router = IntentRouter([item for item in jobStation_list_top + machine_list_bot if 'key' in item]) if goBotFun and local_commands else None
     app = Flask(__name__, static_folder='web-client')  # Creo l'istanza dell'app Flask e imposto la cartella statica
     CORS(app)  # Abilita CORS per tutte le route
-    socketio = SocketIO(app, cors_allowed_origins="*")  # Inizializza SocketIO con CORS abilitato tra il backend python ed il frontend Flask
+    # Inizializza SocketIO con CORS abilitato tra il backend python ed il frontend Flask. Sempre in modalità 'threading':
+    # gli emit partono da thread nativi (event loop DirectLine, TTS, sottoscrittori del bus, caricamento dei modelli)
+    # che i server gevent/eventlet non servono in modo sicuro senza monkey patching
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
     # Configurazione delle callback esterne
     stt_fun = sttFun if sttFun else stt_mock  # Se non viene fornita una funzione STT, usa la funzione di mock
 
-    # Registra i callback per gestire l'inoltro dei messaggi dal bot al frontend
-    chat_client.add_message_callback(backEnd_msg2UI)
-    chat_client.add_error_callback(bot_err2UI)
-
     # Crea una directory temporanea vuota all'avvio del server
     temp_dir = os.path.join(os.path.dirname(__file__), 'temp')
     if os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)  # Rimuovi la directory temporanea esistente
     os.makedirs(temp_dir, exist_ok=True)
 
+    # Risorse statiche con hash del contenuto e varianti .gz/.br generate una volta all'avvio
+    assets = StaticAssets(os.path.join(os.path.dirname(__file__), 'web-client'), os.path.join(os.path.dirname(__file__), 'static-cache'))
+    messageBox("Risorse statiche", f"Varianti compresse pronte: {assets.precompress()}", StyleBox.Light)
+
+    active_sessions = metrics.gauge('ifab_socketio_sessions', "Browser collegati tramite Socket.IO")
+    active_sessions.set(0)
+
+    # Avanzamento dell'avvio inviato alle pagine di benvenuto, su un namespace separato dalla chat:
+    # la pagina di benvenuto non apre conversazioni con il bot e non muove il robot
+    if readiness is not None:
+        @socketio.on('connect', namespace='/readiness')
+        def handle_readiness_connect():
+            socketio.emit('readiness', readiness.snapshot(), namespace='/readiness', to=request.sid)
+
+        readiness.add_listener(lambda snapshot: socketio.emit('readiness', snapshot, namespace='/readiness'))
+
+    # Mappa del tavolo in tempo reale: solo le differenze, a frequenza limitata, e nessun lavoro senza browser collegati
+    table_map = tm.TableMapStream(socketio, rate=table_map_rate)
+    app.extensions['ifab_table_map'] = table_map
+
+    @socketio.on('connect', namespace=tm.NAMESPACE)
+    def handle_table_connect():
+        table_map.connect(request.sid)
+
+    @socketio.on('disconnect', namespace=tm.NAMESPACE)
+    def handle_table_disconnect():
+        table_map.disconnect()
+
     # Gestione dell'evento di connessione Socket.IO
     @socketio.on('connect')
     def handle_connect():
         """Gestisce l'evento di connessione di un client Socket.IO"""
-        if goBotFun:
-            goBotFun(None)  # Invia un nuovo target al robot
-        messageBox("Nuova connessione frontend", "Avvio nuova conversazione con il bot", StyleBox.Dash_Bold)
+        sid = request.sid
+        connected_sids.add(sid)
+        active_sessions.inc()
+        if goBotFun and conversation_pool.stats()['sessions'] == 0:
+            # Primo visitatore: il robot torna al centro; con altre sessioni aperte il loro target non va toccato
+            goBotFun(None)
+        messageBox("Nuova connessione frontend", f"Assegno una conversazione con il bot alla sessione {sid}", StyleBox.Dash_Bold)
         # Invia un messaggio di benvenuto all'utente
-        backEnd_msg2UI('Benvenuto! Puoi scrivere un messaggio o registrare un messaggio vocale.', audio_enable=False)
+        backEnd_msg2UI(WELCOME_MESSAGE, audio_enable=False, room=sid)
         # Gestione più robusta della connessione
         try:
-            if chat_client.running:
-                messageBox("Chiusura conversazione", "Chiudo la conversazione precedente con il bot", StyleBox.Light)
-                chat_client.stop_conversation()
-                time.sleep(0.5)  # Breve pausa per assicurarsi che la connessione precedente sia completamente chiusa
-            # Tenta di avviare una nuova conversazione
-            if not chat_client.start_conversation():
+            # Prende una conversazione già aperta dal pool, le altre sessioni non vengono toccate
+            if session_client(sid) is None:
                 messageBox("Errore connessione", "Impossibile avviare la conversazione con il bot", StyleBox.Error)
                 # Invia un messaggio di errore al frontend
-                socketio.emit('message', {'type': 'error', 'text': 'Impossibile avviare la conversazione con il bot'})
+                socketio.emit('message', {'type': 'error', 'text': 'Impossibile avviare la conversazione con il bot'}, to=sid)
         except Exception as e:
             messageBox("Errore connessione", f"Errore durante l'avvio della conversazione: {str(e)}", StyleBox.Error)
-            socketio.emit('message', {'type': 'error', 'text': f'Errore durante la connessione: {str(e)}'})
+            socketio.emit('message', {'type': 'error', 'text': f'Errore durante la connessione: {str(e)}'}, to=sid)
 
     # Aggiungi una route per servire le immagini statiche
     @app.route('/images/<path:filename>')
     def serve_image(filename):
-        return send_from_directory('web-client/images', filename)
+        return assets.send(f'images/{filename}')
 
     # Aggiungi una route per servire il file CSS
     @app.route('/css/<path:filename>')
     def serve_css(filename):
-        return send_from_directory('web-client/css', filename)
+        return assets.send(f'css/{filename}')
 
     # Aggiungi una route per servire il file JavaScript
     @app.route('/js/<path:filename>')
     def serve_js(filename):
-        return send_from_directory('web-client/js', filename)
+        return assets.send(f'js/{filename}')
 
     # Aggiungi route per servire le librerie JavaScript locali
     @app.route('/libs/<path:filename>')
     def serve_libs(filename):
-        return send_from_directory('web-client/libs', filename)
+        return assets.send(f'libs/{filename}')
 
     @app.route('/favicon.ico')
     def serve_favicon():
-        return send_from_directory('web-client', 'favicon.ico')
-
-    # Aggiungi una route per servire il file HTML e generare la pagina
-    @app.route('/')
-    def index():
-        """Serve the main HTML page"""
-
-        def mkHTMLbutton(buttons):
-            html = ''
-            for item in buttons:
-                if "img_path" not in item or "text" not in item or "say" not in item or "key" not in item:
-                    print(f"[WARNING] 'img_path' or 'text' or 'say' or 'key' not in item: {item}")
-                    continue
-                text = item["text"]
-                img_path = item["img_path"]
-                say = item["say"]
-                key = item["key"]
-                if os.path.exists(os.path.join(os.path.dirname(__file__), img_path)):  # Se l'immagine esiste, impostala come sfondo
-                    if not img_path.startswith('/'):  # Assicurati che il percorso dell'immagine inizi con '/'
-                        img_path = '/' + img_path
-                    bg_img = f'style="background-image: url(\'{img_path}\')"'
-                else:
-                    bg_img = ''
-                html += f'<button class="static-btn" data-say="{say}" data-key="{key}" {bg_img}><span>{text}</span></button>\n'
-            return html
-
-        # Crea HTML per i pulsanti di sinistra
+        return assets.send('favicon.ico')
+
+    # Pagine HTML generate una volta e servite dalla memoria, rigenerate solo se cambiano i file o i pulsanti
+    index_path = os.path.join(os.path.dirname(__file__), 'web-client/index.html')
+    welcome_path = os.path.join(os.path.dirname(__file__), 'web-client/welcome.html')
+    map_path = os.path.join(os.path.dirname(__file__), 'web-client/map.html')
+    about_path = os.path.join(os.path.dirname(__file__), 'web-client/about.html')
+    buttons = {'top': jobStation_list_top, 'bot': machine_list_bot}
+
+    def mkHTMLbutton(buttons):
+        html = ''
+        for item in buttons:
+            if "img_path" not in item or "text" not in item or "say" not in item or "key" not in item:
+                print(f"[WARNING] 'img_path' or 'text' or 'say' or 'key' not in item: {item}")
+                continue
+            text = item["text"]
+            img_path = item["img_path"]
+            say = item["say"]
+            key = item["key"]
+            if img_path and os.path.isfile(os.path.join(os.path.dirname(__file__), img_path)):  # Se l'immagine esiste, impostala come sfondo
+                if not img_path.startswith('/'):  # Assicurati che il percorso dell'immagine inizi con '/'
+                    img_path = '/' + img_path
+                bg_img = f'style="background-image: url(\'{img_path}\')"'
+            else:
+                bg_img = ''
+            html += f'<button class="static-btn" data-say="{say}" data-key="{key}" {bg_img}><span>{text}</span></button>\n'
+        return html
+
+    def render_index():
         # Leggi il contenuto del file HTML
-        with open(os.path.join(os.path.dirname(__file__), 'web-client/index.html'), 'r') as file:
+        with open(index_path, 'r') as file:
             html_content = file.read()
 
         # Sostituisci i placeholder nel template
-        html_content = html_content.replace('<!-- STATIC_BUTTONS_JOB_STATION -->', mkHTMLbutton(jobStation_list_top))
-        html_content = html_content.replace('<!-- STATIC_BUTTONS_MACHINE -->', mkHTMLbutton(machine_list_bot))
+        html_content = html_content.replace('<!-- STATIC_BUTTONS_JOB_STATION -->', mkHTMLbutton(buttons['top']))
+        html_content = html_content.replace('<!-- STATIC_BUTTONS_MACHINE -->', mkHTMLbutton(buttons['bot']))
+        return assets.versioned_html(html_content)  # Riferimenti a css/js con l'hash del contenuto
+
+    def render_about():
+        with open(about_path, 'r') as file:
+            return assets.versioned_html(file.read())
+
+    def render_welcome():
+        with open(welcome_path, 'r') as file:
+            return assets.versioned_html(file.read())
+
+    def render_map():
+        with open(map_path, 'r') as file:
+            return assets.versioned_html(file.read())
+
+    def index_sources():
+        # Il template, le risorse statiche (il loro hash è nella pagina) e le immagini dei pulsanti: se un'immagine compare o sparisce cambia lo sfondo del pulsante
+        images = [os.path.join(os.path.dirname(__file__), item["img_path"]) for item in buttons['top'] + buttons['bot'] if item.get("img_path")]
+        return [index_path] + assets.files() + images
+
+    pages = {
+        'index': CachedPage(render_index, index_sources),
+        'about': CachedPage(render_about, lambda: [about_path] + assets.files()),
+        'welcome': CachedPage(render_welcome, lambda: [welcome_path] + assets.files()),
+        'map': CachedPage(render_map, lambda: [map_path] + assets.files()),
+    }
+
+    def update_buttons(jobStation_list_top, machine_list_bot):
+        """Sostituisce i pulsanti statici (es. dopo una modifica della configurazione), rigenera la pagina principale e l'indice dei comandi locali"""
+        nonlocal intent_router
+        buttons['top'] = jobStation_list_top
+        buttons['bot'] = machine_list_bot
+        if intent_router is not None:
+            intent_router = IntentRouter([item for item in jobStation_list_top + machine_list_bot if 'key' in item])
+        pages['index'].invalidate()
+
+    app.extensions['ifab_pages'] = pages
+    app.extensions['ifab_update_buttons'] = update_buttons
 
-        return html_content
+    # Aggiungi una route per servire il file HTML e generare la pagina
+    @app.route('/')
+    def index():
+        """Serve the main HTML page, or the welcome page while the subsystems are still loading"""
+        if readiness is None:
+            return pages['index'].response()
+        readiness.page_served()
+        return pages['index' if readiness.is_ready() else 'welcome'].response()
 
     # Aggiungi una route per gestire la richiesta di invio del messaggio testuale
     @app.route('/robot-face-update', methods=['POST'])
@@ -208,6 +463,18 @@ def create_app(url: str, auth: str,
 
         return jsonify({'success': True})
 
+    # Aggiungi una route per interrompere il TTS quando l'utente inizia a parlare (barge-in)
+    @app.route('/tts-stop', methods=['POST'])
+    def tts_stop():
+        """Flush the queued TTS audio of the session that started recording"""
+        sid = (request.get_json(silent=True) or {}).get('sid')
+        if sid not in connected_sids:
+            # Senza sessione l'interruzione toccherebbe l'audio di tutti i browser
+            return jsonify({'success': False, 'error': 'Sessione Socket.IO non valida'}), 400
+        if stopTtsFun:
+            stopTtsFun(sid)
+        return jsonify({'success': True})
+
     # Aggiungi una route per gestire la richiesta di invio del messaggio testuale
     @app.route('/send-message', methods=['POST'])
     def send_message():
@@ -217,20 +484,26 @@ def create_app(url: str, auth: str,
             return jsonify({'success': False, 'error': 'No text provided'}), 400
 
         text = data['text']
+        sid = data.get('sid')  # Sessione Socket.IO del browser, identifica la conversazione
+        if sid not in connected_sids:
+            # Senza una sessione collegata la conversazione presa dal pool non verrebbe mai rilasciata
+            # e la risposta andrebbe a tutti i browser
+            return jsonify({'success': False, 'error': 'Sessione Socket.IO non valida'}), 400
 
         # Gestione più robusta della connessione
         try:
-            # Se la connessione non è attiva, tenta di riavviarla
-            if not chat_client.running:
-                messageBox("Riconnessione", "Tentativo di riavvio della conversazione", StyleBox.Light)
-                if not chat_client.start_conversation():
+            with tracer.use(tracer.new_trace('testo', sid=sid, text=text)):
+                # I comandi di movimento vengono eseguiti subito, senza bisogno della conversazione
+                if dispatch_command(text, sid):
+                    return jsonify({'success': True})
+                # Se la connessione non è attiva, tenta di riavviarla
+                chat_client = session_client(sid)
+                if chat_client is None:
                     messageBox("Errore connessione", "Impossibile avviare la conversazione", StyleBox.Error)
                     return jsonify({'success': False, 'error': 'Impossibile avviare la conversazione'}), 500
-                # Breve pausa per assicurarsi che la connessione sia stabilita
-                time.sleep(0.5)
-            # Invia il messaggio al bot in un thread separato per non bloccare la risposta HTTP
-            threading.Thread(target=send_to_copilot, args=(text,)).start()
-            return jsonify({'success': True})
+                # Invia il messaggio al bot senza bloccare la risposta HTTP
+                send_to_copilot(text, chat_client, sid)
+                return jsonify({'success': True})
         except Exception as e:
             messageBox("Errore invio", f"Errore durante l'invio del messaggio: {str(e)}", StyleBox.Error)
             return jsonify({'success': False, 'error': f'Errore durante l\'invio: {str(e)}'}), 500
@@ -245,13 +518,15 @@ def create_app(url: str, auth: str,
 
         key = data['key']
         say = data['say']
+        sid = data.get('sid')  # Sessione Socket.IO del browser, riceve la conferma vocale
 
         # Stampa il testo del pulsante nel server per debug
         messageBox("Frontend al click di un pulsante invia chiave", f"key: {key}\nsay: {say}", StyleBox.Light)
-        if goBotFun:
-            goBotFun(key)  # Invia il nuovo target al robot
-        if ttsFun:
-            ttsFun(say)  # Invia il messaggio al TTS
+        with tracer.use(tracer.new_trace('pulsante', key=key, text=say)):
+            if goBotFun:
+                goBotFun(key)  # Invia il nuovo target al robot
+            if ttsFun:
+                ttsFun(say, sid)  # Invia il messaggio al TTS
         return jsonify({'success': True, 'key': key})
 
     # Aggiungi una route per gestire l'invio di un messaggio audio
@@ -261,13 +536,18 @@ def create_app(url: str, auth: str,
         if 'audio' not in request.files:
             return jsonify({'success': False, 'error': 'No audio file provided'}), 400
         audio_file = request.files['audio']
+        sid = request.form.get('sid')  # Sessione Socket.IO del browser, identifica la conversazione
+        if sid not in connected_sids:
+            return jsonify({'success': False, 'error': 'Sessione Socket.IO non valida'}), 400
 
         # Genera un nome file univoco con timestamp
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         temp_path = os.path.join(temp_dir, f'audio_{timestamp}.wav')
 
-        # Salva il file audio e logga il percorso
-        audio_file.save(temp_path)
+        # Salva il file audio e logga il percorso, l'interazione parte dalla ricezione dell'audio
+        trace_id = tracer.new_trace('voce', sid=sid)
+        with tracer.span('upload.save', trace_id=trace_id):
+            audio_file.save(temp_path)
         messageBox("Frontend audio", f"File audio temporaneo salvato in: {temp_path}", StyleBox.Light)
 
         # Crea un URL relativo per il file audio
@@ -276,37 +556,41 @@ def create_app(url: str, auth: str,
         # Gestione più robusta della connessione
         try:
             # Se la connessione non è attiva, tenta di riavviarla
-            if not chat_client.running:
-                messageBox("Riconnessione", "Tentativo di riavvio della conversazione per audio", StyleBox.Light)
-                if not chat_client.start_conversation():
-                    messageBox("Errore connessione", "Impossibile avviare la conversazione per audio", StyleBox.Error)
-                    # Invia un messaggio di errore al frontend
-                    socketio.emit('message', {'type': 'error', 'text': 'Impossibile avviare la conversazione. Riprova più tardi.'})
-                    return jsonify({'success': False, 'error': 'Impossibile avviare la conversazione'}), 500
-                # Breve pausa per assicurarsi che la connessione sia stabilita
-                time.sleep(0.5)
+            chat_client = session_client(sid)
+            if chat_client is None:
+                messageBox("Errore connessione", "Impossibile avviare la conversazione per audio", StyleBox.Error)
+                # Invia un messaggio di errore al frontend
+                socketio.emit('message', {'type': 'error', 'text': 'Impossibile avviare la conversazione. Riprova più tardi.'}, to=sid)
+                return jsonify({'success': False, 'error': 'Impossibile avviare la conversazione'}), 500
 
             # Crea un ID messaggio basato sul timestamp
             message_id = f"audio_{timestamp}"
 
             # Invia il messaggio audio al bot in un thread separato per non bloccare la risposta HTTP
             def send_audio_thread(audio_path, message_id):
-                stt_audio_text = stt_fun(audio_path)
+                with tracer.use(trace_id):
+                    send_audio_traced(audio_path, message_id)
+
+            def send_audio_traced(audio_path, message_id):
+                with tracer.span('stt'):
+                    stt_audio_text = stt_fun(audio_path)
                 if stt_audio_text:
                     messageBox("Backend audio STT", f"Trascrizione audio: {stt_audio_text}", StyleBox.Light)
-                    backEnd_msg2UI(stt_audio_text, message_id=message_id)  # Invia messaggio trascritto al frontend
-                    if stt_fun is not stt_mock:  # Invia messaggio trascritto al bot solo se veramente trascritto
-                        # Invia il messaggio al bot in un thread separato per non bloccare la risposta HTTP
-                        threading.Thread(target=send_to_copilot, args=(stt_audio_text,)).start()
+                    backEnd_msg2UI(stt_audio_text, message_id=message_id, room=sid)  # Invia messaggio trascritto al frontend
+                    if dispatch_command(stt_audio_text, sid):
+                        pass  # Comando di movimento eseguito localmente, il bot non serve
+                    elif stt_fun is not stt_mock:  # Invia messaggio trascritto al bot solo se veramente trascritto
+                        # Invia il messaggio al bot senza bloccare la risposta HTTP
+                        send_to_copilot(stt_audio_text, chat_client, sid)
                     else:
                         time.sleep(1)  # Simula un breve ritardo per il mock
                         messageBox("Backend audio STT to Bot", "Trascrizione audio non inviata al bot, Mock STT", StyleBox.Light)
-                        backEnd_msg2UI("Trascrizione audio non inviata al bot, Mock STT")  # Invia messaggio mock al frontend
+                        backEnd_msg2UI("Trascrizione audio non inviata al bot, Mock STT", room=sid)  # Invia messaggio mock al frontend
                 else:
                     messageBox("Backend audio STT", "Errore durante la trascrizione audio, impossibile distinguere parole", StyleBox.Light)
-                    backEnd_msg2UI("Impossibile trascrivere il messaggio audio, troppo corto o rumoroso", message_id=message_id)
+                    backEnd_msg2UI("Impossibile trascrivere il messaggio audio, troppo corto o rumoroso", message_id=message_id, room=sid)
                     time.sleep(1)  # Breve attesa per non bloccare la macchina a stati
-                    backEnd_msg2UI("Mi spiace ma non ho capito nulla, puoi ripetere da capo?")  # Invia messaggio frontend per ripetere
+                    backEnd_msg2UI(STT_RETRY_MESSAGE, room=sid)  # Invia messaggio frontend per ripetere
 
             threading.Thread(target=send_audio_thread, args=(temp_path, message_id,)).start()
             return jsonify({'success': True, 'file_path': audio_url, 'message_id': message_id})
@@ -319,45 +603,104 @@ def create_app(url: str, auth: str,
     @app.route('/temp/<path:filename>')
     def serve_audio(filename):
         """Serve temporary audio files"""
-        temp_dir = os.path.join(os.path.dirname(__file__), 'temp')
-        return send_from_directory(temp_dir, filename)
+        # Richieste parziali (Range) supportate, il browser può fare seek nell'audio senza riscaricarlo tutto
+        # Ogni registrazione ha un nome univoco, quindi il browser può tenerla in cache
+        return send_from_directory(temp_dir, filename, conditional=True, max_age=3600)
 
     # Aggiungi una route per verificare lo stato della connessione
     @app.route('/check-connection', methods=['GET'])
     def check_connection():
         """Check if the connection to the bot is active"""
-        is_connected = chat_client.running
-        if not is_connected:
-            # Tenta di riavviare la connessione se non è attiva
-            is_connected = chat_client.start_conversation()
+        sid = request.args.get('sid')
+        if sid not in connected_sids:
+            # Nessuna sessione Socket.IO nota: solo lo stato del pool, senza prendere una conversazione che nessuno rilascerebbe
+            stats = conversation_pool.stats()
+            is_connected = stats['active'] + stats['spares'] > 0
+            return jsonify({'connected': is_connected, 'status': 'active' if is_connected else 'disconnected', 'pool': stats})
+        # Tenta di riavviare la connessione della sessione se non è attiva
+        is_connected = session_client(sid) is not None
 
         return jsonify({
             'connected': is_connected,
             'status': 'active' if is_connected else 'disconnected'
         })
 
-    # Aggiungi route per check-server-status che risponde che il server è pronto
+    # Aggiungi route per check-server-status con lo stato di avvio di ogni sottosistema
     @app.route('/check-server-status')
     def server_status():
-        return jsonify({'ready': True})
+        if readiness is None:
+            return jsonify({'ready': True})
+        return jsonify(readiness.snapshot())
+
+    # Nuovo tentativo di caricamento di un sottosistema fallito (es. modello TTS non caricato, timeout dei worker STT)
+    @app.route('/retry-subsystem/<name>', methods=['POST'])
+    def retry_subsystem(name):
+        if readiness is None:
+            return jsonify({'success': False, 'error': 'Startup status not available'}), 404
+        if not readiness.retry(name):
+            return jsonify({'success': False, 'error': f'Subsystem {name} is not failed or cannot be retried'}), 409
+        return jsonify({'success': True})
+
+    # Aggiungi una route per le statistiche della cache delle risposte
+    @app.route('/answer-cache-stats')
+    def answer_cache_stats():
+        """Hit rate and saved latency of the answer cache"""
+        if answer_cache is None:
+            return jsonify({'enabled': False})
+        return jsonify({'enabled': True, **answer_cache.stats()})
+
+    # Aggiungi una route per le metriche di tutto il processo, nel formato di Prometheus
+    @app.route('/metrics')
+    def metrics_export():
+        """Prometheus text exposition of the process metrics"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    # Aggiungi una route per esportare le tracce delle interazioni
+    @app.route('/trace')
+    def trace_export():
+        """Chrome-trace JSON of the recent interactions (open it in chrome://tracing or ui.perfetto.dev)"""
+        return jsonify(tracer.chrome_trace(request.args.get('trace_id')))
+
+    @app.route('/trace-summary/<trace_id>')
+    def trace_summary(trace_id):
+        """Stage durations of one interaction"""
+        return jsonify(tracer.summary(trace_id))
 
     # Aggiungi una route per la pagina "Chi siamo"
     @app.route('/about')
     def about():
         """Serve the about page"""
-        with open(os.path.join(os.path.dirname(__file__), 'web-client/about.html'), 'r') as file:
-            html_content = file.read()
-        return html_content
+        return pages['about'].response()
+
+    # Aggiungi una route per la mappa del tavolo, per seguire robot e target senza la finestra della visione
+    @app.route('/map')
+    def table_map_page():
+        """Serve the live table map page"""
+        return pages['map'].response()
+
+    # Aggiungi una route per il video annotato della visione in MJPEG, attiva se è stato registrato uno stream
+    @app.route('/video')
+    def video_stream():
+        """MJPEG stream of the annotated table view, one JPEG encoding shared by all viewers"""
+        stream = app.extensions.get('ifab_video_stream')
+        if stream is None:
+            return jsonify({'error': 'Video della visione non disponibile'}), 404
+        response = Response(stream.frames(sleep=socketio.sleep), mimetype=f'multipart/x-mixed-replace; boundary={stream.boundary}')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
     # Gestione dell'evento di disconnessione Socket.IO
     @socketio.on('disconnect')
     def handle_disconnect():
         """Gestisce l'evento di disconnessione di un client Socket.IO"""
-        messageBox("Disconnessione frontend", "Client disconnesso", StyleBox.Light)
-        # Non chiudiamo la conversazione qui, poiché potrebbe essere un refresh della pagina
-        # e vogliamo mantenere la conversazione attiva per quando l'utente si riconnette
+        messageBox("Disconnessione frontend", f"Client {request.sid} disconnesso", StyleBox.Light)
+        connected_sids.discard(request.sid)
+        active_sessions.dec()
+        # Un refresh della pagina crea una nuova sessione, che riceve subito una conversazione pronta dal pool
+        conversation_pool.release(request.sid)
+        bot_history.discard(request.sid)
 
-    return app, socketio, chat_client
+    return app, socketio, conversation_pool
 
 
 """ Utility function for Argvparser"""
@@ -367,6 +710,19 @@ def flaskFrontEnd_argsAdd(parser: argparse.ArgumentParser) -> argparse.ArgumentP
     flaskFrontEndParser = parser.add_argument_group("Flask WebSocket server")
     flaskFrontEndParser.add_argument('--host', type=str, default='0.0.0.0', help="Host del server [default '%(default)s']")
     flaskFrontEndParser.add_argument('--port', type=int, default=8000, help="Porta del server [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--server', type=str, default='dev', choices=['dev', 'gunicorn'],
+                                     help="Server web: 'dev' Werkzeug con debug, 'gunicorn' un worker gunicorn a thread nativi, da usare in produzione [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--server_threads', type=int, default=64,
+                                     help="Thread del worker gunicorn, ognuno serve una richiesta o un websocket alla volta [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--conv_pool', type=int, default=2, help="Conversazioni con il bot aperte in anticipo per i nuovi browser [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--dl_client', type=str, default='async', choices=['async', 'thread'],
+                                     help="Client DirectLine: 'async' multiplexa le conversazioni su un event loop, 'thread' usa un thread per socket [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--conv_idle', type=int, default=600, help="Secondi di inattività prima di chiudere la conversazione di una sessione [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--no_local_commands', dest='local_commands', action='store_false',
+                                     help="Invia al bot anche i comandi di movimento invece di riconoscerli localmente")
+    flaskFrontEndParser.add_argument('--answer_cache_size', type=int, default=256, help="Risposte del bot tenute in cache per le domande ripetute, 0 per disabilitare [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--map_rate', type=float, default=10.0, help="Aggiornamenti al secondo della mappa del tavolo nel browser [default '%(default)s']")
+    flaskFrontEndParser.add_argument('--answer_cache_ttl', type=float, default=3600, help="Secondi di validità di una risposta in cache [default '%(default)s']")
     return flaskFrontEndParser
 
 
@@ -374,6 +730,39 @@ def flaskFrontEnd_useArgs(args: argparse.Namespace) -> tuple[str, int]:
     return args.host, args.port
 
 
+def run_server(app: Flask, socketio: SocketIO, host: str, port: int, server: str = 'dev'):
+    """Avvia il server di sviluppo Werkzeug con debug, bloccante; in produzione si usa run_gunicorn"""
+    socketio.run(app, host=host, port=port, debug=server == 'dev', allow_unsafe_werkzeug=True, use_reloader=False, log_output=server == 'dev')
+
+
+def run_gunicorn(app_factory: Callable[[], Flask], host: str, port: int, threads: int = 64, timeout: int = 120):
+    """
+    Server di produzione: gunicorn con un solo worker 'gthread', bloccante, da chiamare dal thread principale.
+    Thread nativi come la modalità 'threading' di Socket.IO, niente monkey patching; un solo worker perché
+    sessioni Socket.IO, conversazioni e robot vivono nella memoria del processo.
+    Il worker è un processo figlio: app_factory viene eseguita al suo interno dopo il fork e deve avviare lei
+    tutti i thread del sistema, quelli avviati prima nel processo padre non esisterebbero nel worker.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        messageBox("Errore server", "gunicorn non è installato: pip install gunicorn, oppure avviare con --server dev", StyleBox.Error)
+        raise
+
+    class _GunicornServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', 1)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('timeout', timeout)  # Anche l'avvio del sistema nel worker deve stare in questo tempo
+
+        def load(self):
+            return app_factory()
+
+    _GunicornServer().run()
+
+
 if __name__ == '__main__':
     def newSetPointMock(key):
         print(f"Nuovo setpoint per il robot: '{key}'")
@@ -383,50 +772,68 @@ if __name__ == '__main__':
     flaskFrontEnd_argsAdd(parser)  # Aggiungi gli argomenti per il server Flask
     ap.audioPlayer_argsAdd(parser)  # Aggiungi gli argomenti per l'AudioPlayer
     wl.whisperListener_argsAdd(parser)  # Aggiungi gli argomenti per il WhisperListener
+    lu.log_argsAdd(parser)  # Aggiungi gli argomenti per il logging
     args = parser.parse_args()
+    lu.log_useArgs(args)
 
     # Ottieni gli argomenti per il server Flask
     host, port = flaskFrontEnd_useArgs(args)
 
-    # Avvia il server temporaneo di welcome-page
-    run_temp_server(port)
-
-    # Inizializza TTS
-    player = ap.audioPlayer_useArgs(args)
-
-    # Inizializza STT
-    listener, listener_ready_event = wl.whisperListener_useArgs(args)
-
-
-    # Inizializza il client WebSocket per la comunicazione con il bot
-    # Token Bot Ema:
-    # url = "https://europe.directline.botframework.com/v3/directline/conversations"
-    # auth = "Bearer Ec99xFUkF1i7cR8m5TLtPokIlKXvLNdCxIYyDsraweBmf2zltwUZJQQJ99BCACi5YpzAArohAAABAZBSECEz.IpVjYOfmWMOQOHYGdH4G16pGKUArN1pEpAGJebfBjSrKI71E6ZhDJQQJ99BCACi5YpzAArohAAABAZBSMCrh"
-    # Token Bot Fondazione:
-    url = "https://europe.directline.botframework.com/v3/directline/conversations"
-    auth = "Bearer BI91xBzzXppQiRxyBjniBLPFctD8IGqIR0BCmQCyODxSZrZjLX7QJQQJ99BDACi5YpzAArohAAABAZBS4vKQ.DEsKhbDDeYsTi7cHcOgSMV4HrdEnNrJAPp8hTnCv55nxFqtKRfonJQQJ99BDACi5YpzAArohAAABAZBS4AHw"
-
-    # Lista di pulsanti statici (testo, percorso_immagine, testo da dire, chiave del dizionario da cui è stato generato)
-    zone_lavoro = [
-        {"text": "Zona saldatura", "img_path": "web-client/images/help.jpeg", "say": "Vado a saldare", "key": "saldatura"},
-        {"text": "Zona debug", "img_path": "web-client/images/weather.jpg", "say": "Mi dirigo alla strumentazione di analisi", "key": "debug"},
-        {"text": "Zona prototipazione", "img_path": "images/news.jpg", "say": "Vado sul tavolo di prototipazione", "key": "prototipazione"}
-    ]
-    macchinari = [
-        {"text": "Tagliatrice Laser", "img_path": "web-client/images/info.jpg", "say": "Vado dalla Tagliatrice Laser", "key": "laser"},
-        {"text": "Stampante 3D", "img_path": "web-client/images/commands.jpg", "say": "Vado verso la Stampante 3D", "key": "3d"},
-        {"text": "CNC", "img_path": "web-client/images/music.jpg", "say": "Mi dirigo verso la CNC", "key": "cnc"},
-        {"text": "Plotter", "img_path": "web-client/images/info.jpg", "say": "Sto andando dal Plotter", "key": "plotter"}
-    ]
-    # Crea l'app Flask e SocketIO con tutte le callback e le informazioni del progetto
-    app, socketio, chat_client = create_app(url, auth, zone_lavoro, macchinari,
-                                            ttsFun=player.play_text, sttFun=listener,
-                                            goBotFun=newSetPointMock)
-    
-    wl.wait_for_model_loading(listener_ready_event)
-
-    # Ferma il server temporaneo prima di avviare quello Flask
-    stop_temp_server()
+    def build_app() -> tuple[Flask, SocketIO]:
+        """Avvia il caricamento dei modelli e crea l'app, nel processo che servirà le richieste"""
+        # TTS e STT si caricano in parallelo mentre il server mostra la pagina di benvenuto
+        readiness = Readiness()
+        readiness.register('tts', "Sintesi vocale", required=False)
+        readiness.register('stt', "Riconoscimento vocale", required=False)
+
+        def load_stt():
+            listener, listener_ready_event = wl.whisperListener_useArgs(args)
+            if not wl.wait_for_model_loading(listener_ready_event):
+                listener_ready_event.terminate()  # Un nuovo tentativo avvia worker nuovi
+                raise TimeoutError("Timeout durante il caricamento del modello whisper")
+            return listener
+
+        readiness.start('tts', ap.audioPlayer_useArgs, args)
+        readiness.start('stt', load_stt)
+
+        # Inizializza il client WebSocket per la comunicazione con il bot
+        # Token Bot Ema:
+        # url = "https://europe.directline.botframework.com/v3/directline/conversations"
+        # auth = "Bearer Ec99xFUkF1i7cR8m5TLtPokIlKXvLNdCxIYyDsraweBmf2zltwUZJQQJ99BCACi5YpzAArohAAABAZBSECEz.IpVjYOfmWMOQOHYGdH4G16pGKUArN1pEpAGJebfBjSrKI71E6ZhDJQQJ99BCACi5YpzAArohAAABAZBSMCrh"
+        # Token Bot Fondazione:
+        url = "https://europe.directline.botframework.com/v3/directline/conversations"
+        auth = "Bearer BI91xBzzXppQiRxyBjniBLPFctD8IGqIR0BCmQCyODxSZrZjLX7QJQQJ99BDACi5YpzAArohAAABAZBS4vKQ.DEsKhbDDeYsTi7cHcOgSMV4HrdEnNrJAPp8hTnCv55nxFqtKRfonJQQJ99BDACi5YpzAArohAAABAZBS4AHw"
+
+        # Lista di pulsanti statici (testo, percorso_immagine, testo da dire, chiave del dizionario da cui è stato generato)
+        zone_lavoro = [
+            {"text": "Zona saldatura", "img_path": "web-client/images/help.jpeg", "say": "Vado a saldare", "key": "saldatura"},
+            {"text": "Zona debug", "img_path": "web-client/images/weather.jpg", "say": "Mi dirigo alla strumentazione di analisi", "key": "debug"},
+            {"text": "Zona prototipazione", "img_path": "images/news.jpg", "say": "Vado sul tavolo di prototipazione", "key": "prototipazione"}
+        ]
+        macchinari = [
+            {"text": "Tagliatrice Laser", "img_path": "web-client/images/info.jpg", "say": "Vado dalla Tagliatrice Laser", "key": "laser"},
+            {"text": "Stampante 3D", "img_path": "web-client/images/commands.jpg", "say": "Vado verso la Stampante 3D", "key": "3d"},
+            {"text": "CNC", "img_path": "web-client/images/music.jpg", "say": "Mi dirigo verso la CNC", "key": "cnc"},
+            {"text": "Plotter", "img_path": "web-client/images/info.jpg", "say": "Sto andando dal Plotter", "key": "plotter"}
+        ]
+        # Crea l'app Flask e SocketIO con tutte le callback e le informazioni del progetto
+        app, socketio, conversation_pool = create_app(url, auth, zone_lavoro, macchinari,
+                                                      ttsFun=lambda text, room: readiness.get('tts') and readiness.get('tts').play_text(text, room),
+                                                      sttFun=lambda audio_path: readiness.get('stt') and readiness.get('stt')(audio_path),
+                                                      stopTtsFun=lambda room: readiness.get('tts') and readiness.get('tts').cancel(room),
+                                                      goBotFun=newSetPointMock, pool_size=args.conv_pool, idle_timeout=args.conv_idle,
+                                                      async_client=args.dl_client == 'async',
+                                                      answer_cache_size=args.answer_cache_size, answer_cache_ttl=args.answer_cache_ttl,
+                                                      local_commands=args.local_commands,
+                                                      readiness=readiness, table_map_rate=args.map_rate)
+        return app, socketio
 
     # Avvia il server Flask con SocketIO
-    socketio.run(app, host=host, port=port, debug=True, allow_unsafe_werkzeug=True, use_reloader=False)  # Avvia il server Flask con SocketIO disabilitando il riavvio automatico
+    if args.server == 'gunicorn':
+        def worker_app():
+            lu.log_useArgs(args)  # Il thread del logging asincrono del processo padre non esiste nel worker
+            return build_app()[0]
+
+        run_gunicorn(worker_app, host, port, threads=args.server_threads)
+    else:
+        run_server(*build_app(), host, port, args.server)  # Avvia il server Flask con SocketIO disabilitando il riavvio automatico
@@ -0,0 +1,366 @@
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+try:
+    from chatLib.Tracer import tracer
+    from chatLib.util import *
+    from ifabChatWebSocket import IfabChatWebSocket, backoff_delay, _reconnects
+except ImportError:
+    from .chatLib.Tracer import tracer
+    from .chatLib.util import *
+    from .ifabChatWebSocket import IfabChatWebSocket, backoff_delay, _reconnects
+
+
+class DirectLineLoop:
+    """
+    Event loop asyncio condiviso da tutte le conversazioni DirectLine, in un unico thread.
+    Tutti i client usano la stessa ClientSession aiohttp, quindi lo stesso pool di connessioni keep-alive.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, limit=64, keepalive_timeout=60):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), daemon=True, name="directline-loop")
+        self.thread.start()
+        ready.wait()
+
+    @classmethod
+    def get(cls) -> 'DirectLineLoop':
+        """Restituisce il loop condiviso, avviandolo alla prima chiamata"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._setup())
+        ready.set()
+        self.loop.run_forever()
+
+    async def _setup(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive_timeout)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    def submit(self, coro):
+        """Esegue la coroutine nel loop e restituisce un concurrent.futures.Future, chiamabile da qualsiasi thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Esegue la coroutine nel loop e ne attende il risultato dal thread chiamante"""
+        return self.submit(coro).result(timeout=timeout)
+
+
+class IfabChatAsync(IfabChatWebSocket):
+    """
+    Client DirectLine 3.0 basato su asyncio: apertura della conversazione, invio delle activity,
+    stream websocket, ripresa dal watermark e polling di riserva girano tutti sull'event loop condiviso di DirectLineLoop,
+    senza thread dedicati per socket, riconnessione o invio.
+    Mantiene l'interfaccia di IfabChatWebSocket (callback, start_conversation, send_message, ...),
+    i metodi bloccanti possono essere chiamati da qualsiasi thread tranne quello del loop.
+    """
+
+    def __init__(self, url, auth_token, user_id="user1", dl_loop: DirectLineLoop | None = None, connect_timeout=5, read_timeout=30):
+        super().__init__(url, auth_token, user_id=user_id, connect_timeout=connect_timeout, read_timeout=read_timeout)
+        self.dl_loop = dl_loop if dl_loop is not None else DirectLineLoop.get()
+        self.client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.reader_task = None
+        self.watchdog_task = None
+        self.reconnect_task = None
+        self.callback_executor = None  # Thread delle callback di questa conversazione, creato al primo messaggio
+
+    @property
+    def http(self) -> aiohttp.ClientSession:
+        return self.dl_loop.session
+
+    # ------------------------------------------------------------------ callback
+    def _notify(self, callbacks, *args, reply_to=None):
+        """
+        Le callback (emit Socket.IO, cache delle risposte, TTS) non girano sul loop condiviso: una callback lenta fermerebbe
+        tutte le conversazioni. Vanno in un executor a thread singolo della conversazione, che ne mantiene l'ordine,
+        con il contesto corrente (interazione tracciata)
+        """
+        if not callbacks:
+            return
+        if self.callback_executor is None:
+            self.callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='directline-callbacks')
+        self.callback_executor.submit(contextvars.copy_context().run, self._run_callbacks, list(callbacks), args, reply_to)
+
+    def _run_callbacks(self, callbacks, args, reply_to):
+        try:
+            IfabChatWebSocket._notify(self, callbacks, *args, reply_to=reply_to)
+        except Exception as e:
+            print(f"Errore in una callback della conversazione {self.conversation_id}: {e}")
+
+    def _shutdown_callbacks(self):
+        """Le callback già accodate vengono comunque eseguite, l'executor si ricrea se la conversazione riparte"""
+        executor, self.callback_executor = self.callback_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------ stream
+    async def _connect_stream(self, stream_url) -> bool:
+        """Apre lo stream websocket e avvia il task di lettura"""
+        try:
+            self.ws = await self.http.ws_connect(stream_url, heartbeat=30, timeout=self.client_timeout.sock_connect)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"WebSocket error: {e}")
+            return False
+        self.running = True
+        self.closing = False
+        self.reader_task = asyncio.ensure_future(self._reader(self.ws))
+        if self.watchdog_task is None or self.watchdog_task.done():
+            self.watchdog_task = asyncio.ensure_future(self._awatchdog())
+        return True
+
+    async def _reader(self, ws):
+        """Legge lo stream fino alla chiusura, poi riprende la conversazione se la chiusura non è voluta"""
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self.on_message(ws, msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    self.on_error(ws, ws.exception())
+                    break
+        except asyncio.CancelledError:
+            return
+        if ws is not self.ws:
+            return  # Stream già sostituito da una riconnessione
+        self.running = False
+        if self.closing:
+            self.waiting_for_response = False
+            return
+        # La risposta in attesa non va persa, verrà recuperata dal watermark
+        messageBox("WebSocket", f"Connessione chiusa: codice {ws.close_code}", StyleBox.Light)
+        if not self.reconnecting and (self.reconnect_task is None or self.reconnect_task.done()):
+            self.reconnecting = True
+            # Riferimento conservato: un task senza riferimenti può essere raccolto dal garbage collector a metà
+            self.reconnect_task = asyncio.ensure_future(self._areconnect())
+            self.reconnect_task.add_done_callback(self._reconnect_done)
+
+    def _reconnect_done(self, task: asyncio.Task):
+        """Recupera l'esito della riconnessione, un'eccezione viene segnalata e permette un nuovo tentativo"""
+        if task.cancelled():
+            self.reconnecting = False
+            return
+        error = task.exception()
+        if error is not None:
+            self.reconnecting = False
+            messageBox("Errore Riconnessione", f"Errore durante la riconnessione: {type(error).__name__}: {error}", StyleBox.Error)
+
+    async def _areconnect(self):
+        """Riprende la conversazione dal watermark tramite l'endpoint di riconnessione, altrimenti ne apre una nuova"""
+        messageBox("WebSocket", "Tentativo di riconnessione automatica...", StyleBox.Light)
+        for attempt in range(1, self.max_retries + 1):
+            await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+            if self.closing or self.conversation_id is None:
+                break
+            _reconnects.inc()
+            # Le risposte arrivate durante la disconnessione si recuperano subito via GET
+            await self.apoll_activities()
+            url = f"{self.url}/{self.conversation_id}"
+            params = {'watermark': self.watermark} if self.watermark else None
+            try:
+                async with self.http.get(url, headers=self.conversation_headers, params=params, timeout=self.client_timeout) as response:
+                    if response.status != 200:
+                        print(f"Errore nella ripresa della conversazione: HTTP {response.status}")
+                        continue
+                    data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Errore nella ripresa della conversazione: {e}")
+                continue
+            self._set_token(data)
+            if data.get('streamUrl') and await self._connect_stream(data['streamUrl']):
+                messageBox("Riconnessione", f"Conversazione {self.conversation_id} ripresa dal watermark {self.watermark}", StyleBox.Light)
+                self.reconnecting = False
+                return True
+        if self.closing:
+            self.reconnecting = False
+            return False
+        # La conversazione non è recuperabile: il contesto è perso, l'utente deve saperlo
+        self._notify(self.error_callbacks, "Connessione interrotta: la conversazione con il bot è stata riavviata")
+        return await self.astart_conversation()
+
+    async def apoll_activities(self) -> bool:
+        """Versione asincrona di poll_activities"""
+        if not self.conversation_id:
+            return False
+        self.last_poll_time = time.time()
+        params = {'watermark': self.watermark} if self.watermark else None
+        try:
+            async with self.http.get(f"{self.url}/{self.conversation_id}/activities", headers=self.conversation_headers,
+                                     params=params, timeout=self.client_timeout) as response:
+                if response.status != 200:
+                    print(f"Errore nel recupero delle activity: HTTP {response.status}")
+                    return False
+                self._process_activities(await response.json())
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Errore nel recupero delle activity: {e}")
+            return False
+
+    async def _awatchdog(self):
+        """Interroga le activity via GET quando lo stream si blocca con una risposta in attesa"""
+        while not self.closing and self.conversation_id is not None:
+            await asyncio.sleep(1)
+            if self.is_stalled():
+                messageBox("WebSocket", "Stream fermo, recupero le activity via GET", StyleBox.Light)
+                await self.apoll_activities()
+
+    # ------------------------------------------------------------------ conversazione
+    async def astart_conversation(self) -> bool:
+        """Versione asincrona di start_conversation, da eseguire nel loop condiviso"""
+        if not self.reconnecting:
+            self.retry_count = 0
+
+        while self.retry_count < self.max_retries:
+            if self.retry_count > 0:
+                delay = backoff_delay(self.retry_count, self.base_delay, self.max_delay)
+                messageBox("Riconnessione", f"Tentativo {self.retry_count}/{self.max_retries} - Attesa di {delay:.1f} secondi", StyleBox.Light)
+                await asyncio.sleep(delay)
+            try:
+                messageBox("Connessione", f"Tentativo di connessione a {self.url}", StyleBox.Light)
+                async with self.http.post(self.url, headers=self.headers, timeout=self.client_timeout) as response:
+                    if response.status != 201:
+                        print(f"Error starting conversation: HTTP {response.status}")
+                        self.retry_count += 1
+                        continue
+                    conv_data = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                messageBox("Errore Connessione", f"Errore di connessione: {e}", StyleBox.Dash_Bold)
+                self.retry_count += 1
+                continue
+
+            self.conversation_id = conv_data['conversationId']
+            self._reset_activity_state()
+            self._set_token(conv_data)
+            stream_url = conv_data.get('streamUrl')
+            if not stream_url:
+                print("No stream URL provided in the response")
+                self.retry_count += 1
+                continue
+
+            messageBox("Connessione", f"Conversazione avviata con ID: {self.conversation_id}", StyleBox.Light)
+            if await self._connect_stream(stream_url):
+                self.retry_count = 0
+                self.reconnecting = False
+                return True
+            print("WebSocket connection timed out")
+            self.retry_count += 1
+
+        self.reconnecting = False
+        error_msg = f"Impossibile connettersi dopo {self.max_retries} tentativi"
+        messageBox("Errore Connessione", error_msg, StyleBox.Error)
+        self._notify(self.error_callbacks, error_msg)
+        return False
+
+    async def asend_message(self, text, on_sent=None) -> bool:
+        """Versione asincrona di send_message, da eseguire nel loop condiviso"""
+        if not self.conversation_id:
+            messageBox("Riconnessione", "Tentativo di riavvio della conversazione...", StyleBox.Light)
+            if not await self.astart_conversation():
+                self._notify(self.error_callbacks, "Nessuna conversazione attiva")
+                return False
+
+        body = {"locale": "it-IT", "type": "message", "from": {"id": self.user_id}, "text": text}
+        max_send_retries = 3
+        for send_retries in range(max_send_retries):
+            if send_retries > 0:
+                await asyncio.sleep(backoff_delay(send_retries, self.base_delay, self.max_delay))
+            self.waiting_for_response = True
+            activity_url = f"{self.url}/{self.conversation_id}/activities"
+            try:
+                # Il task eredita il contesto di chi ha chiamato send_message_nowait, quindi l'interazione in corso
+                with tracer.span('directline.post', attempt=send_retries + 1):
+                    async with self.http.post(activity_url, headers=self.conversation_headers, json=body, timeout=self.client_timeout) as response:
+                        status = response.status
+                        reply = await response.text() if status == 200 else ''
+                if status == 200:
+                    self.pending_since = time.time()
+                    self._begin_reply_wait()
+                    if on_sent is not None:
+                        self._notify([on_sent], self._activity_id(lambda: json.loads(reply)))
+                    return True
+                messageBox("Errore", f"Errore nell'invio del messaggio: HTTP {status}", StyleBox.Dash_Bold)
+                if status in [401, 403]:
+                    messageBox("Riconnessione", "Tentativo di riavvio della conversazione per errore di autenticazione...", StyleBox.Light)
+                    await self.astop_conversation()
+                    await self.astart_conversation()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                messageBox("Errore", f"Errore di connessione durante l'invio: {e}", StyleBox.Dash_Bold)
+
+        self.waiting_for_response = False
+        error_msg = f"Impossibile inviare il messaggio dopo {max_send_retries} tentativi"
+        messageBox("Errore", error_msg, StyleBox.Dash_Bold)
+        self._notify(self.error_callbacks, error_msg)
+        return False
+
+    async def arefresh_token(self) -> bool:
+        if not self.token:
+            return False
+        try:
+            async with self.http.post(self.token_url, headers={"Authorization": f"Bearer {self.token}"}, timeout=self.client_timeout) as response:
+                if response.status != 200:
+                    print(f"Errore nel rinnovo del token: HTTP {response.status}")
+                    return False
+                self._set_token(await response.json())
+                return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Errore nel rinnovo del token: {e}")
+            return False
+
+    async def astop_conversation(self):
+        self.closing = True
+        self.running = False
+        if self.ws is not None:
+            await self.ws.close()
+        for task in (self.reader_task, self.watchdog_task, self.reconnect_task):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self.conversation_id = None
+        self.token = None
+        self.token_expires_at = None
+        self.ws = None
+        self.reader_task = None
+        self.watchdog_task = None
+        self.reconnect_task = None
+        self._reset_activity_state()
+        self.waiting_for_response = False
+
+    # ------------------------------------------------------------------ interfaccia bloccante, compatibile con IfabChatWebSocket
+    def start_conversation(self):
+        return self.dl_loop.run(self.astart_conversation())
+
+    def send_message(self, text, on_sent=None):
+        return self.dl_loop.run(self.asend_message(text, on_sent))
+
+    def send_message_nowait(self, text, on_sent=None):
+        """Invia il messaggio senza attendere l'esito, restituisce un concurrent.futures.Future"""
+        return self.dl_loop.submit(self.asend_message(text, on_sent))
+
+    def refresh_token(self) -> bool:
+        return self.dl_loop.run(self.arefresh_token())
+
+    def stop_conversation(self):
+        """Terminate the current conversation with the bot and reset all variables"""
+        self.dl_loop.run(self.astop_conversation())
+        self._shutdown_callbacks()
+        print("Conversation stopped and variables reset")
+        return True
+
+    def close(self):
+        """Close the WebSocket connection"""
+        self.dl_loop.run(self.astop_conversation())
+        self._shutdown_callbacks()
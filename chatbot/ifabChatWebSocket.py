@@ -1,35 +1,88 @@
+import contextvars
 import json
 import os
 import random
 import threading
 import time
+from collections import OrderedDict
 
 import certifi
 import requests
 import websocket
+from requests.adapters import HTTPAdapter
 
 try:
+    from chatLib.Metrics import metrics
+    from chatLib.Tracer import current_trace, tracer
     from chatLib.util import *
 except ImportError:
+    from .chatLib.Metrics import metrics
+    from .chatLib.Tracer import current_trace, tracer
     from .chatLib.util import *
 
 # Add this line near the beginning of your code, before any network requests
 os.environ['SSL_CERT_FILE'] = certifi.where()
 
+# Metriche condivise da tutte le conversazioni, comprese quelle del client asincrono
+_reply_seconds = metrics.histogram('ifab_directline_reply_seconds', "Attesa fra l'invio di un messaggio e la prima risposta del bot")
+_reconnects = metrics.counter('ifab_directline_reconnects_total', "Tentativi di ripresa dello stream DirectLine dopo una disconnessione")
+
+# Activity dell'utente a cui risponde l'activity del bot in elaborazione, impostata durante le callback
+_reply_to = contextvars.ContextVar('directline_reply_to', default=None)
+
+
+def current_reply_to() -> str | None:
+    """Id dell'activity dell'utente (restituito da send_message tramite on_sent) a cui risponde il messaggio del bot in consegna"""
+    return _reply_to.get()
+
+
+# Sessione HTTP condivisa da tutte le conversazioni: le connessioni TCP/TLS verso DirectLine restano aperte (keep-alive)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session(pool_connections=4, pool_maxsize=16) -> requests.Session:
+    """
+    Restituisce la sessione HTTP condivisa, creandola alla prima chiamata.
+
+    Args:
+        pool_connections: Numero di host distinti per cui mantenere un pool di connessioni
+        pool_maxsize: Numero massimo di connessioni aperte in parallelo verso lo stesso host
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # I tentativi sono gestiti dal client con backoff esponenziale, l'adapter non deve ripetere le richieste
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0) -> float:
+    """Attesa prima del tentativo 'attempt' (da 1): backoff esponenziale con jitter completo, per evitare tentativi sincronizzati"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
 
 class IfabChatWebSocket:
     """ Class to manage WebSocket connection to the Ifab Chatbot API and the backend"""
 
-    def __init__(self, url, auth_token, user_id="user1"):
+    def __init__(self, url, auth_token, user_id="user1", session: requests.Session | None = None, connect_timeout=5, read_timeout=30):
         # Connection parameters
         self.url = url
         self.headers = {
             "Authorization": auth_token,
             "Content-Type": "application/json"
         }
+        self.session = session if session is not None else get_http_session()
+        self.timeout = (connect_timeout, read_timeout)  # Timeout separati per connessione e risposta
         self.user_id = user_id
         # State variables
         self.conversation_id = None
+        self.token = None  # Token della conversazione restituito da DirectLine, rinnovabile
+        self.token_expires_at = None
         self.ws = None
         self.ws_thread = None
         self.running = False
@@ -37,6 +90,20 @@ class IfabChatWebSocket:
         self.waiting_for_response = False
         self.message_callbacks = []
         self.error_callbacks = []
+        self.partial_callbacks = []
+        self.streams = {}  # streamId -> (streamSequence, testo ricevuto finora) delle risposte in streaming
+        # Recupero delle activity perse: id già elaborati, ultimo traffico sullo stream e risposta in attesa
+        self.seen_ids = OrderedDict()
+        self.max_seen_ids = 512
+        self.activity_lock = threading.Lock()
+        self.last_stream_time = 0.0
+        self.pending_since = None  # Istante dell'ultimo invio ancora senza risposta del bot
+        self.trace_id = None  # Interazione dell'ultimo messaggio inviato, attiva durante le callback della risposta
+        self.reply_span = None  # Attesa della prima risposta del bot
+        self.stall_timeout = 5  # Secondi senza traffico sullo stream prima di interrogare le activity via GET
+        self.last_poll_time = 0.0
+        self.watchdog_thread = None
+        self.closing = False
         # Reconnection parameters
         self.max_retries = 5
         self.base_delay = 1  # Base delay in seconds
@@ -52,69 +119,257 @@ class IfabChatWebSocket:
         """Add a callback function to be called when an error occurs"""
         self.error_callbacks.append(callback)
 
+    def add_partial_callback(self, callback):
+        """
+        Add a callback function to be called for each chunk of a streamed reply
+        callback(stream_id, delta, text, final): delta è il testo nuovo, text la risposta ricevuta finora.
+        Senza callback di streaming le risposte vengono consegnate solo complete ai message callback.
+        """
+        self.partial_callbacks.append(callback)
+
+    def _notify(self, callbacks, *args, reply_to=None):
+        """Chiama le callback registrate; durante la chiamata current_reply_to() restituisce reply_to"""
+        token = _reply_to.set(reply_to)
+        try:
+            for callback in list(callbacks):
+                callback(*args)
+        finally:
+            _reply_to.reset(token)
+
     def on_message(self, ws, message):
         """Handle incoming WebSocket messages"""
+        self.last_stream_time = time.time()  # Anche gli heartbeat vuoti indicano che lo stream è vivo
         # Skip empty messages
         if not message or message.isspace():
             return
 
         try:
-            data = json.loads(message)
-            if 'activities' in data and data['activities']:
-                for activity in data['activities']:
-                    # Only process messages from the bot
-                    if activity.get('from', {}).get('id') != self.user_id and activity.get('type') == 'message' and activity.get('text') is not None:
-                        # Stampa il messaggio ricevuto per debug
-                        messageBox("Copilot", activity.get('text', 'no-text'))
-
-                        # Notify all callbacks
-                        for callback in self.message_callbacks:
-                            callback(activity.get('text', ''))
-
-                        # Imposta waiting_for_response a False per fermare l'animazione
-                        self.waiting_for_response = False
-
-                    # Update watermark
-                    if 'id' in activity:
-                        self.watermark = activity['id'].split('|')[1]
+            self._process_activities(json.loads(message))
         except json.JSONDecodeError:
             # Only log the error if it's not a heartbeat or empty message
             if message and len(message) > 2:  # Ignore likely heartbeat messages
                 print("Error decoding message: ", message[:100] + "..." if len(message) > 100 else message)
         except Exception as e:
             print(f"Error processing message: {e}")
-            for callback in self.error_callbacks:
-                callback(str(e))
+            self._notify(self.error_callbacks, str(e))
+
+    def _begin_reply_wait(self):
+        """Messaggio inviato: da qui si misura l'attesa della risposta del bot"""
+        self.trace_id = current_trace()
+        self.reply_span = tracer.span('directline.reply', trace_id=self.trace_id, conversation=self.conversation_id)
+
+    def _end_reply_wait(self):
+        if self.reply_span is not None:
+            _reply_seconds.observe(time.perf_counter() - self.reply_span.start)
+            self.reply_span.end()
+            self.reply_span = None
+
+    def _process_activities(self, data):
+        """Elabora un blocco di activity, dallo stream o dal polling, scartando quelle già viste"""
+        # Le callback della risposta (UI, TTS, robot) vengono attribuite all'interazione del messaggio inviato
+        with self.activity_lock, tracer.use(self.trace_id):
+            for activity in data.get('activities') or []:
+                activity_id = activity.get('id')
+                if activity_id:
+                    # Dopo una ripresa dal watermark o un polling la stessa activity può arrivare due volte
+                    if activity_id in self.seen_ids:
+                        continue
+                    self.seen_ids[activity_id] = None
+                    if len(self.seen_ids) > self.max_seen_ids:
+                        self.seen_ids.popitem(last=False)
+
+                # Update watermark
+                if activity_id and '|' in activity_id:
+                    self.watermark = activity_id.split('|')[1]
+
+                from_bot = activity.get('from', {}).get('id') != self.user_id
+                if from_bot and self.partial_callbacks and self._process_stream(activity):
+                    continue
+
+                # Only process messages from the bot
+                if from_bot and activity.get('type') == 'message' and activity.get('text') is not None:
+                    # Stampa il messaggio ricevuto per debug
+                    messageBox("Copilot", activity.get('text', 'no-text'))
+                    self._end_reply_wait()
+
+                    # Notify all callbacks
+                    self._notify(self.message_callbacks, activity.get('text', ''), reply_to=activity.get('replyToId'))
+
+                    # Imposta waiting_for_response a False per fermare l'animazione
+                    self.waiting_for_response = False
+                    self.pending_since = None
+            if data.get('watermark'):
+                self.watermark = data['watermark']
+
+    @staticmethod
+    def _stream_info(activity) -> dict | None:
+        """Informazioni di streaming della activity (Copilot Studio): in channelData o in un'entità 'streaminfo'"""
+        channel_data = activity.get('channelData') or {}
+        if 'streamType' in channel_data:
+            return channel_data
+        for entity in activity.get('entities') or []:
+            if entity.get('type') == 'streaminfo':
+                return entity
+        return None
+
+    def _process_stream(self, activity) -> bool:
+        """Gestisce i pezzi di una risposta in streaming, restituisce False se la activity va trattata come messaggio normale"""
+        info = self._stream_info(activity)
+        if info is None or info.get('streamType') == 'informative':
+            # Le typing informative ("sto cercando...") non contengono la risposta
+            return activity.get('type') == 'typing'
+        stream_id = info.get('streamId') or activity.get('id')  # Il primo pezzo non ha streamId, gli altri usano il suo id
+        text = activity.get('text') or ''
+        final = activity.get('type') == 'message' or info.get('streamType') == 'final'
+
+        self._end_reply_wait()
+        if final:
+            if stream_id not in self.streams:
+                return False  # Risposta finale senza pezzi precedenti
+            _, previous = self.streams.pop(stream_id)
+        else:
+            sequence = info.get('streamSequence', 0)
+            last_sequence, previous = self.streams.get(stream_id, (-1, ''))
+            if sequence <= last_sequence or not text:
+                return True  # Pezzo fuori ordine o vuoto, il successivo contiene comunque tutto il testo
+        # I pezzi contengono il testo cumulativo, il delta è la parte nuova
+        delta = text[len(previous):] if text.startswith(previous) else text
+        if not final:
+            self.streams[stream_id] = (sequence, text)
+        else:
+            messageBox("Copilot", text)
+            self.waiting_for_response = False
+            self.pending_since = None
+        self._notify(self.partial_callbacks, stream_id, delta, text, final, reply_to=activity.get('replyToId'))
+        return True
+
+    def _reset_activity_state(self):
+        """Nuova conversazione: watermark e id visti della precedente non sono più validi"""
+        with self.activity_lock:
+            self.watermark = None
+            self.seen_ids.clear()
+            self.streams.clear()
+            self.pending_since = None
+
+    def poll_activities(self) -> bool:
+        """Recupera via GET le activity successive al watermark, usato quando lo stream è fermo o in riconnessione"""
+        if not self.conversation_id:
+            return False
+        self.last_poll_time = time.time()
+        try:
+            response = self.session.get(f"{self.url}/{self.conversation_id}/activities", headers=self.conversation_headers,
+                                        params={'watermark': self.watermark} if self.watermark else None, timeout=self.timeout)
+            if response.status_code != 200:
+                print(f"Errore nel recupero delle activity: HTTP {response.status_code}")
+                return False
+            self._process_activities(response.json())
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"Errore nel recupero delle activity: {e}")
+            return False
+
+    def is_stalled(self) -> bool:
+        """Vero se si attende una risposta e lo stream tace da più di stall_timeout secondi (e non si è appena interrogato)"""
+        if self.pending_since is None:
+            return False
+        now = time.time()
+        last_traffic = max(self.last_stream_time, self.pending_since, self.last_poll_time)
+        return now - last_traffic > self.stall_timeout
+
+    def _watchdog(self):
+        """Interroga le activity via GET quando lo stream si blocca con una risposta in attesa"""
+        while not self.closing and self.conversation_id is not None:
+            time.sleep(1)
+            if self.is_stalled():
+                messageBox("WebSocket", "Stream fermo, recupero le activity via GET", StyleBox.Light)
+                self.poll_activities()
 
     def on_error(self, ws, error):
         print(f"WebSocket error: {error}")
         self.waiting_for_response = False
-        for callback in self.error_callbacks:
-            callback(str(error))
+        self._notify(self.error_callbacks, str(error))
 
     def on_close(self, ws, close_status_code, close_msg):
+        if ws is not self.ws:
+            return  # Stream già sostituito da una riconnessione
         messageBox("WebSocket", f"Connessione chiusa: codice {close_status_code}, messaggio: {close_msg}", StyleBox.Light)
         self.running = False
-        self.waiting_for_response = False
-
-        # Non tentiamo di riconnetterci per chiusure normali (codice 1000 o 1001)
-        if close_status_code is not None and close_status_code not in [1000, 1001]:
-            # Notifica l'utente del problema
-            for callback in self.error_callbacks:
-                callback(f"Connessione interrotta: {close_msg if close_msg else 'Motivo sconosciuto'}")
 
-            # Avvia un tentativo di riconnessione in un thread separato
+        # Non tentiamo di riconnetterci per chiusure volute o normali (codice 1000 o 1001)
+        if not self.closing and close_status_code not in [1000, 1001]:
+            # Avvia un tentativo di riconnessione in un thread separato, la risposta in attesa non va persa
             if not self.reconnecting:
                 self.reconnecting = True
-                threading.Thread(target=self._reconnect).start()
+                threading.Thread(target=self._reconnect, daemon=True).start()
+        else:
+            self.waiting_for_response = False
 
     def _reconnect(self):
-        """Attempt to reconnect to the WebSocket after a connection failure"""
+        """Attempt to reconnect to the WebSocket after a connection failure, resuming from the stored watermark"""
         messageBox("WebSocket", "Tentativo di riconnessione automatica...", StyleBox.Light)
-        # Breve pausa prima di tentare la riconnessione
-        time.sleep(1)
+        for attempt in range(1, self.max_retries + 1):
+            time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+            if self.closing or self.conversation_id is None:
+                break
+            _reconnects.inc()
+            # Le risposte arrivate durante la disconnessione si recuperano subito via GET
+            self.poll_activities()
+            try:
+                # Endpoint di riconnessione: nuovo streamUrl che riparte dal watermark
+                response = self.session.get(f"{self.url}/{self.conversation_id}", headers=self.conversation_headers,
+                                            params={'watermark': self.watermark} if self.watermark else None, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                print(f"Errore nella ripresa della conversazione: {e}")
+                continue
+            if response.status_code != 200:
+                print(f"Errore nella ripresa della conversazione: HTTP {response.status_code}")
+                continue
+            data = response.json()
+            self._set_token(data)
+            if data.get('streamUrl') and self._open_stream(data['streamUrl']):
+                messageBox("Riconnessione", f"Conversazione {self.conversation_id} ripresa dal watermark {self.watermark}", StyleBox.Light)
+                self.reconnecting = False
+                return
+
+        if self.closing:
+            self.reconnecting = False
+            return
+        # La conversazione non è recuperabile: il contesto è perso, l'utente deve saperlo
+        self._notify(self.error_callbacks, "Connessione interrotta: la conversazione con il bot è stata riavviata")
         self.start_conversation()
 
+    def _open_stream(self, stream_url) -> bool:
+        """Apre lo stream websocket in un thread dedicato e attende la connessione"""
+        self.closing = False
+        # Connect to WebSocket with ping interval to keep connection alive
+        websocket.enableTrace(False)  # Disable verbose logging
+        self.ws = websocket.WebSocketApp(
+            stream_url,
+            on_message=self.on_message,
+            on_error=self.on_error,
+            on_close=self.on_close,
+            on_open=self.on_open
+        )
+
+        # Start WebSocket connection in a separate thread with ping interval
+        ws = self.ws
+        self.ws_thread = threading.Thread(
+            target=lambda: ws.run_forever(ping_interval=30, ping_timeout=10)
+        )
+        self.ws_thread.daemon = True
+        self.ws_thread.start()
+
+        # Wait for connection to establish
+        timeout = 5
+        start_time = time.time()
+        while not self.running and time.time() - start_time < timeout:
+            time.sleep(0.1)
+
+        if self.running and (self.watchdog_thread is None or not self.watchdog_thread.is_alive()):
+            self.watchdog_thread = threading.Thread(target=self._watchdog, daemon=True)
+            self.watchdog_thread.start()
+        return self.running
+
     def on_open(self, ws):
         print("WebSocket connection established")
         self.running = True
@@ -130,13 +385,13 @@ class IfabChatWebSocket:
                 # If we're retrying, add a delay with exponential backoff
                 if self.retry_count > 0:
                     # Calculate delay with jitter to prevent thundering herd problem
-                    delay = min(self.base_delay * (2 ** (self.retry_count - 1)) + random.uniform(0, 1), self.max_delay)
+                    delay = backoff_delay(self.retry_count, self.base_delay, self.max_delay)
                     messageBox("Riconnessione", f"Tentativo {self.retry_count}/{self.max_retries} - Attesa di {delay:.1f} secondi", StyleBox.Light)
                     time.sleep(delay)
 
                 # Start a new conversation
                 messageBox("Connessione", f"Tentativo di connessione a {self.url}", StyleBox.Light)
-                response = requests.post(self.url, headers=self.headers, timeout=30)  # Add explicit timeout
+                response = self.session.post(self.url, headers=self.headers, timeout=self.timeout)
 
                 if response.status_code != 201:
                     error_msg = f"Error starting conversation: HTTP {response.status_code}"
@@ -147,6 +402,8 @@ class IfabChatWebSocket:
 
                 conv_data = response.json()
                 self.conversation_id = conv_data['conversationId']
+                self._reset_activity_state()
+                self._set_token(conv_data)
                 stream_url = conv_data.get('streamUrl')
 
                 if not stream_url:
@@ -157,30 +414,7 @@ class IfabChatWebSocket:
 
                 messageBox("Connessione", f"Conversazione avviata con ID: {self.conversation_id}", StyleBox.Light)
 
-                # Connect to WebSocket with ping interval to keep connection alive
-                websocket.enableTrace(False)  # Disable verbose logging
-                self.ws = websocket.WebSocketApp(
-                    stream_url,
-                    on_message=self.on_message,
-                    on_error=self.on_error,
-                    on_close=self.on_close,
-                    on_open=self.on_open
-                )
-
-                # Start WebSocket connection in a separate thread with ping interval
-                self.ws_thread = threading.Thread(
-                    target=lambda: self.ws.run_forever(ping_interval=30, ping_timeout=10)
-                )
-                self.ws_thread.daemon = True
-                self.ws_thread.start()
-
-                # Wait for connection to establish
-                timeout = 5
-                start_time = time.time()
-                while not self.running and time.time() - start_time < timeout:
-                    time.sleep(0.1)
-
-                if self.running:
+                if self._open_stream(stream_url):
                     # Reset retry count on successful connection
                     self.retry_count = 0
                     self.reconnecting = False
@@ -214,13 +448,55 @@ class IfabChatWebSocket:
         self.reconnecting = False
         error_msg = f"Impossibile connettersi dopo {self.max_retries} tentativi"
         messageBox("Errore Connessione", error_msg, StyleBox.Error)
-        for callback in self.error_callbacks:
-            callback(error_msg)
+        self._notify(self.error_callbacks, error_msg)
         return False
 
+    def _set_token(self, data):
+        """Memorizza il token della conversazione e la sua scadenza, se presenti nella risposta di DirectLine"""
+        if data.get('token'):
+            self.token = data['token']
+            self.token_expires_at = time.time() + data.get('expires_in', 1800)
+
+    @property
+    def token_url(self) -> str:
+        """Endpoint per il rinnovo del token, ricavato dall'URL delle conversazioni"""
+        return self.url.rsplit('/conversations', 1)[0] + "/tokens/refresh"
+
+    @property
+    def conversation_headers(self) -> dict:
+        """Header per le chiamate sulla conversazione: token della conversazione se disponibile, altrimenti il segreto"""
+        if self.token:
+            return {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        return self.headers
+
+    def refresh_token(self) -> bool:
+        """Rinnova il token della conversazione prima che scada, senza chiudere lo stream"""
+        if not self.token:
+            return False
+        try:
+            response = self.session.post(self.token_url, headers={"Authorization": f"Bearer {self.token}"}, timeout=self.timeout)
+            if response.status_code != 200:
+                print(f"Errore nel rinnovo del token: HTTP {response.status_code}")
+                return False
+            self._set_token(response.json())
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"Errore nel rinnovo del token: {e}")
+            return False
+
+    def clear_callbacks(self):
+        """Rimuove tutti i callback registrati, usato quando la conversazione passa a un altro utente"""
+        self.message_callbacks.clear()
+        self.error_callbacks.clear()
+        self.partial_callbacks.clear()
+
     # TODO: aggiungere tipo una callback al sistema della telecamera, per avere lo stato corrente del robot
-    def send_message(self, text):
-        """Send a message to the bot using REST API with retry mechanism"""
+    def send_message(self, text, on_sent=None):
+        """
+        Send a message to the bot using REST API with retry mechanism
+        on_sent(activity_id) viene chiamata quando DirectLine accetta il messaggio, con l'id che le risposte
+        del bot riportano in replyToId (vedi current_reply_to)
+        """
         if not self.conversation_id:
             error_msg = "Nessuna conversazione attiva"
             messageBox("Errore", error_msg, StyleBox.Dash_Bold)
@@ -228,8 +504,7 @@ class IfabChatWebSocket:
             # Tenta di riavviare la conversazione
             messageBox("Riconnessione", "Tentativo di riavvio della conversazione...", StyleBox.Light)
             if not self.start_conversation():
-                for callback in self.error_callbacks:
-                    callback(error_msg)
+                self._notify(self.error_callbacks, error_msg)
                 return False
 
             # Se la riconnessione ha avuto successo, continua con l'invio del messaggio
@@ -256,7 +531,8 @@ class IfabChatWebSocket:
 
                 # Send the message with timeout
                 messageBox("Invio", f"Invio messaggio (tentativo {send_retries + 1}/{max_send_retries})...", StyleBox.Light)
-                response = requests.post(activity_url, headers=self.headers, json=body, timeout=30)
+                with tracer.span('directline.post', attempt=send_retries + 1):
+                    response = self.session.post(activity_url, headers=self.conversation_headers, json=body, timeout=self.timeout)
 
                 if response.status_code != 200:
                     error_msg = f"Errore nell'invio del messaggio: HTTP {response.status_code}"
@@ -273,10 +549,14 @@ class IfabChatWebSocket:
 
                     # Attendi prima di riprovare
                     if send_retries < max_send_retries:
-                        time.sleep(2 * send_retries)  # Backoff lineare
+                        time.sleep(backoff_delay(send_retries, self.base_delay, self.max_delay))
                     continue
 
-                # Messaggio inviato con successo
+                # Messaggio inviato con successo, da qui il watchdog controlla che la risposta arrivi
+                self.pending_since = time.time()
+                self._begin_reply_wait()
+                if on_sent is not None:
+                    self._notify([on_sent], self._activity_id(response.json))
                 return True
 
             except requests.exceptions.Timeout:
@@ -284,7 +564,7 @@ class IfabChatWebSocket:
                 messageBox("Errore", error_msg, StyleBox.Dash_Bold)
                 send_retries += 1
                 if send_retries < max_send_retries:
-                    time.sleep(2 * send_retries)
+                    time.sleep(backoff_delay(send_retries, self.base_delay, self.max_delay))
                 continue
 
             except requests.exceptions.ConnectionError as e:
@@ -297,7 +577,7 @@ class IfabChatWebSocket:
                     activity_url = f"{self.url}/{self.conversation_id}/activities"
                     send_retries += 1
                     if send_retries < max_send_retries:
-                        time.sleep(2 * send_retries)
+                        time.sleep(backoff_delay(send_retries, self.base_delay, self.max_delay))
                     continue
                 else:
                     # Se la riconnessione fallisce, interrompi i tentativi
@@ -308,19 +588,32 @@ class IfabChatWebSocket:
                 messageBox("Errore", error_msg, StyleBox.Dash_Bold)
                 send_retries += 1
                 if send_retries < max_send_retries:
-                    time.sleep(2 * send_retries)
+                    time.sleep(backoff_delay(send_retries, self.base_delay, self.max_delay))
                 continue
 
         # Se arriviamo qui, tutti i tentativi sono falliti
         self.waiting_for_response = False
         error_msg = f"Impossibile inviare il messaggio dopo {max_send_retries} tentativi"
         messageBox("Errore", error_msg, StyleBox.Dash_Bold)
-        for callback in self.error_callbacks:
-            callback(error_msg)
+        self._notify(self.error_callbacks, error_msg)
         return False
 
+    @staticmethod
+    def _activity_id(read_json) -> str | None:
+        """Id dell'activity inviata, dalla risposta di DirectLine alla POST ({"id": "..."})"""
+        try:
+            return read_json().get('id')
+        except (ValueError, AttributeError):
+            return None
+
+    def send_message_nowait(self, text, on_sent=None):
+        """Invia il messaggio in un thread separato per non bloccare il chiamante"""
+        # Il thread eredita il contesto del chiamante, così l'invio resta legato all'interazione in corso
+        threading.Thread(target=contextvars.copy_context().run, args=(self.send_message, text, on_sent), daemon=True).start()
+
     def stop_conversation(self):
         """Terminate the current conversation with the bot and reset all variables"""
+        self.closing = True
         # Close the WebSocket connection
         if self.ws:
             self.ws.close()
@@ -330,9 +623,11 @@ class IfabChatWebSocket:
 
         # Reset all state variables
         self.conversation_id = None
+        self.token = None
+        self.token_expires_at = None
         self.ws = None
         self.ws_thread = None
-        self.watermark = None
+        self._reset_activity_state()
         self.waiting_for_response = False
 
         print("Conversation stopped and variables reset")
@@ -340,6 +635,7 @@ class IfabChatWebSocket:
 
     def close(self):
         """Close the WebSocket connection"""
+        self.closing = True
         if self.ws:
             self.ws.close()
             self.running = False
@@ -347,6 +643,141 @@ class IfabChatWebSocket:
                 self.ws_thread.join(timeout=1)
 
 
+class ConversationPool:
+    """
+    Pool di conversazioni DirectLine, una per ogni sessione del frontend.
+    Tiene pronte 'size' conversazioni già aperte, così un nuovo browser non aspetta l'handshake con il bot;
+    chiude le conversazioni delle sessioni inattive da più di 'idle_timeout' secondi (vengono riaperte al
+    messaggio successivo) e rinnova i token prima della scadenza.
+    """
+
+    def __init__(self, url, auth_token, size=2, idle_timeout=600, token_refresh_margin=300, maintenance_interval=10, client_class=None):
+        self.url = url
+        self.client_class = client_class if client_class is not None else IfabChatWebSocket
+        self.auth_token = auth_token
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.token_refresh_margin = token_refresh_margin
+        self.maintenance_interval = maintenance_interval
+
+        self._spares = []  # Conversazioni aperte non ancora assegnate
+        self._sessions = {}  # sid -> IfabChatWebSocket
+        self._last_used = {}  # sid -> istante dell'ultimo utilizzo
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._wakeup.set()  # Il primo riempimento parte subito, non dopo maintenance_interval
+        self.ready = threading.Event()  # Impostato quando la prima conversazione è pronta
+        self._running = True
+        self._thread = threading.Thread(target=self._maintenance, daemon=True)
+        self._thread.start()
+
+    def _new_client(self, sid=None) -> IfabChatWebSocket:
+        # Ogni sessione usa un user_id diverso, il bot tiene separati gli utenti anche nei log
+        return self.client_class(self.url, self.auth_token, user_id=f"user-{sid}" if sid else "user1")
+
+    def acquire(self, sid) -> IfabChatWebSocket | None:
+        """Assegna una conversazione alla sessione, prendendola dal pool se disponibile; None se il bot non risponde"""
+        with self._lock:
+            self._last_used[sid] = time.time()
+            client = self._sessions.get(sid)
+            if client is not None:
+                return client
+            while self._spares:
+                spare = self._spares.pop()
+                if spare.running:
+                    client = spare
+                    break
+                threading.Thread(target=spare.stop_conversation, daemon=True).start()
+            self._wakeup.set()  # Ripristina il numero di conversazioni pronte
+
+        if client is None:
+            # Pool vuoto: apertura sincrona, il browser aspetta come prima
+            client = self._new_client()
+            if not client.start_conversation():
+                return None
+        client.user_id = f"user-{sid}"
+        with self._lock:
+            self._sessions[sid] = client
+        return client
+
+    def get(self, sid) -> IfabChatWebSocket | None:
+        """Conversazione della sessione, aggiornando l'istante dell'ultimo utilizzo"""
+        with self._lock:
+            client = self._sessions.get(sid)
+            if client is not None:
+                self._last_used[sid] = time.time()
+            return client
+
+    def release(self, sid):
+        """Chiude la conversazione della sessione, il pool ne prepara una nuova"""
+        with self._lock:
+            client = self._sessions.pop(sid, None)
+            self._last_used.pop(sid, None)
+        if client is not None:
+            client.clear_callbacks()
+            threading.Thread(target=client.stop_conversation, daemon=True).start()
+
+    def _maintenance(self):
+        while self._running:
+            self._wakeup.wait(timeout=self.maintenance_interval)
+            self._wakeup.clear()
+            if not self._running:
+                break
+            now = time.time()
+
+            # Chiude le conversazioni delle sessioni inattive, la sessione resta registrata e verrà riaperta al bisogno
+            with self._lock:
+                idle = [client for sid, client in self._sessions.items()
+                        if client.running and now - self._last_used.get(sid, now) > self.idle_timeout]
+            for client in idle:
+                messageBox("Pool conversazioni", f"Chiusa la conversazione inattiva {client.conversation_id}", StyleBox.Light)
+                client.stop_conversation()
+
+            # Rinnova i token in scadenza, sia delle sessioni che delle conversazioni pronte
+            with self._lock:
+                clients = list(self._sessions.values()) + list(self._spares)
+            for client in clients:
+                if client.running and client.token_expires_at and client.token_expires_at - now < self.token_refresh_margin:
+                    client.refresh_token()
+
+            # Scarta le conversazioni pronte che hanno perso lo stream e riempie il pool
+            with self._lock:
+                dead = [client for client in self._spares if not client.running]
+                self._spares = [client for client in self._spares if client.running]
+                missing = self.size - len(self._spares)
+            for client in dead:
+                client.stop_conversation()
+            for _ in range(missing):
+                client = self._new_client()
+                if not client.start_conversation():
+                    break  # Il bot non risponde, riprova al prossimo giro
+                with self._lock:
+                    self._spares.append(client)
+                self.ready.set()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Attende la prima conversazione aperta, cioè che il bot risponda; subito vero se il pool è vuoto per scelta"""
+        return self.size <= 0 or self.ready.wait(timeout=timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'active': sum(1 for client in self._sessions.values() if client.running),
+                'spares': len(self._spares),
+            }
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        with self._lock:
+            clients = list(self._sessions.values()) + self._spares
+            self._sessions.clear()
+            self._spares = []
+        for client in clients:
+            client.close()
+
+
 if __name__ == '__main__':
 
     # Inizializza il client WebSocket per la comunicazione con il bot
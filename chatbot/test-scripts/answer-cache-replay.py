@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Verifica che una domanda ripetuta, servita dalla cache delle risposte, non richieda nessuna nuova sintesi:
+la risposta arriva in streaming a pezzi (con il disclaimer spezzato fra due pezzi), i testi inviati al TTS vengono
+salvati con la risposta e riprodotti uguali al secondo invio, quindi tutte le frasi sono già nella cache TTS.
+"""
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from chatLib.AnswerCache import AnswerCache
+from chatLib.TTSCache import TTSCache
+from chatLib.text_utils import SpeechSegmenter, split_sentences
+
+AI_DISCLAIMER = "Il contenuto generato dall'IA potrebbe essere errato"
+
+reply = ('La **Stampante 3D** del laboratorio è una macchina a filamento [1]. Ecco cosa serve per usarla:\n'
+         '- Un file *STL* del modello\n- Il software di slicing\n- Il filamento in `PLA` o `PETG`\n\n'
+         f'{AI_DISCLAIMER}\n\nPer maggiori dettagli consulta la guida del laboratorio.')
+
+
+class CountingTTS:
+    """Come AudioPlayer.play_text: divide il testo in frasi e sintetizza solo quelle assenti dalla cache TTS"""
+
+    def __init__(self):
+        self.cache = set()
+        self.synth_calls = 0
+        self.spoken = []
+
+    def __call__(self, text):
+        for sentence in split_sentences(text):
+            key = TTSCache.make_key(sentence, 'voce', {})
+            if key not in self.cache:
+                self.synth_calls += 1
+                self.cache.add(key)
+            self.spoken.append(sentence)
+
+
+def stream(text, chunk_size):
+    """Pezzi cumulativi come quelli dei callback di streaming DirectLine"""
+    ends = list(range(chunk_size, len(text), chunk_size)) + [len(text)]
+    return [(text[:end], end == len(text)) for end in ends]
+
+
+if __name__ == '__main__':
+    for chunk_size in (5, 17, 40):
+        tts = CountingTTS()
+        answers = AnswerCache()
+
+        # Primo invio: risposta del bot in streaming, pronunciata frase per frase
+        segmenter = SpeechSegmenter(AI_DISCLAIMER)
+        for text, final in stream(reply, chunk_size):
+            clean_text = segmenter.feed(text, final)
+            if clean_text:
+                tts(clean_text)
+        answers.put("Come si usa la stampante 3D?", reply.replace(AI_DISCLAIMER, ""), segmenter.segments)
+        first_calls = tts.synth_calls
+        assert first_calls > 0
+        assert not any("IA" in sentence for sentence in tts.spoken), f"Disclaimer pronunciato: {tts.spoken}"
+
+        # Secondo invio: risposta dalla cache, stessi testi al TTS
+        tts.spoken.clear()
+        answer, speech = answers.get("come si usa la stampante 3D")
+        for segment in speech:
+            tts(segment)
+        assert tts.synth_calls == first_calls, f"Pezzi da {chunk_size}: {tts.synth_calls - first_calls} sintesi per una risposta in cache"
+        print(f"Pezzi da {chunk_size:2d} caratteri: {first_calls} frasi sintetizzate al primo invio, 0 alla domanda ripetuta")
+    print("OK")
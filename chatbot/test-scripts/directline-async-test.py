@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test del client DirectLine asyncio contro il server locale di directline_mock.py:
+apre molte conversazioni sullo stesso event loop, invia un messaggio per ciascuna e verifica
+che ogni risposta arrivi solo alla conversazione che l'ha generata.
+"""
+
+import argparse
+import threading
+import time
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from ifabChatAsync import IfabChatAsync
+from directline_mock import DirectLineMock
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test del client DirectLine asyncio con il server locale")
+    parser.add_argument("--conversations", type=int, default=20, help="Numero di conversazioni contemporanee [default '%(default)s']")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Secondi massimi di attesa delle risposte [default '%(default)s']")
+    args = parser.parse_args()
+
+    mock = DirectLineMock(reply_delay=0.2)
+    url = mock.start()
+    threads_before = threading.active_count()
+
+    replies = {}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def make_callback(idx):
+        def callback(text):
+            with lock:
+                replies.setdefault(idx, []).append(text)
+                if len(replies) == args.conversations:
+                    done.set()
+        return callback
+
+    clients = []
+    start_time = time.time()
+    for i in range(args.conversations):
+        client = IfabChatAsync(url, "Bearer mock", user_id=f"user-{i}")
+        client.add_message_callback(make_callback(i))
+        assert client.start_conversation(), f"Conversazione {i} non avviata"
+        clients.append(client)
+    print(f"{args.conversations} conversazioni aperte in {time.time() - start_time:.2f} secondi")
+    print(f"└─▶ Thread aggiuntivi: {threading.active_count() - threads_before}")
+
+    start_time = time.time()
+    futures = [client.send_message_nowait(f"domanda {i}") for i, client in enumerate(clients)]
+    assert all(future.result(timeout=args.timeout) for future in futures), "Invio fallito"
+    assert done.wait(timeout=args.timeout), f"Risposte ricevute solo da {len(replies)} conversazioni"
+    print(f"Tutte le risposte ricevute in {time.time() - start_time:.2f} secondi")
+
+    for i in range(args.conversations):
+        assert replies[i] == [f"Echo: domanda {i}"], f"Risposte errate per la conversazione {i}: {replies[i]}"
+    print("└─▶ Ogni conversazione ha ricevuto solo la propria risposta")
+
+    for client in clients:
+        client.close()
+    mock.stop()
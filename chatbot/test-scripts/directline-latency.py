@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Misura la latenza di invio di un messaggio DirectLine con requests.post "nudo"
+(nuova connessione ad ogni chiamata) e con la sessione HTTP condivisa (keep-alive).
+Senza --url usa il server DirectLine locale di directline_mock.py: in locale si misura solo
+il risparmio dell'handshake TCP, verso Azure si risparmia anche l'handshake TLS.
+"""
+
+import argparse
+import statistics
+import time
+
+import requests
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from ifabChatWebSocket import get_http_session
+from directline_mock import DirectLineMock
+
+
+def measure(post, url, headers, body, repeat):
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        response = post(url, headers=headers, json=body, timeout=(5, 30))
+        response.raise_for_status()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def report(name, times):
+    print(f"{name}: media {statistics.mean(times) * 1000:.2f} ms, mediana {statistics.median(times) * 1000:.2f} ms, "
+          f"max {max(times) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark della latenza di invio DirectLine con e senza keep-alive")
+    parser.add_argument("--url", type=str, default=None, help="Endpoint delle conversazioni DirectLine, se assente usa il server locale")
+    parser.add_argument("--auth", type=str, default="Bearer mock", help="Token di autorizzazione 'Bearer ...'")
+    parser.add_argument("--repeat", type=int, default=50, help="Numero di messaggi per modalità [default '%(default)s']")
+    args = parser.parse_args()
+
+    mock = None
+    url = args.url
+    if url is None:
+        mock = DirectLineMock(reply_delay=0.0)
+        url = mock.start()
+        print(f"Server DirectLine locale su {url}")
+
+    headers = {"Authorization": args.auth, "Content-Type": "application/json"}
+    session = get_http_session()
+    conversation = session.post(url, headers=headers, timeout=(5, 30)).json()
+    activity_url = f"{url}/{conversation['conversationId']}/activities"
+    body = {"locale": "it-IT", "type": "message", "from": {"id": "benchmark"}, "text": "ping"}
+
+    # Primo messaggio fuori misura, apre la connessione della sessione
+    session.post(activity_url, headers=headers, json=body, timeout=(5, 30))
+
+    bare = measure(requests.post, activity_url, headers, body, args.repeat)
+    pooled = measure(session.post, activity_url, headers, body, args.repeat)
+    report("requests.post", bare)
+    report("Sessione condivisa", pooled)
+    print(f"└─▶ Risparmio medio per messaggio: {(statistics.mean(bare) - statistics.mean(pooled)) * 1000:.2f} ms")
+
+    if mock is not None:
+        mock.stop()
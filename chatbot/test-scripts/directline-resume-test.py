@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test del recupero delle activity DirectLine contro il server locale di directline_mock.py:
+    1. lo stream viene chiuso mentre il bot sta rispondendo, il client deve riprendere dal watermark
+    2. lo stream resta aperto ma smette di ricevere activity, il client deve recuperarle via GET
+In entrambi i casi ogni risposta deve arrivare una e una sola volta.
+"""
+
+import argparse
+import threading
+import time
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from ifabChatAsync import IfabChatAsync
+from ifabChatWebSocket import IfabChatWebSocket
+from directline_mock import DirectLineMock
+
+
+def wait_replies(replies, count, timeout):
+    start_time = time.time()
+    while len(replies) < count and time.time() - start_time < timeout:
+        time.sleep(0.05)
+    time.sleep(0.5)  # Lascia il tempo a eventuali duplicati di arrivare
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test della ripresa dal watermark e del polling di riserva")
+    parser.add_argument("--client", type=str, default="async", choices=["async", "thread"], help="Client DirectLine da testare [default '%(default)s']")
+    parser.add_argument("--timeout", type=float, default=15.0, help="Secondi massimi di attesa delle risposte [default '%(default)s']")
+    args = parser.parse_args()
+
+    mock = DirectLineMock(reply_delay=1.0)
+    url = mock.start()
+    client_class = IfabChatAsync if args.client == "async" else IfabChatWebSocket
+    client = client_class(url, "Bearer mock", user_id="tester")
+    client.stall_timeout = 2
+
+    replies = []
+    lock = threading.Lock()
+
+    def on_reply(text):
+        with lock:
+            replies.append(text)
+
+    client.add_message_callback(on_reply)
+    assert client.start_conversation(), "Conversazione non avviata"
+    conversation_id = client.conversation_id
+
+    # 1. Socket chiuso a metà risposta: il bot risponde mentre il client è disconnesso
+    assert client.send_message("prima domanda")
+    time.sleep(0.3)
+    mock.call(mock.drop_sockets())
+    wait_replies(replies, 1, args.timeout)
+    assert replies == ["Echo: prima domanda"], f"Risposte dopo la chiusura dello stream: {replies}"
+    assert client.conversation_id == conversation_id, "La conversazione non è stata ripresa ma riavviata"
+    print("Stream chiuso durante la risposta: risposta ricevuta una sola volta, conversazione ripresa dal watermark")
+
+    # 2. Stream aperto ma fermo: la risposta arriva solo tramite polling
+    mock.stall_streams(True)
+    assert client.send_message("seconda domanda")
+    wait_replies(replies, 2, args.timeout)
+    assert replies == ["Echo: prima domanda", "Echo: seconda domanda"], f"Risposte con lo stream fermo: {replies}"
+    print("Stream fermo: risposta recuperata via GET")
+
+    # Lo stream riparte: le activity già recuperate non devono essere notificate di nuovo
+    mock.stall_streams(False)
+    mock.call(mock.drop_sockets())
+    assert client.send_message("terza domanda")
+    wait_replies(replies, 3, args.timeout)
+    assert replies == ["Echo: prima domanda", "Echo: seconda domanda", "Echo: terza domanda"], f"Risposte dopo la ripresa: {replies}"
+    print("└─▶ Nessuna activity persa o duplicata")
+
+    client.close()
+    mock.stop()
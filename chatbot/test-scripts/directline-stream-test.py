@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test delle risposte DirectLine in streaming contro il server locale di directline_mock.py:
+i pezzi devono arrivare in ordine ai callback di streaming, l'ultimo marcato come finale,
+e il testo completo non deve essere consegnato una seconda volta ai message callback.
+"""
+
+import time
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from ifabChatAsync import IfabChatAsync
+from chatLib.text_utils import pop_complete_sentences
+from directline_mock import DirectLineMock
+
+if __name__ == '__main__':
+    mock = DirectLineMock(reply_delay=0.2, stream_chunks=4, chunk_delay=0.2)
+    url = mock.start()
+    client = IfabChatAsync(url, "Bearer mock", user_id="tester")
+
+    chunks = []
+    messages = []
+    client.add_partial_callback(lambda stream_id, delta, text, final: chunks.append((time.time(), delta, text, final)))
+    client.add_message_callback(messages.append)
+    assert client.start_conversation(), "Conversazione non avviata"
+
+    question = "La stampante 3D è accesa? Quanto manca alla fine della stampa del pezzo per il robot?"
+    start_time = time.time()
+    assert client.send_message(question)
+    while not (chunks and chunks[-1][3]) and time.time() - start_time < 10:
+        time.sleep(0.05)
+
+    assert chunks and chunks[-1][3], "Risposta finale non ricevuta"
+    assert ''.join(delta for _, delta, _, _ in chunks) == f"Echo: {question}", "I delta non ricompongono la risposta"
+    assert messages == [], "La risposta in streaming è stata consegnata anche come messaggio intero"
+    print(f"Primo pezzo dopo {(chunks[0][0] - start_time) * 1000:.0f} ms, risposta completa dopo {(chunks[-1][0] - start_time) * 1000:.0f} ms")
+
+    # Prima frase pronta per il TTS
+    buffer = ''
+    for timestamp, delta, _, _ in chunks:
+        buffer += delta
+        sentence, buffer = pop_complete_sentences(buffer)
+        if sentence:
+            print(f"└─▶ Prima frase al TTS dopo {(timestamp - start_time) * 1000:.0f} ms: '{sentence}'")
+            break
+
+    client.close()
+    mock.stop()
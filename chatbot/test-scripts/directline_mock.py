@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server DirectLine 3.0 locale, per test e benchmark del client senza passare da Copilot.
+Implementa l'apertura della conversazione, il rinnovo del token, l'invio di activity, lo stream websocket e la lettura
+delle activity via GET; ogni messaggio utente riceve una risposta "Echo: <testo>" dal bot.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+
+from aiohttp import WSMsgType, web
+
+BASE_PATH = "/v3/directline/conversations"
+
+
+class DirectLineMock:
+    def __init__(self, host='127.0.0.1', port=0, reply_delay=0.05, latency=0.0, stream_chunks=0, chunk_delay=0.1):
+        self.host = host
+        self.port = port
+        self.reply_delay = reply_delay  # Tempo di "ragionamento" del bot prima della risposta
+        self.latency = latency  # Ritardo artificiale su ogni richiesta REST
+        self.stream_chunks = stream_chunks  # Se > 0 la risposta arriva in streaming, in questo numero di typing cumulative
+        self.chunk_delay = chunk_delay
+        self.conversations = {}
+        self.stalled = set()  # Conversazioni il cui stream resta aperto ma non riceve più activity
+        self.requests_count = 0
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{BASE_PATH}"
+
+    def _stream_url(self, conversation_id, watermark=None) -> str:
+        url = f"ws://{self.host}:{self.port}{BASE_PATH}/{conversation_id}/stream"
+        return f"{url}?watermark={watermark}" if watermark is not None else url
+
+    # ------------------------------------------------------------------ activity
+    async def _publish(self, conversation_id, activity):
+        conversation = self.conversations[conversation_id]
+        conversation['seq'] += 1
+        activity['id'] = f"{conversation_id}|{conversation['seq']:07d}"
+        activity['timestamp'] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        conversation['activities'].append(activity)
+        if conversation_id in self.stalled:
+            return activity['id']
+        payload = json.dumps({'activities': [activity], 'watermark': str(conversation['seq'])})
+        for ws in list(conversation['sockets']):
+            try:
+                await ws.send_str(payload)
+            except ConnectionResetError:
+                conversation['sockets'].discard(ws)
+        return activity['id']
+
+    async def _bot_reply(self, conversation_id, text):
+        await asyncio.sleep(self.reply_delay)
+        reply = f"Echo: {text}"
+        bot = {'id': 'bot', 'name': 'Mock'}
+        if self.stream_chunks <= 0:
+            await self._publish(conversation_id, {'type': 'message', 'from': bot, 'text': reply})
+            return
+
+        # Streaming come Copilot Studio: typing con testo cumulativo, poi il messaggio finale con lo stesso streamId
+        words = reply.split(' ')
+        stream_id = None
+        for sequence in range(1, self.stream_chunks + 1):
+            partial = ' '.join(words[:max(1, len(words) * sequence // (self.stream_chunks + 1))])
+            channel_data = {'streamType': 'streaming', 'streamSequence': sequence}
+            if stream_id:
+                channel_data['streamId'] = stream_id
+            activity_id = await self._publish(conversation_id, {'type': 'typing', 'from': bot, 'text': partial, 'channelData': channel_data})
+            stream_id = stream_id or activity_id
+            await asyncio.sleep(self.chunk_delay)
+        await self._publish(conversation_id, {'type': 'message', 'from': bot, 'text': reply,
+                                              'channelData': {'streamType': 'final', 'streamId': stream_id}})
+
+    # ------------------------------------------------------------------ handler
+    @web.middleware
+    async def _latency_middleware(self, request, handler):
+        self.requests_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def _start_conversation(self, request):
+        conversation_id = f"mock{next(self._ids)}"
+        self.conversations[conversation_id] = {'activities': [], 'sockets': set(), 'seq': 0}
+        return web.json_response({'conversationId': conversation_id, 'token': f"token-{conversation_id}",
+                                  'expires_in': 1800, 'streamUrl': self._stream_url(conversation_id)}, status=201)
+
+    async def _refresh_token(self, request):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        conversation_id = token.removeprefix('token-')
+        if conversation_id not in self.conversations:
+            return web.json_response({'error': {'code': 'TokenExpired'}}, status=403)
+        return web.json_response({'conversationId': conversation_id, 'token': token, 'expires_in': 1800})
+
+    async def _reconnect(self, request):
+        conversation_id = request.match_info['conversation_id']
+        if conversation_id not in self.conversations:
+            return web.json_response({'error': {'code': 'BadArgument'}}, status=404)
+        return web.json_response({'conversationId': conversation_id, 'token': f"token-{conversation_id}", 'expires_in': 1800,
+                                  'streamUrl': self._stream_url(conversation_id, request.query.get('watermark'))})
+
+    async def _post_activity(self, request):
+        conversation_id = request.match_info['conversation_id']
+        if conversation_id not in self.conversations:
+            return web.json_response({'error': {'code': 'BadArgument'}}, status=404)
+        activity = await request.json()
+        activity_id = await self._publish(conversation_id, activity)
+        if activity.get('type') == 'message':
+            asyncio.ensure_future(self._bot_reply(conversation_id, activity.get('text', '')))
+        return web.json_response({'id': activity_id})
+
+    async def _get_activities(self, request):
+        conversation_id = request.match_info['conversation_id']
+        if conversation_id not in self.conversations:
+            return web.json_response({'error': {'code': 'BadArgument'}}, status=404)
+        conversation = self.conversations[conversation_id]
+        watermark = int(request.query.get('watermark') or 0)
+        return web.json_response({'activities': conversation['activities'][watermark:], 'watermark': str(conversation['seq'])})
+
+    async def _stream(self, request):
+        conversation_id = request.match_info['conversation_id']
+        if conversation_id not in self.conversations:
+            return web.Response(status=404)
+        conversation = self.conversations[conversation_id]
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        # Con il watermark, il server reinvia le activity successive prima di quelle nuove
+        watermark = request.query.get('watermark')
+        if watermark:
+            missed = conversation['activities'][int(watermark):]
+            if missed:
+                await ws.send_str(json.dumps({'activities': missed, 'watermark': str(conversation['seq'])}))
+        conversation['sockets'].add(ws)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            conversation['sockets'].discard(ws)
+        return ws
+
+    async def drop_sockets(self, conversation_id=None):
+        """Chiude bruscamente gli stream websocket, per simulare una disconnessione"""
+        for cid, conversation in self.conversations.items():
+            if conversation_id is None or cid == conversation_id:
+                for ws in list(conversation['sockets']):
+                    await ws.close(code=1011)
+                conversation['sockets'].clear()
+
+    def stall_streams(self, stalled=True, conversation_id=None):
+        """Blocca (o sblocca) l'invio di activity sugli stream, che restano aperti: simula uno stream fermo"""
+        ids = [conversation_id] if conversation_id is not None else list(self.conversations)
+        if stalled:
+            self.stalled.update(ids)
+        else:
+            self.stalled.difference_update(ids)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._latency_middleware])
+        app.router.add_post(BASE_PATH, self._start_conversation)
+        app.router.add_post("/v3/directline/tokens/refresh", self._refresh_token)
+        app.router.add_get(BASE_PATH + "/{conversation_id}", self._reconnect)
+        app.router.add_post(BASE_PATH + "/{conversation_id}/activities", self._post_activity)
+        app.router.add_get(BASE_PATH + "/{conversation_id}/activities", self._get_activities)
+        app.router.add_get(BASE_PATH + "/{conversation_id}/stream", self._stream)
+        return app
+
+    # ------------------------------------------------------------------ avvio
+    def start(self) -> str:
+        """Avvia il server in un thread dedicato e restituisce l'URL delle conversazioni"""
+        ready = threading.Event()
+
+        async def setup():
+            self._runner = web.AppRunner(self.make_app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]  # Porta effettiva se richiesta la 0
+            ready.set()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(setup())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait(timeout=5)
+        return self.url
+
+    def call(self, coro, timeout=5):
+        """Esegue una coroutine nel loop del server, dal thread chiamante"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout=timeout)
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self.call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Server DirectLine 3.0 locale per i test")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host del server [default '%(default)s']")
+    parser.add_argument("--port", type=int, default=3978, help="Porta del server [default '%(default)s']")
+    parser.add_argument("--reply_delay", type=float, default=0.5, help="Secondi prima della risposta del bot [default '%(default)s']")
+    parser.add_argument("--stream_chunks", type=int, default=0, help="Numero di pezzi delle risposte in streaming, 0 per risposte intere [default '%(default)s']")
+    parser.add_argument("--latency", type=float, default=0.0, help="Ritardo artificiale in secondi su ogni richiesta REST [default '%(default)s']")
+    args = parser.parse_args()
+
+    mock = DirectLineMock(args.host, args.port, reply_delay=args.reply_delay, latency=args.latency, stream_chunks=args.stream_chunks)
+    web.run_app(mock.make_app(), host=args.host, port=args.port)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import timeit
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from chatLib.text_utils import clean_markdown_for_tts
+
+
+def clean_markdown_for_tts_legacy(text):
+    """Implementazione precedente (re.sub con pattern da stringa e blocchi di codice dopo il codice inline), come riferimento"""
+    if not text:
+        return text
+    text = re.sub(r'\[\d+\]:\s*cite:\d+\s*"[^"]*"', '', text)
+    text = re.sub(r'\[\d+\]', '', text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)
+    text = re.sub(r'\*([^*]+)\*', r'\1', text)
+    text = re.sub(r'`([^`]+)`', r'\1', text)
+    text = re.sub(r'```[\s\S]*?```', '', text)
+    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
+    text = re.sub(r'^#+\s+', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\*\-\+]\s+(.+?)$', r'\1.', text, flags=re.MULTILINE)
+    text = re.sub(r'^\d+\.\s+(.+?)$', r'\1.', text, flags=re.MULTILINE)
+    text = re.sub(r'^-{3,}|^\*{3,}|^_{3,}', '', text, flags=re.MULTILINE)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\n{2,}', '\n', text)
+    text = re.sub(r'\s+([.,;:!?])', r'\1', text)
+    text = re.sub(r'\n', ', ', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)
+    return text.strip()
+
+
+# Risposta tipica di Copilot, con elenchi, grassetti e citazioni
+copilot_reply = '''La **Stampante 3D** del laboratorio è una macchina a filamento [1]. Ecco cosa serve per usarla:
+- Un file *STL* del modello
+- Il software di slicing
+- Il filamento in `PLA` o `PETG`
+
+I passaggi principali sono:
+1. Preparare il modello
+2. Generare il G-code
+3. Avviare la stampa
+
+Per maggiori dettagli consulta la [guida](https://example.com/guida) del laboratorio [2].
+
+[1]: cite:1 "Citation-1"
+[2]: cite:2 "Citation-2"'''
+
+code_reply = '''Ecco un esempio:
+```bash
+asd
+ads
+```
+Fine dell'esempio con `codice inline`.'''
+
+# Output atteso: paragrafi e righe separati da virgole (l'implementazione precedente incollava i paragrafi separati da una riga vuota)
+copilot_expected = ("La Stampante 3D del laboratorio è una macchina a filamento. Ecco cosa serve per usarla:, Un file STL del modello., "
+                    "Il software di slicing., Il filamento in PLA o PETG., I passaggi principali sono:, Preparare il modello., "
+                    "Generare il G-code., Avviare la stampa., Per maggiori dettagli consulta la guida del laboratorio.")
+expected = {
+    "copilot": (copilot_reply, copilot_expected),
+    "copilot x20": ("\n\n".join([copilot_reply] * 20), ", ".join([copilot_expected] * 20)),
+    "codice": (code_reply, "Ecco un esempio:, Fine dell'esempio con codice inline."),
+    "paragrafi": ("Primo paragrafo\n\nSecondo paragrafo", "Primo paragrafo, Secondo paragrafo"),
+}
+
+if __name__ == '__main__':
+    # Verifica dell'output corretto, poi confronto dei tempi con l'implementazione precedente
+    for name, (text, output) in expected.items():
+        assert clean_markdown_for_tts(text) == output, f"Output errato per '{name}': {clean_markdown_for_tts(text)!r}"
+    print(f"Paragrafi, precedente: {clean_markdown_for_tts_legacy(expected['paragrafi'][0])!r}")
+    print(f"Paragrafi, attuale:    {clean_markdown_for_tts(expected['paragrafi'][0])!r}")
+    print(f"Blocco di codice, precedente: {clean_markdown_for_tts_legacy(code_reply)!r}")
+    print(f"Blocco di codice, attuale:    {clean_markdown_for_tts(code_reply)!r}")
+
+    for name, text in (("risposta breve", "Vado verso la Stampante 3D"), ("risposta tipica", copilot_reply),
+                       ("risposta lunga x20", "\n\n".join([copilot_reply] * 20))):
+        number = 2000 if len(text) < 5000 else 200
+        legacy = min(timeit.repeat(lambda: clean_markdown_for_tts_legacy(text), number=number, repeat=5)) / number
+        current = min(timeit.repeat(lambda: clean_markdown_for_tts(text), number=number, repeat=5)) / number
+        print(f"{name:20s} precedente {legacy * 1e6:8.1f} us, attuale {current * 1e6:8.1f} us, speedup x{legacy / current:.2f}")
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import time
+
+import argcomplete
+
+""" Import local library """
+import sys
+import os
+
+# Aggiungi il percorso relativo al sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from chatLib import AudioPlayer as ap
+from chatLib.AudioSink import NullSink, WavFileSink
+
+test_text = ("Ciao, sono il robot di IFAB. Posso accompagnarti davanti alla Stampante 3D, alla Tagliatrice Laser, "
+             "alla Fresatrice CNC o al Plotter. Chiedimi pure cosa fanno i macchinari del laboratorio e come si usano. "
+             "Quando vuoi puoi anche premere uno dei pulsanti a destra per mandarmi direttamente in una zona di lavoro.")
+
+if __name__ == '__main__':
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Piper-TTS throughput benchmark, senza scheda audio")
+    parser.add_argument("--model", type=str, required=True, help="Path to the Piper-TTS model")
+    parser.add_argument("--wav", type=str, default=None, help="Salva l'audio in un file wav invece di scartarlo")
+    parser.add_argument("--repeat", type=int, default=3, help="Numero di ripetizioni del testo [default '%(default)s']")
+
+    argcomplete.autocomplete(parser)
+    args = parser.parse_args()
+
+    sink = WavFileSink(args.wav) if args.wav else NullSink()
+    player = ap.AudioPlayer(args.model, sink=sink)
+
+    for i in range(args.repeat):
+        audio_before = sink.seconds_written if isinstance(sink, NullSink) else 0.0
+        start_time = time.time()
+        utterance = player.play_text(test_text)
+        player.waitEndBuffer(utterance)
+        elapsed = time.time() - start_time
+        print(f"Prova {i + 1}: {elapsed:.2f} secondi, time-to-first-audio {utterance.ttfa * 1000:.0f} ms")
+        if isinstance(sink, NullSink):
+            audio_seconds = sink.seconds_written - audio_before
+            print(f"└─▶ Audio prodotto: {audio_seconds:.1f} secondi, real-time factor {elapsed / audio_seconds:.3f}")
+    print(f"Statistiche time-to-first-audio: {player.ttfa_stats()}")
+    if player.cache is None:
+        print("Cache TTS disabilitata, ogni prova esegue la sintesi completa")
+    player.close()
@@ -0,0 +1,152 @@
+document.addEventListener('DOMContentLoaded', function () {
+    // Mappa 2D del tavolo: il server invia lo stato completo alla connessione e poi solo le differenze
+    const canvas = document.getElementById('tableMap');
+    const ctx = canvas.getContext('2d');
+    const targetLabel = document.getElementById('mapTarget');
+    const updateLabel = document.getElementById('mapUpdate');
+
+    const MARGIN = 30; // Pixel attorno al tavolo
+    const PATH_COLOR = getComputedStyle(document.documentElement).getPropertyValue('--primary-color').trim() || '#0078d4';
+    let table = null;   // {width, height, bounds: [x_min, x_max, y_min, y_max]} in metri
+    let targets = {};   // chiave -> testo del pulsante
+    let markers = {};   // chiave -> [x, y, theta], 'robot' per il robot
+    let target = null;  // Chiave del target corrente
+    let lastUpdate = null;
+    let drawPending = false;
+
+    // Coordinate del tavolo (origine in basso a sinistra, y verso l'alto) -> pixel del canvas
+    function scale() {
+        return (canvas.width - 2 * MARGIN) / table.width;
+    }
+
+    function toPx(x, y) {
+        const s = scale();
+        return [MARGIN + x * s, canvas.height - MARGIN - y * s];
+    }
+
+    function resize() {
+        if (!table) return;
+        canvas.width = canvas.clientWidth;
+        canvas.height = Math.round((canvas.width - 2 * MARGIN) * table.height / table.width) + 2 * MARGIN;
+        requestDraw();
+    }
+
+    function requestDraw() {
+        if (drawPending) return;
+        drawPending = true;
+        requestAnimationFrame(() => {
+            drawPending = false;
+            draw();
+        });
+    }
+
+    function drawPose(pose, color, size, label) {
+        const [px, py] = toPx(pose[0], pose[1]);
+        ctx.fillStyle = color;
+        ctx.strokeStyle = color;
+        ctx.beginPath();
+        ctx.arc(px, py, size, 0, 2 * Math.PI);
+        ctx.fill();
+        // Orientamento: l'angolo è antiorario con y verso l'alto, sul canvas la y è invertita
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        ctx.moveTo(px, py);
+        ctx.lineTo(px + Math.cos(pose[2]) * size * 2.5, py - Math.sin(pose[2]) * size * 2.5);
+        ctx.stroke();
+        ctx.fillStyle = '#333';
+        ctx.font = '12px sans-serif';
+        ctx.fillText(label, px + size + 4, py - size - 2);
+    }
+
+    function draw() {
+        if (!table) return;
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        const s = scale();
+
+        // Tavolo e area raggiungibile dal robot
+        ctx.strokeStyle = '#999';
+        ctx.lineWidth = 2;
+        ctx.strokeRect(MARGIN, MARGIN, table.width * s, table.height * s);
+        const [bx, by] = toPx(table.bounds[0], table.bounds[3]);
+        ctx.setLineDash([6, 4]);
+        ctx.strokeStyle = '#bbb';
+        ctx.strokeRect(bx, by, (table.bounds[1] - table.bounds[0]) * s, (table.bounds[3] - table.bounds[2]) * s);
+
+        // Percorso pianificato: dal robot al target, o al centro del tavolo senza target
+        const robot = markers['robot'];
+        const goal = target ? markers[target] : [table.width / 2, table.height / 2];
+        if (robot && goal) {
+            ctx.strokeStyle = PATH_COLOR;
+            ctx.lineWidth = 2;
+            ctx.beginPath();
+            ctx.moveTo(...toPx(robot[0], robot[1]));
+            ctx.lineTo(...toPx(goal[0], goal[1]));
+            ctx.stroke();
+        }
+        ctx.setLineDash([]);
+
+        for (const [key, pose] of Object.entries(markers)) {
+            if (key === 'robot') continue;
+            const color = key === target ? '#e67e22' : (key in targets ? '#2e8b57' : '#aaa');
+            drawPose(pose, color, 6, targets[key] || key);
+        }
+        if (robot) {
+            drawPose(robot, '#d9534f', 9, 'Robot');
+        }
+    }
+
+    function showTarget() {
+        targetLabel.textContent = target ? `Target: ${targets[target] || target}` : 'Nessun target';
+    }
+
+    const socket = io('/table');
+
+    socket.on('table-init', data => {
+        table = data.table && data.table.width ? data.table : null;
+        targets = data.targets || {};
+        markers = data.markers || {};
+        target = data.target;
+        showTarget();
+        resize();
+    });
+
+    socket.on('table-delta', delta => {
+        Object.assign(markers, delta.upd);
+        delta.del.forEach(key => delete markers[key]);
+        if ('target' in delta) {
+            target = delta.target;
+            showTarget();
+        }
+        lastUpdate = Date.now();
+        requestDraw();
+    });
+
+    socket.on('disconnect', () => {
+        updateLabel.textContent = 'Connessione al server persa, riconnessione...';
+    });
+
+    // Età dell'ultimo aggiornamento: con il tavolo fermo il server non invia nulla
+    setInterval(() => {
+        if (lastUpdate !== null && socket.connected) {
+            const age = (Date.now() - lastUpdate) / 1000;
+            updateLabel.textContent = age < 1 ? 'Aggiornata ora' : `Ultima variazione ${age.toFixed(0)} s fa`;
+        }
+    }, 1000);
+
+    // Video della camera su richiesta: finché è nascosto il server non annota né codifica nulla
+    const videoToggle = document.getElementById('videoToggle');
+    const video = document.getElementById('tableVideo');
+    videoToggle.addEventListener('click', () => {
+        if (video.hidden) {
+            video.src = '/video';
+            video.hidden = false;
+            videoToggle.textContent = 'Nascondi video della camera';
+        } else {
+            video.removeAttribute('src'); // Chiude la connessione MJPEG
+            video.hidden = true;
+            videoToggle.textContent = 'Mostra video della camera';
+        }
+    });
+
+    window.addEventListener('resize', resize);
+});
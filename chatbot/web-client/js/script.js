@@ -23,6 +23,7 @@ document.addEventListener('DOMContentLoaded', function () {
     let lastAudioPath = null; // Variabile per tenere traccia dell'ultimo file audio registrato
     let audioMessages = {}; // Oggetto per memorizzare i percorsi audio associati a ciascun messaggio
     let microphoneStream = null; // Variabile per tenere traccia dello stream del microfono
+    let sttAvailable = true; // Falso se il riconoscimento vocale non è stato caricato: la chat resta solo testuale
 
 
     // Imposta la visibilità iniziale del pulsante
@@ -34,7 +35,9 @@ document.addEventListener('DOMContentLoaded', function () {
 
 
     socket.on('message', function (data) {
-        if (data.type === 'message') {
+        if (data.type === 'message' && data.streamId) {
+            updateStreamingMessage(data.streamId, data.text); // Risposta in streaming, aggiorna sempre lo stesso messaggio
+        } else if (data.type === 'message') {
             addBotMessage(data.text);
         } else if (data.type === 'error') {
             addBotMessage('Errore: ' + data.text);
@@ -43,6 +46,37 @@ document.addEventListener('DOMContentLoaded', function () {
         hideLoading();
     });
 
+    // Riproduzione dell'audio TTS inviato dal server (--tts_sink socketio), PCM 16 bit accodato con WebAudio
+    let ttsContext = null;
+    let ttsNextTime = 0;
+    let ttsSources = [];
+
+    socket.on('tts-audio', function (data) {
+        if (!ttsContext) ttsContext = new (window.AudioContext || window.webkitAudioContext)();
+        const pcm = new Int16Array(data.data);
+        const frames = pcm.length / data.channels;
+        const buffer = ttsContext.createBuffer(data.channels, frames, data.sample_rate);
+        for (let ch = 0; ch < data.channels; ch++) {
+            const channelData = buffer.getChannelData(ch);
+            for (let i = 0; i < frames; i++) channelData[i] = pcm[i * data.channels + ch] / 32768;
+        }
+        const source = ttsContext.createBufferSource();
+        source.buffer = buffer;
+        source.connect(ttsContext.destination);
+        // Accoda il blocco subito dopo il precedente, senza buchi fra un blocco e l'altro
+        ttsNextTime = Math.max(ttsNextTime, ttsContext.currentTime + 0.05);
+        source.start(ttsNextTime);
+        ttsNextTime += buffer.duration;
+        source.onended = () => { ttsSources = ttsSources.filter(s => s !== source); };
+        ttsSources.push(source);
+    });
+
+    socket.on('tts-flush', function () {
+        ttsSources.forEach(source => source.stop());
+        ttsSources = [];
+        ttsNextTime = 0;
+    });
+
     socket.on('stt', function (data) {
         updateAudioMessage(data.messageId, data.text); // Aggiorna il messaggio specifico usando l'ID fornito dal backend
     });
@@ -64,7 +98,7 @@ document.addEventListener('DOMContentLoaded', function () {
     socket.on('reconnect', function (attemptNumber) {
         console.log('Riconnesso al server dopo ' + attemptNumber + ' tentativi');
         // Verifica lo stato della connessione con il backend
-        fetch('/check-connection')
+        fetch('/check-connection?sid=' + encodeURIComponent(socket.id))
             .then(response => response.json())
             .then(data => {
                 if (data.connected) console.log('Connessione al bot verificata con successo'); else console.warn('Connessione al bot non attiva, potrebbe essere necessario ricaricare la pagina');
@@ -122,8 +156,66 @@ document.addEventListener('DOMContentLoaded', function () {
         // Utilizziamo marked per convertire il testo Markdown in HTML
         messageDiv.innerHTML = marked.parse(text);
         messageContainer.appendChild(messageDiv);
+        return messageDiv;
     }
 
+    // Sottosistemi non caricati all'avvio (voce, visione): la chat testuale funziona, le altre funzioni sono segnalate
+    function checkDegradedSubsystems() {
+        fetch('/check-server-status')
+            .then(response => response.json())
+            .then(status => {
+                if (!status.subsystems) return;
+                const stt = status.subsystems.find(subsystem => subsystem.name === 'stt');
+                sttAvailable = !stt || stt.state === 'ready';
+                if (!isWaitingForResponse) recordButton.disabled = !sttAvailable;
+
+                const failed = status.subsystems.filter(subsystem => subsystem.state === 'failed' && !subsystem.required);
+                if (failed.length === 0) return;
+                const messageDiv = addErrorMessage('Funzioni non disponibili: ' + failed.map(subsystem => subsystem.label).join(', ') +
+                    '. La chat testuale è comunque attiva.', isGui = true);
+                failed.filter(subsystem => subsystem.retryable).forEach(subsystem => {
+                    const retry = document.createElement('button');
+                    retry.className = 'retry-button';
+                    retry.textContent = 'Riprova: ' + subsystem.label;
+                    retry.addEventListener('click', () => {
+                        retry.disabled = true;
+                        fetch('/retry-subsystem/' + encodeURIComponent(subsystem.name), {method: 'POST'})
+                            .then(response => {
+                                if (!response.ok) throw new Error('Nuovo tentativo rifiutato dal server');
+                                messageDiv.remove();
+                                waitForSubsystem(subsystem.name);
+                            })
+                            .catch(error => {
+                                console.error('Errore durante il nuovo tentativo:', error);
+                                retry.disabled = false;
+                            });
+                    });
+                    messageDiv.appendChild(retry);
+                });
+                setTimeout(scrollToBottom, 50);
+            })
+            .catch(err => console.error('Errore durante la verifica dello stato del server:', err));
+    }
+
+    // Attende la fine del nuovo caricamento, poi aggiorna gli avvisi e il pulsante del microfono
+    function waitForSubsystem(name) {
+        recordButton.disabled = name === 'stt' || !sttAvailable;
+        fetch('/check-server-status')
+            .then(response => response.json())
+            .then(status => {
+                const subsystem = status.subsystems.find(subsystem => subsystem.name === name);
+                if (subsystem && (subsystem.state === 'pending' || subsystem.state === 'loading')) {
+                    setTimeout(() => waitForSubsystem(name), 2000);
+                } else {
+                    if (subsystem && subsystem.state === 'ready') addErrorMessage(subsystem.label + ' di nuovo disponibile.', isGui = true);
+                    checkDegradedSubsystems();
+                }
+            })
+            .catch(() => setTimeout(() => waitForSubsystem(name), 2000));
+    }
+
+    checkDegradedSubsystems();
+
     // Add a bot message to the chat with Markdown support
     function addBotMessage(text) {
         const messageDiv = document.createElement('div');
@@ -151,6 +243,21 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // Forza lo scroll dopo un breve ritardo per assicurarsi che il contenuto sia stato renderizzato
         setTimeout(scrollToBottom, 50);
+        return messageDiv;
+    }
+
+    // Aggiorna il messaggio del bot di una risposta in streaming con il testo ricevuto finora, creandolo al primo pezzo
+    function updateStreamingMessage(streamId, text) {
+        const messageDiv = messageContainer.querySelector(`[data-stream-id="${CSS.escape(streamId)}"]`);
+        if (!messageDiv) {
+            const newMessageDiv = addBotMessage(text);
+            if (newMessageDiv) newMessageDiv.dataset.streamId = streamId;
+            return;
+        }
+        const iconDiv = messageDiv.querySelector('.bot-icon');
+        messageDiv.innerHTML = marked.parse(text);
+        if (iconDiv) messageDiv.prepend(iconDiv);
+        if (isUserAtBottom()) setTimeout(scrollToBottom, 50);
     }
 
     // Add a user audio message to the chat
@@ -275,7 +382,7 @@ document.addEventListener('DOMContentLoaded', function () {
         isWaitingForResponse = false;
         statusElement.innerHTML = '';
         sendButton.disabled = false;
-        recordButton.disabled = false;
+        recordButton.disabled = !sttAvailable;
         setStaticButtonsState(false); // Riabilita i pulsanti statici
     }
 
@@ -318,7 +425,7 @@ document.addEventListener('DOMContentLoaded', function () {
         fetch('/send-message', {
             method: 'POST', headers: {
                 'Content-Type': 'application/json'
-            }, body: JSON.stringify({text: text})
+            }, body: JSON.stringify({text: text, sid: socket.id})
         })
             .then(response => {
                 if (!response.ok) {
@@ -446,6 +553,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 const audioBlob = new Blob(audioChunks, {type: 'audio/wav'});
                 const formData = new FormData();
                 formData.append('audio', audioBlob, 'recording.wav');
+                formData.append('sid', socket.id); // La risposta del bot arriva solo a questa sessione
 
                 // Crea immediatamente un messaggio audio utente con animazione di caricamento
                 const tempMessageId = 'audio_' + Date.now();
@@ -521,6 +629,12 @@ document.addEventListener('DOMContentLoaded', function () {
                     });
             };
 
+            // Interrompe il TTS in corso: l'utente sta parlando sopra al robot
+            fetch('/tts-stop', {
+                method: 'POST', headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({sid: socket.id}) // Interrompe solo l'audio di questo browser
+            })
+                .catch(error => console.error('Errore durante l\'interruzione del TTS:', error));
             // Face update when recording started
             robotFaceUpdate("speak");
             mediaRecorder.start();
@@ -659,7 +773,7 @@ document.addEventListener('DOMContentLoaded', function () {
             fetch('/button-click', {
                 method: 'POST', headers: {
                     'Content-Type': 'application/json'
-                }, body: JSON.stringify({key: key, say: say})
+                }, body: JSON.stringify({key: key, say: say, sid: socket.id})
             })
                 .then(response => {
                     if (!response.ok) {
@@ -1,16 +1,32 @@
+import time
+
+STARTUP_TIME = time.perf_counter()  # Origine dei tempi di avvio, prima di qualsiasi import pesante
+
 import json
+import logging
 import math
 import socket
 import threading
 
-from chatbot.flaskFrontEnd import *
-from vision.vision import *
+from chatbot.chatLib import Readiness as rd
+from chatbot.chatLib.Metrics import RateMeter, metrics
+from chatbot.chatLib.Tracer import tracer
+from chatbot.chatLib.text_utils import clean_markdown_for_tts
+from chatbot.chatLib.util import StyleBox, TreeParser, formatHelp, messageBox
+# flaskFrontEnd non carica i modelli: torch, whisperx e piper sono importati dai sottosistemi quando vengono avviati
+from chatbot.flaskFrontEnd import (STT_RETRY_MESSAGE, ap, create_app, flaskFrontEnd_argsAdd, flaskFrontEnd_useArgs,
+                                   lu, run_gunicorn, run_server, wl)
+from ifabConfig import ConfigError, ConfigWatcher, IfabConfig, Table, Target
+from vision import TableState as ts  # Solo libreria standard: OpenCV viene importato all'avvio della camera
+from vision import VideoStream as vs
 
 version = "0.0.1"
 
+log = logging.getLogger('ifab.robot')
+
 
 class RobotController:
-    def __init__(self, client_addr: str, client_port: int, targets: dict, table: dict):
+    def __init__(self, client_addr: str, client_port: int, targets: dict[str, Target], table: Table):
         # Configurazione client
         self.client_addr = client_addr
         self.client_port = client_port
@@ -26,10 +42,23 @@ class RobotController:
 
         # Target macchina
         self.target_machine = None
-        self.targets = targets if targets is not None else {}
-
-        # Dati sul campo fisico
-        self.table = table if table is not None else {}
+        self.set_targets(targets, table)
+
+        # Metriche: pacchetti UDP e ultimo avvistamento di ogni marker
+        self.last_seen = {}  # chiave marker -> time.time() dell'ultimo avvistamento
+        self.udp_packets = metrics.counter('ifab_udp_packets_total', "Pacchetti UDP inviati al robot")
+        self.udp_errors = metrics.counter('ifab_udp_send_errors_total', "Errori nell'invio dei pacchetti UDP al robot")
+        self.markers_seen = metrics.counter('ifab_markers_seen_total', "Avvistamenti dei marker da parte della visione", ('marker',))
+        metrics.gauge('ifab_marker_last_seen_age_seconds', "Secondi dall'ultimo avvistamento di ogni marker", ('marker',),
+                      fun=lambda: {key: time.time() - seen for key, seen in list(self.last_seen.items())})
+
+    def set_targets(self, targets: dict[str, Target], table: Table):
+        """Target raggiungibili e dati sul campo fisico, sostituibili a caldo quando cambia la configurazione"""
+        self.targets = targets
+        self.table = table
+        if self.target_machine is not None and self.target_machine not in targets:
+            log.warning("Il target '%s' non è più presente nella configurazione", self.target_machine)
+            self.target_machine = None
 
     def get_socket(self):
         """Ottiene una socket valida o ne crea una nuova."""
@@ -37,25 +66,31 @@ class RobotController:
             try:
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             except Exception as e:
-                print(f"Errore nella creazione della socket: {e}")
+                log.error("Errore nella creazione della socket: %s", e)
         return self.sock
 
     def set_target(self, target: str | None):
         """Imposta una nuova macchina target."""
-        self.target_machine = target
-        self.send_to_robot(robot_data_fresh=False)
+        with tracer.span('robot.set_target', target=target):
+            self.target_machine = target
+            self.send_to_robot(robot_data_fresh=False)
 
     def update_states(self, data: dict):
         """Aggiorna lo stato del robot e dei marker."""
         # Aggiorna la memoria del robot
         robotData = False
+        now = time.time()
         if data.get('robot') is not None:
             self.memory['robot']['data'] = data['robot']
             robotData = True
+            self.last_seen['robot'] = now
+            self.markers_seen.labels('robot').inc()
 
         # Aggiorna la memoria dei marker
         for marker_key, marker_data in data.get('markers', {}).items():
             self.memory['markers'][marker_key] = marker_data
+            self.last_seen[marker_key] = now
+            self.markers_seen.labels(marker_key).inc()
 
         # Invia i dati al robot
         self.send_to_robot(robot_data_fresh=robotData)
@@ -73,24 +108,19 @@ class RobotController:
             x = self.memory['markers'][self.target_machine]["position"][0]
             y = self.memory['markers'][self.target_machine]["position"][1]
             theta = self.memory['markers'][self.target_machine]["angle"]
-            x_min = self.table['offset_inside']
-            x_max = self.table['width'] - self.table['offset_inside']
-            y_min = self.table['offset_inside']
-            y_max = self.table['height'] - self.table['offset_inside']
-            if x < x_min or x > x_max or y < y_min or y > y_max:
-                print(f"Il target '{self.target_machine}' è fuori dai limiti dello spazio raggiungibile: {x}, {y}")
+            if not self.table.contains(x, y):
+                log.warning("Il target '%s' è fuori dai limiti dello spazio raggiungibile: %s, %s", self.target_machine, x, y)
             else:
                 toSend['target'] = {"x": x, "y": y, 'theta': theta}
 
         if self.target_machine is None and self.memory['robot']['data'] is not None:
             # Se non abbiamo un target, ma il robot è stato visto almeno una volta, gli diciamo di andare al centro del campo
-            x = self.table['width'] / 2
-            y = self.table['height'] / 2
+            x, y = self.table.center
             theta = math.pi / 2
             toSend['target'] = {"x": x, "y": y, 'theta': theta}
 
         if not toSend:  # Invia i dati usando la socket solo se c'è qualcosa da inviare
-            print("Nessun dato da inviare al robot")
+            log.debug("Nessun dato da inviare al robot")
             return
 
         toSend['timestamp'] = time.time();
@@ -100,9 +130,12 @@ class RobotController:
             if s:
                 json_data = json.dumps(toSend, indent=0).replace("\n", "")
                 bytes_data = json_data.encode('utf-8') + b'\0'
-                s.sendto(bytes_data, (self.client_addr, self.client_port))
+                with tracer.span('robot.udp', bytes=len(bytes_data)):  # Registrata solo dentro un'interazione, non per gli aggiornamenti della visione
+                    s.sendto(bytes_data, (self.client_addr, self.client_port))
+                self.udp_packets.inc()
         except Exception as e:
-            print(f"Errore nell'invio dei dati: {e}")
+            self.udp_errors.inc()
+            log.error("Errore nell'invio dei dati: %s", e)
             # Resetta la socket in caso di errore
             self.sock = None
 
@@ -120,13 +153,13 @@ class RobotController:
             status += "Attualmente non c'è nessun target impostato per il robot"
         elif (self.memory['robot']['data'] is None or self.memory['markers'].get(self.target_machine) is None):
             # Verifica se abbiamo dati del robot e del target
-            status += f"Il robot si sta muovendo verso: {self.targets[self.target_machine]['text']}"
+            status += f"Il robot si sta muovendo verso: {self.targets[self.target_machine].text}"
         else:
             threshold = 0.2  # Soglia di distanza in metri, 20 cm
             if distance > threshold:
-                status += f"Il robot si sta dirigendo verso: {self.targets[self.target_machine]['text']}"
+                status += f"Il robot si sta dirigendo verso: {self.targets[self.target_machine].text}"
             else:
-                status += f"Il robot si trova davanti a: {self.targets[self.target_machine]['text']}"
+                status += f"Il robot si trova davanti a: {self.targets[self.target_machine].text}"
         return status
     
     def update_face(self, state):
@@ -141,60 +174,23 @@ class RobotController:
                 toSend["face"] = 2
             case _:
                 toSend["face"] = 1
-        print('Data Send to robot:', toSend)
+        log.debug("Data Send to robot: %s", toSend)
         try:
             s = self.get_socket()
             if s:
                 json_data = json.dumps(toSend, indent=0).replace("\n", "")
                 bytes_data = json_data.encode('utf-8') + b'\0'
                 s.sendto(bytes_data, (self.client_addr, self.client_port))
+                self.udp_packets.inc()
         except Exception as e:
-            print(f"Errore nell'invio dei dati: {e}")
+            self.udp_errors.inc()
+            log.error("Errore nell'invio dei dati: %s", e)
             # Resetta la socket in caso di errore
             self.sock = None
         pass
 
 
 
-def wait_for_port_available(port, host='localhost', timeout=10):
-    """
-    Attende che una porta si liberi entro un determinato timeout.
-
-    Args:
-        port (int): Numero della porta da verificare
-        host (str): Host su cui controllare la porta
-        timeout (int): Tempo massimo di attesa in secondi
-
-    Returns:
-        bool: True se la porta è disponibile, False se è ancora occupata dopo il timeout
-    """
-    import time
-    import socket as sock
-
-    def is_port_in_use(port, host):
-        with sock.socket(sock.AF_INET, sock.SOCK_STREAM) as s:
-            try:
-                s.bind((host, port))
-                return False
-            except sock.error:
-                return True
-
-    start_time = time.time()
-    port_free = False
-
-    while time.time() - start_time < timeout:
-        if not is_port_in_use(port, host):
-            port_free = True
-            break
-        print(f"La porta {port} è occupata. Attendo che si liberi...")
-        time.sleep(1)
-
-    if not port_free:
-        print(f"Timeout: la porta {port} è ancora occupata dopo {timeout} secondi.")
-
-    return port_free
-
-
 if __name__ == '__main__':
     # Argomenti da riga di comando di IFAB
     parser = TreeParser(formatter_class=formatHelp, description='Avvio del sistema IFAB')
@@ -203,72 +199,212 @@ if __name__ == '__main__':
     flaskFrontEnd_argsAdd(parser)  # Aggiungi gli argomenti per il server Flask
     ap.audioPlayer_argsAdd(parser)  # Aggiungi gli argomenti per l'AudioPlayer
     wl.whisperListener_argsAdd(parser)  # Aggiungi gli argomenti per il WhisperListener
+    lu.log_argsAdd(parser)  # Aggiungi gli argomenti per il logging
+    ts.tableState_argsAdd(parser)  # Aggiungi gli argomenti per il servizio dello stato del tavolo
+    vs.videoStream_argsAdd(parser)  # Aggiungi gli argomenti per il video MJPEG
+    parser.add_argument('--headless', action='store_true', help="Visione senza finestre OpenCV, da seguire via browser su /map e /video")
     args = parser.parse_args()
 
+    # Logging asincrono: da qui in poi console e file non bloccano visione e richieste
+    lu.log_useArgs(args)
+
     # Ottieni gli argomenti per il server Flask
     host, port = flaskFrontEnd_useArgs(args)
 
-    # Avvia il server temporaneo di welcome-page
-    # run_temp_server(port)
-
     # Inizio il caricamento in memoria di tutte le risorse dei vari sottemi
-    with open(args.config) as f:
-        conf = json.load(f)
-
-    # Inizializza il client per la comunicazione con il robot
-    targetMachines = merge({}, conf['workZone'], conf['macchinari'])
-    robot_client = RobotController(conf['robot']['client_addr'], conf['robot']['client_port'], targets=targetMachines, table=conf['table'])
-    # Avvio del sottosistema di visione
-    cameraSystem = vision_setup(conf, visionStateUpdate=robot_client.update_states)
-    # Inizializza TTS
-    def talkFace():
-        robot_client.update_face("listen")
-    def endTalkFace():
-        robot_client.update_face("idle")
-    player = ap.audioPlayer_useArgs(args, startTalkCallback=talkFace, stopTalkCallback=endTalkFace)
-    # Callback che invia la frase e attende che finisca per stoppare la faccia
-    def ttsTakl_face(text):
-        def sendAndWait(text):
-            player.play_text(text)
-            player.waitEndBuffer()
-            endTalkFace()
-        faceWaitThread = threading.Thread(target=sendAndWait, args=(text,))
-        faceWaitThread.daemon = True  # Il thread terminerà quando il programma principale termina
-        faceWaitThread.start()
-        
-
-    # Inizializza STT
-    listener, whisper_ready_event = wl.whisperListener_useArgs(args)
-
-    # Generazione dei pulsanti statici con i target (testo, percorso_immagine, testo da dire, chiave del dizionario da cui è stato generato)
-    workZone = [{'key': str(key), 'text': target['text'], 'img_path': target['img_path'], 'say': target['say']} for key, target in conf['workZone'].items()]
-    macchinari = [{'key': str(key), 'text': target['text'], 'img_path': target['img_path'], 'say': target['say']} for key, target in conf['macchinari'].items()]
-
-    if wl.wait_for_model_loading(whisper_ready_event):
-        print("Modello whisper caricato con successo")
-    else:
-        print("Timeout durante il caricamento del modello whisper")
+    try:
+        config = IfabConfig.load(args.config)
+    except ConfigError as e:
+        messageBox("Errore configurazione", str(e), StyleBox.Error)
         exit(1)
 
-    # Ferma il server temporaneo prima di avviare quello Flask
-    # stop_temp_server()
-
-    # Crea l'app Flask e SocketIO con tutte le callback e le informazioni del progetto
-    app, socketio, chat_client = create_app(conf['url'], conf['auth'], jobStation_list_top=workZone, machine_list_bot=macchinari,
-                                            ttsFun=ttsTakl_face, sttFun=listener,
-                                            goBotFun=robot_client.set_target, getBotStatusFun=robot_client.botStatus, updateBotFaceFun=robot_client.update_face)
-
-    # Prima di avviare il server Flask, verifica che la porta sia libera
-    # if not wait_for_port_available(port, host):
-    #    print("Arresto del programma a causa di porta occupata.")
-    #    exit(1)
-
-    # Avvia il server Flask con SocketIO in un thread separato
-
-    flask_thread = threading.Thread(target=lambda: socketio.run(app, host=host, port=port, debug=True, allow_unsafe_werkzeug=True, use_reloader=False))
-    flask_thread.daemon = True  # Il thread terminerà quando il programma principale termina
-    flask_thread.start()
-    print("Server Flask avviato in un thread separato")
-
-    # Avvia il sistema di visione nel thread principale
-    cameraSystem.run()
+    def start_system(in_worker: bool):
+        """
+        Avvia robot, server, modelli e visione; restituisce (app, visione, thread del server).
+        in_worker: il sistema si avvia dentro il worker gunicorn, che serve già le richieste: niente server in un thread
+        """
+        # Stato di avvio: i sottosistemi si caricano in parallelo mentre il server mostra la pagina di benvenuto
+        readiness = rd.Readiness(start_time=STARTUP_TIME)
+        # Senza voce la chat testuale resta utilizzabile: TTS e STT falliti mettono il sistema in modalità degradata e si possono ricaricare
+        readiness.register('tts', "Sintesi vocale", required=False)
+        readiness.register('stt', "Riconoscimento vocale", required=False)
+        readiness.register('directline', "Conversazione con il bot")
+        readiness.register('camera', "Visione", required=False)  # Senza camera la chat resta utilizzabile
+        metrics.gauge('ifab_startup_seconds', "Secondi dall'avvio del processo alla prima pagina servita e alla prontezza del sistema", ('phase',),
+                      fun=lambda: {phase: seconds for phase, seconds in (('first_page', readiness.time_to_first_page), ('ready', readiness.time_to_ready))
+                                   if seconds is not None})
+
+        # Inizializza il client per la comunicazione con il robot
+        robot_client = RobotController(config.robot.client_addr, config.robot.client_port, targets=config.targets, table=config.table)
+
+        # Stato del tavolo: la visione pubblica le pose una volta per frame, ogni consumatore le riceve nel proprio thread
+        table_bus = ts.tableState_useArgs(args)
+        table_bus.subscribe(lambda snapshot: robot_client.update_states(snapshot.state), name='robot')
+        metrics.gauge('ifab_table_state_skipped', "Snapshot del tavolo superati da uno più recente prima della consegna, per sottoscrittore", ('subscriber',),
+                      fun=lambda: {name: stats['skipped'] for name, stats in table_bus.stats()['subscribers'].items()})
+        # Metriche della visione: FPS e durata di ogni fase, aggiornate dal ciclo della camera senza lock
+        vision_fps = RateMeter()
+        metrics.gauge('ifab_vision_fps', "Frame elaborati al secondo dalla visione", fun=lambda: vision_fps.rate)
+        vision_frames = metrics.counter('ifab_vision_frames_total', "Frame elaborati dalla visione")
+        vision_stage = metrics.histogram('ifab_vision_stage_seconds', "Durata delle fasi di elaborazione di un frame", ('stage',),
+                                         buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25, 0.5))
+        vision_stage_children = {}  # fase -> istogramma, per non cercare le etichette ad ogni frame
+
+        def visionMetrics(stage_times):
+            vision_fps.tick()
+            vision_frames.inc()
+            for stage, seconds in stage_times.items():
+                child = vision_stage_children.get(stage)
+                if child is None:
+                    child = vision_stage_children[stage] = vision_stage.labels(stage)
+                child.observe(seconds)
+
+        # Callback di TTS e STT risolte al momento della chiamata: l'app parte prima che i modelli siano caricati
+        def ttsTakl_face(text, room=None):
+            player = readiness.get('tts')
+            if player is not None:
+                player.play_text(text, room)
+
+        def stopTts(room=None):
+            player = readiness.get('tts')
+            if player is not None:
+                player.cancel(room)
+
+        def stt(audio_path):
+            listener = readiness.get('stt')
+            return listener(audio_path) if listener is not None else None
+
+        # Pulsanti statici con i target (testo, percorso_immagine, testo da dire, chiave del dizionario da cui è stato generato)
+        workZone, macchinari = config.buttons()
+
+        # Crea l'app Flask e SocketIO con tutte le callback e le informazioni del progetto
+        app, socketio, conversation_pool = create_app(config.url, config.auth, jobStation_list_top=workZone, machine_list_bot=macchinari,
+                                                      ttsFun=ttsTakl_face, sttFun=stt, stopTtsFun=stopTts,
+                                                      goBotFun=robot_client.set_target, getBotStatusFun=robot_client.botStatus, updateBotFaceFun=robot_client.update_face,
+                                                      pool_size=args.conv_pool, idle_timeout=args.conv_idle, async_client=args.dl_client == 'async',
+                                                      answer_cache_size=args.answer_cache_size, answer_cache_ttl=args.answer_cache_ttl,
+                                                      local_commands=args.local_commands,
+                                                      readiness=readiness, table_map_rate=args.map_rate)
+
+        # Mappa del tavolo nel browser: un altro sottoscrittore dello stato del tavolo
+        table_map = app.extensions['ifab_table_map']
+        table_map.target_fun = lambda: robot_client.target_machine
+        table_map.set_table(config.table.width, config.table.height, config.table.bounds, {key: target.text for key, target in config.targets.items()})
+        table_bus.subscribe(table_map.update, name='web-map')
+
+        # Video annotato su /video: codificato una volta per tutti gli spettatori, nessun lavoro senza spettatori
+        video_stream = vs.videoStream_useArgs(args)
+        app.extensions['ifab_video_stream'] = video_stream
+        metrics.gauge('ifab_video_viewers', "Browser collegati al video MJPEG della visione", fun=lambda: video_stream.viewers)
+        metrics.gauge('ifab_video_frames_encoded', "Frame JPEG codificati per il video della visione", fun=lambda: video_stream.encoded)
+
+        flask_thread = None
+        if not in_worker:
+            # Avvia subito il server Flask con SocketIO in un thread separato, sulla porta definitiva:
+            # la pagina di benvenuto riceve l'avanzamento via Socket.IO e passa alla chat quando il sistema è pronto
+            flask_thread = threading.Thread(target=lambda: run_server(app, socketio, host, port, args.server))
+            flask_thread.daemon = True  # Il thread terminerà quando il programma principale termina
+            flask_thread.start()
+            messageBox("Avvio", f"Server Flask avviato dopo {time.perf_counter() - STARTUP_TIME:.2f} s, caricamento dei sottosistemi in corso", StyleBox.Light)
+
+        # Inizializza TTS
+        def load_tts():
+            def talkFace():
+                robot_client.update_face("listen")
+
+            def endTalkFace():
+                robot_client.update_face("idle")
+
+            readiness.update('tts', detail="Caricamento del modello della voce")
+            player = ap.audioPlayer_useArgs(args, startTalkCallback=talkFace, stopTalkCallback=endTalkFace)
+            # Con la destinazione Socket.IO l'audio TTS viene suonato dal browser invece che dalle casse del server
+            if args.tts_sink == "socketio":
+                player.set_sink(ap.SocketIOSink(socketio))
+            # Pre-carica nella cache TTS le frasi fisse, così i comandi ricorrenti partono senza attendere la sintesi
+            readiness.update('tts', detail="Preparazione delle frasi ricorrenti")
+            player.prewarm([target.say for target in config.targets.values()] +
+                           [clean_markdown_for_tts(STT_RETRY_MESSAGE)])  # Il benvenuto è solo scritto, mai pronunciato
+            return player
+
+        # Inizializza STT: i worker caricano il modello nei propri processi
+        def load_stt():
+            listener, whisper_ready_event = wl.whisperListener_useArgs(args)
+            readiness.update('stt', detail="Caricamento del modello whisper nei worker")
+
+            def progress(ready, total):
+                readiness.update('stt', detail=f"Worker pronti: {ready}/{total}")
+
+            if not wl.wait_for_model_loading(whisper_ready_event, progress=progress):
+                whisper_ready_event.terminate()  # Un nuovo tentativo avvia worker nuovi: quelli bloccati non devono restare attivi
+                raise TimeoutError("Timeout durante il caricamento del modello whisper")
+            return listener
+
+        # Prima conversazione con il bot aperta dal pool
+        def load_directline():
+            readiness.update('directline', detail="Apertura della conversazione")
+            if not conversation_pool.wait_ready(timeout=120):
+                raise TimeoutError("Nessuna risposta dal bot")
+            return conversation_pool
+
+        readiness.start('tts', load_tts)
+        readiness.start('stt', load_stt)
+        readiness.start('directline', load_directline)
+
+        # Avvio del sottosistema di visione nel thread principale: gestori dei segnali, tkinter e finestre OpenCV lo richiedono.
+        # Nel worker gunicorn il ciclo principale è quello del server: la visione gira senza finestre, da seguire su /map e /video
+        readiness.update('camera', rd.LOADING, detail="Apertura della camera" if len(config.cameras) == 1 else f"Apertura di {len(config.cameras)} camere")
+        try:
+            from vision.vision import vision_setup  # OpenCV e tkinter caricati solo ora, in parallelo ai modelli
+            cameraSystem = vision_setup(config.vision_dict(), visionStateUpdate=table_bus.publish, visionMetricsUpdate=visionMetrics,
+                                        frameStream=video_stream, display=not args.headless and not in_worker)
+        except Exception as e:
+            messageBox("Errore visione", f"Impossibile avviare il sottosistema di visione: {e}", StyleBox.Error)
+            readiness.update('camera', rd.FAILED, detail=str(e))
+            cameraSystem = None
+        else:
+            readiness.update('camera', rd.READY, value=cameraSystem)
+            if hasattr(cameraSystem, 'camera_ages'):  # Più camere: una camera ferma non blocca la fusione, ma va notata
+                metrics.gauge('ifab_camera_frame_age_seconds', "Secondi dall'ultimo frame ricevuto da ogni camera", ('camera',),
+                              fun=cameraSystem.camera_ages)
+
+        # Ricarica a caldo di target, offset e pulsanti quando config.json cambia, senza riavviare camera e modelli
+        def apply_config(new, old):
+            # La geometria del tavolo è quella dell'omografia della camera: cambia solo al riavvio, fino ad allora resta quella
+            # dell'avvio (confronto con la configurazione di avvio, non con la precedente, che può essere già stata rimandata)
+            table = new.table
+            if 'table' in new.restart_required(config):
+                table = robot_client.table
+                log.warning("Dimensioni o angoli del tavolo diversi da quelli in uso: applicati solo i target, riavviare per usare il nuovo tavolo")
+            robot_client.set_targets(new.targets, table)
+            table_map.set_table(table.width, table.height, table.bounds, {key: target.text for key, target in new.targets.items()})
+            if cameraSystem is not None:
+                cameraSystem.set_targets(new.robot.as_dict(), {key: target.as_dict() for key, target in new.targets.items()})
+            if new.buttons() != old.buttons():
+                app.extensions['ifab_update_buttons'](*new.buttons())
+            player = readiness.get('tts')
+            if player is not None:
+                player.prewarm([target.say for target in new.targets.values() if target.key not in old.targets or target.say != old.targets[target.key].say])
+
+        config_watcher = ConfigWatcher(config)
+        config_watcher.add_listener(apply_config)
+        config_watcher.start()
+
+        return app, cameraSystem, flask_thread
+
+    if args.server == 'gunicorn':
+        # Server di produzione: il worker gunicorn è un processo figlio e tutto il sistema si avvia al suo interno dopo il fork,
+        # nessun thread va avviato prima (un fork non li copia); il ciclo della visione gira in un thread del worker
+        def worker_app():
+            lu.log_useArgs(args)  # Il thread del logging asincrono del processo padre non esiste nel worker
+            app, cameraSystem, _ = start_system(in_worker=True)
+            if cameraSystem is not None:
+                threading.Thread(target=cameraSystem.run, daemon=True, name='vision').start()
+            return app
+
+        run_gunicorn(worker_app, host, port, threads=args.server_threads)
+    else:
+        app, cameraSystem, flask_thread = start_system(in_worker=False)
+        if cameraSystem is not None:
+            cameraSystem.run()
+        else:
+            flask_thread.join()  # Senza visione il processo resta in vita per il server
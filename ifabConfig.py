@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+log = logging.getLogger('ifab.config')
+
+_REQUIRED = object()
+_CORNERS = ('top-left', 'top-right', 'bottom-right', 'bottom-left')
+
+
+class ConfigError(ValueError):
+    """Errore di validazione di config.json, il messaggio indica la chiave errata (es. 'macchinari.laser.aruco')"""
+
+
+def _get(data: dict, key: str, kind: type | tuple, path: str, default: Any = _REQUIRED) -> Any:
+    """Legge e controlla il tipo di una chiave, i numeri interi sono accettati dove è richiesto un float"""
+    where = f"{path}.{key}" if path else key
+    if key not in data:
+        if default is _REQUIRED:
+            raise ConfigError(f"{where}: chiave mancante")
+        return default
+    value = data[key]
+    kinds = kind if isinstance(kind, tuple) else (kind,)
+    if float in kinds and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if isinstance(value, bool) and bool not in kinds or not isinstance(value, kinds):
+        names = ' o '.join(k.__name__ for k in kinds)
+        raise ConfigError(f"{where}: atteso {names}, trovato {type(value).__name__} ({value!r})")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ConfigError(f"{where}: valore non finito ({value!r})")
+    return value
+
+
+def _section(data: dict, key: str, path: str = '') -> dict:
+    return _get(data, key, dict, path)
+
+
+@dataclass(frozen=True)
+class Target:
+    """Zona di lavoro o macchinario raggiungibile dal robot, identificato da un marker ArUco"""
+    key: str
+    group: str  # 'workZone' o 'macchinari'
+    aruco: int
+    x_offset: float
+    y_offset: float
+    theta_offset: float  # Gradi
+    text: str
+    img_path: str
+    say: str
+
+    @classmethod
+    def from_dict(cls, key: str, group: str, data: dict) -> 'Target':
+        path = f"{group}.{key}"
+        if not isinstance(data, dict):
+            raise ConfigError(f"{path}: atteso un oggetto")
+        return cls(key=key, group=group,
+                   aruco=_get(data, 'aruco', int, path),
+                   x_offset=_get(data, 'x_offset', float, path, 0.0),
+                   y_offset=_get(data, 'y_offset', float, path, 0.0),
+                   theta_offset=_get(data, 'theta_offset', float, path, 0.0),
+                   text=_get(data, 'text', str, path),
+                   img_path=_get(data, 'img_path', str, path, ''),
+                   say=_get(data, 'say', str, path))
+
+    def button(self) -> dict:
+        """Pulsante statico del frontend"""
+        return {'key': self.key, 'text': self.text, 'img_path': self.img_path, 'say': self.say}
+
+    def as_dict(self) -> dict:
+        """Forma originale di config.json, usata dal sottosistema di visione"""
+        return {'aruco': self.aruco, 'x_offset': self.x_offset, 'y_offset': self.y_offset, 'theta_offset': self.theta_offset,
+                'text': self.text, 'img_path': self.img_path, 'say': self.say}
+
+
+@dataclass(frozen=True)
+class Table:
+    """Tavolo di lavoro in metri, con l'area raggiungibile dal robot precalcolata"""
+    width: float
+    height: float
+    offset_inside: float
+    corners: tuple[int, int, int, int]  # ID ArUco in ordine top-left, top-right, bottom-right, bottom-left
+    bounds: tuple[float, float, float, float] = field(init=False)  # x_min, x_max, y_min, y_max
+    center: tuple[float, float] = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'bounds', (self.offset_inside, self.width - self.offset_inside,
+                                            self.offset_inside, self.height - self.offset_inside))
+        object.__setattr__(self, 'center', (self.width / 2, self.height / 2))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Table':
+        aruco = _section(data, 'aruco', 'table')
+        table = cls(width=_get(data, 'width', float, 'table'),
+                    height=_get(data, 'height', float, 'table'),
+                    offset_inside=_get(data, 'offset_inside', float, 'table', 0.0),
+                    corners=tuple(_get(aruco, corner, int, 'table.aruco') for corner in _CORNERS))
+        if table.width <= 0 or table.height <= 0:
+            raise ConfigError(f"table: dimensioni non valide ({table.width} x {table.height})")
+        if not 0 <= table.offset_inside < min(table.width, table.height) / 2:
+            raise ConfigError(f"table.offset_inside: {table.offset_inside} lascia vuota l'area raggiungibile")
+        if len(set(table.corners)) != 4:
+            raise ConfigError(f"table.aruco: i quattro angoli devono avere ID distinti ({table.corners})")
+        return table
+
+    def contains(self, x: float, y: float) -> bool:
+        """Vero se il punto è nell'area raggiungibile dal robot"""
+        x_min, x_max, y_min, y_max = self.bounds
+        return x_min <= x <= x_max and y_min <= y <= y_max
+
+    def as_dict(self) -> dict:
+        return {'width': self.width, 'height': self.height, 'offset_inside': self.offset_inside,
+                'aruco': dict(zip(_CORNERS, self.corners))}
+
+
+@dataclass(frozen=True)
+class Camera:
+    """Camera della visione; con più camere ognuna ha la propria omografia verso il sistema di riferimento del tavolo"""
+    name: str
+    index: int | str  # Indice del dispositivo o URL dello stream
+    weight: float = 1.0  # Peso relativo della camera nella fusione delle pose
+    cpu: tuple[int, ...] = ()  # Core a cui vincolare il processo della camera, vuoto per nessuna affinità
+    homography: tuple[tuple[float, ...], ...] | None = None  # Pixel -> metri, per le camere che non vedono i quattro angoli
+
+    @classmethod
+    def from_dict(cls, position: int, data: dict) -> 'Camera':
+        path = f"cameras[{position}]"
+        if not isinstance(data, dict):
+            raise ConfigError(f"{path}: atteso un oggetto")
+        cpu = _get(data, 'cpu', list, path, [])
+        for core in cpu:
+            if isinstance(core, bool) or not isinstance(core, int) or core < 0:
+                raise ConfigError(f"{path}.cpu: atteso un elenco di core, trovato {core!r}")
+        homography = _get(data, 'homography', list, path, None)
+        if homography is not None:
+            if len(homography) != 3 or any(not isinstance(row, list) or len(row) != 3 for row in homography):
+                raise ConfigError(f"{path}.homography: attesa una matrice 3x3")
+            if any(isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) for row in homography for value in row):
+                raise ConfigError(f"{path}.homography: la matrice deve contenere solo numeri finiti")
+            homography = tuple(tuple(float(value) for value in row) for row in homography)
+        camera = cls(name=_get(data, 'name', str, path, str(position)),
+                     index=_get(data, 'index', (int, str), path),
+                     weight=_get(data, 'weight', float, path, 1.0),
+                     cpu=tuple(cpu), homography=homography)
+        if camera.weight <= 0:
+            raise ConfigError(f"{path}.weight: il peso deve essere positivo ({camera.weight})")
+        return camera
+
+    def as_dict(self) -> dict:
+        return {'name': self.name, 'index': self.index, 'weight': self.weight, 'cpu': list(self.cpu),
+                'homography': [list(row) for row in self.homography] if self.homography else None}
+
+
+@dataclass(frozen=True)
+class Robot:
+    client_addr: str
+    client_port: int
+    aruco: int
+    x_offset: float
+    y_offset: float
+    theta_offset: float  # Gradi
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Robot':
+        robot = cls(client_addr=_get(data, 'client_addr', str, 'robot'),
+                    client_port=_get(data, 'client_port', int, 'robot'),
+                    aruco=_get(data, 'aruco', int, 'robot'),
+                    x_offset=_get(data, 'x_offset', float, 'robot', 0.0),
+                    y_offset=_get(data, 'y_offset', float, 'robot', 0.0),
+                    theta_offset=_get(data, 'theta_offset', float, 'robot', 0.0))
+        if not 0 < robot.client_port < 65536:
+            raise ConfigError(f"robot.client_port: porta non valida ({robot.client_port})")
+        return robot
+
+    def as_dict(self) -> dict:
+        return {'client_addr': self.client_addr, 'client_port': self.client_port, 'aruco': self.aruco,
+                'x_offset': self.x_offset, 'y_offset': self.y_offset, 'theta_offset': self.theta_offset}
+
+
+@dataclass(frozen=True)
+class IfabConfig:
+    """
+    Configurazione validata di config.json. Le strutture usate ad ogni frame o ad ogni richiesta
+    (target per chiave e per ID ArUco, pulsanti, limiti del tavolo) sono calcolate una volta al caricamento.
+    """
+    url: str
+    auth: str
+    cameras: tuple[Camera, ...]
+    table: Table
+    robot: Robot
+    work_zones: dict[str, Target]
+    machines: dict[str, Target]
+    path: str | None = None
+    targets: dict[str, Target] = field(init=False)  # Zone di lavoro e macchinari per chiave
+    aruco_to_target: dict[int, Target] = field(init=False)
+
+    def __post_init__(self):
+        targets = {**self.work_zones, **self.machines}
+        object.__setattr__(self, 'targets', targets)
+        object.__setattr__(self, 'aruco_to_target', {target.aruco: target for target in targets.values()})
+
+    @classmethod
+    def from_dict(cls, data: dict, path: str | None = None) -> 'IfabConfig':
+        if not isinstance(data, dict):
+            raise ConfigError("la radice della configurazione deve essere un oggetto")
+        work_zones = {key: Target.from_dict(key, 'workZone', value) for key, value in _section(data, 'workZone').items()}
+        machines = {key: Target.from_dict(key, 'macchinari', value) for key, value in _section(data, 'macchinari').items()}
+        for key in work_zones.keys() & machines.keys():
+            raise ConfigError(f"macchinari.{key}: chiave già usata in workZone")
+        if 'cameras' in data:
+            cameras = tuple(Camera.from_dict(i, camera) for i, camera in enumerate(_get(data, 'cameras', list, '')))
+            if not cameras:
+                raise ConfigError("cameras: serve almeno una camera")
+        else:
+            cameras = (Camera(name='0', index=_get(data, 'cameraIndex', int, '')),)  # Forma con una sola camera
+        for field_name in ('name', 'index'):
+            values = [getattr(camera, field_name) for camera in cameras]
+            for position, value in enumerate(values):
+                if value in values[:position]:
+                    raise ConfigError(f"cameras[{position}].{field_name}: {value!r} già usato da un'altra camera")
+        config = cls(url=_get(data, 'url', str, ''),
+                     auth=_get(data, 'auth', str, ''),
+                     cameras=cameras,
+                     table=Table.from_dict(_section(data, 'table')),
+                     robot=Robot.from_dict(_section(data, 'robot')),
+                     work_zones=work_zones, machines=machines, path=path)
+
+        # Ogni marker deve avere un solo significato: angolo del tavolo, robot o target
+        owners = {aruco: f"table.aruco.{corner}" for corner, aruco in zip(_CORNERS, config.table.corners)}
+        for owner, aruco in [('robot.aruco', config.robot.aruco)] + [(f"{t.group}.{t.key}.aruco", t.aruco) for t in config.targets.values()]:
+            if aruco in owners:
+                raise ConfigError(f"{owner}: ID ArUco {aruco} già usato da {owners[aruco]}")
+            owners[aruco] = owner
+        return config
+
+    @classmethod
+    def load(cls, path: str) -> 'IfabConfig':
+        try:
+            with open(path, encoding='utf-8') as file:
+                data = json.load(file)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{path}: JSON non valido alla riga {e.lineno}, colonna {e.colno}: {e.msg}") from e
+        except OSError as e:
+            raise ConfigError(f"{path}: impossibile leggere il file ({e.strerror})") from e
+        return cls.from_dict(data, path=path)
+
+    def buttons(self) -> tuple[list[dict], list[dict]]:
+        """Pulsanti statici del frontend: zone di lavoro in alto, macchinari in basso"""
+        return [t.button() for t in self.work_zones.values()], [t.button() for t in self.machines.values()]
+
+    def vision_dict(self) -> dict:
+        """Configurazione nella forma attesa da vision_setup"""
+        return {'cameraIndex': self.cameras[0].index, 'cameras': [camera.as_dict() for camera in self.cameras], 'table': self.table.as_dict(), 'robot': self.robot.as_dict(),
+                'workZone': {key: t.as_dict() for key, t in self.work_zones.items()},
+                'macchinari': {key: t.as_dict() for key, t in self.machines.items()}}
+
+    def restart_required(self, other: 'IfabConfig') -> list[str]:
+        """Sezioni cambiate rispetto ad other che non si possono applicare a caldo (camera, tavolo, bot, indirizzo del robot)"""
+        changed = []
+        if (self.url, self.auth) != (other.url, other.auth):
+            changed.append('url/auth')
+        if self.cameras != other.cameras:
+            changed.append('cameras')
+        if (self.table.width, self.table.height, self.table.corners) != (other.table.width, other.table.height, other.table.corners):
+            changed.append('table')
+        if (self.robot.client_addr, self.robot.client_port) != (other.robot.client_addr, other.robot.client_port):
+            changed.append('robot.client_addr/client_port')
+        return changed
+
+
+class ConfigWatcher:
+    """
+    Controlla periodicamente la data di modifica del file di configurazione e lo ricarica quando cambia.
+    Una configurazione non valida viene segnalata e scartata: resta in uso l'ultima valida.
+    I listener ricevono (nuova, precedente) e applicano a caldo le parti che li riguardano.
+    """
+
+    def __init__(self, config: IfabConfig, interval: float = 1.0):
+        if config.path is None:
+            raise ValueError("ConfigWatcher richiede una configurazione caricata da file")
+        self.config = config
+        self.interval = interval
+        self._listeners = []
+        self._stamp = self._file_stamp()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener: Callable[[IfabConfig, IfabConfig], None]):
+        self._listeners.append(listener)
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.config.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def check(self) -> bool:
+        """Ricarica il file se è cambiato, restituisce True se è stata applicata una nuova configurazione"""
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            config = IfabConfig.load(self.config.path)
+        except ConfigError as e:
+            log.error("Configurazione non valida, resta in uso la precedente: %s", e)
+            return False
+        previous, self.config = self.config, config
+        restart = config.restart_required(previous)
+        if restart:
+            log.warning("Modifiche a %s applicate solo al prossimo riavvio", ', '.join(restart))
+        for listener in list(self._listeners):
+            try:
+                listener(config, previous)
+            except Exception:
+                log.exception("Errore nell'applicazione della nuova configurazione")
+        log.info("Configurazione ricaricata da %s: %d target", config.path, len(config.targets))
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self) -> 'ConfigWatcher':
+        self._thread = threading.Thread(target=self._run, daemon=True, name='config-watcher')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from .vision import ArUcoDetector, MarkerPoseCalculator, Visualizer
+except ImportError:
+    from vision import ArUcoDetector, MarkerPoseCalculator, Visualizer
+
+log = logging.getLogger('ifab.vision')
+
+# Osservazione di un marker da parte di una camera: id, x, y (metri), theta (radianti), confidenza
+Observation = Tuple[int, float, float, float, float]
+
+
+def marker_observations(ids: np.ndarray, corners: list, centers: np.ndarray, homography: np.ndarray,
+                        weight: float, skip: Dict[int, int]) -> List[Observation]:
+    """
+    Pose dei marker nel sistema di riferimento del tavolo, calcolate con una sola trasformazione per tutti i marker.
+    La confidenza cresce con l'area apparente del marker (più pixel, posizione più precisa) e cala nelle viste oblique.
+    """
+    keep = [k for k, marker_id in enumerate(ids) if int(marker_id) not in skip]
+    if not keep:
+        return []
+    quads = np.array([corners[k][0] for k in keep], dtype=np.float32)  # (n, 4, 2)
+    direction = quads[:, 1] - quads[:, 0]
+    direction /= np.maximum(np.linalg.norm(direction, axis=1, keepdims=True), 1e-6)
+    points = np.concatenate([centers[keep], centers[keep] + 20 * direction]).reshape(-1, 1, 2)
+    table = cv2.perspectiveTransform(points, homography).reshape(-1, 2)
+    center, tip = table[:len(keep)], table[len(keep):]
+    angles = np.arctan2(tip[:, 1] - center[:, 1], tip[:, 0] - center[:, 0])  # Asse y già verso l'alto
+
+    x, y = quads[..., 0], quads[..., 1]
+    area = 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+    sides = np.linalg.norm(quads - np.roll(quads, -1, axis=1), axis=2)
+    confidence = weight * area * sides.min(axis=1) / np.maximum(sides.max(axis=1), 1e-6)
+    return [(int(ids[k]), float(cx), float(cy), float(angle), float(conf))
+            for k, (cx, cy), angle, conf in zip(keep, center, angles, confidence)]
+
+
+def camera_worker(camera: Dict[str, Any], corner_ids: List[int], width: float, height: float, aruco_dict_type: int,
+                  output, stop_event):
+    """
+    Processo di una camera: cattura, rilevamento dei marker e pose nel sistema del tavolo, inviate al processo principale.
+    Le camere sono fisse: l'omografia viene ricalcolata quando la camera vede i quattro angoli e poi mantenuta,
+    così un angolo coperto non interrompe le pose. Le camere che non vedono mai tutti gli angoli usano quella configurata.
+    """
+    name = camera['name']
+    cpu = camera.get('cpu')
+    if cpu and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpu)
+    cv2.setNumThreads(max(1, len(cpu or ())))  # Un core per camera: OpenCV non occupa quelli delle altre
+
+    cam = cv2.VideoCapture(camera['index'])
+    if not cam.isOpened():
+        output.put(('error', name, f"Cannot open camera with index {camera['index']}"))
+        return
+    detector = ArUcoDetector(aruco_dict_type)
+    homography = np.array(camera['homography'], dtype=np.float64) if camera.get('homography') else None
+    # Centri dei marker d'angolo nel sistema del tavolo: metri, origine in basso a sinistra, asse y verso l'alto
+    table_points = np.array([[0, height], [width, height], [width, 0], [0, 0]], dtype=np.float32)
+    corner_index = {marker_id: i for i, marker_id in enumerate(corner_ids)}
+    weight = camera.get('weight', 1.0)
+    output.put(('ready', name, homography is not None))
+
+    read_failures = 0
+    try:
+        while not stop_event.is_set():
+            capture_start = time.monotonic()  # Orologio di sistema, confrontabile con quello del processo principale
+            ok, frame = cam.read()
+            if not ok:
+                read_failures += 1
+                if read_failures == 1 or read_failures % 100 == 0:
+                    output.put(('warning', name, f"Could not read frame from camera ({read_failures} failures)"))
+                time.sleep(0.05)
+                continue
+            detect_start = time.monotonic()
+            corners, ids, _ = detector.detect_markers(frame)
+            pose_start = time.monotonic()
+
+            observations = []
+            if ids is not None:
+                ids = ids.flatten()
+                centers = np.array([c[0].mean(axis=0) for c in corners], dtype=np.float32)
+                found = {corner_index[int(marker_id)]: centers[k] for k, marker_id in enumerate(ids) if int(marker_id) in corner_index}
+                if len(found) == 4:
+                    src = np.array([found[i] for i in range(4)], dtype=np.float32)
+                    if cv2.isContourConvex(src):  # Scarta i quadrilateri degeneri (angoli rilevati male)
+                        homography = cv2.getPerspectiveTransform(src, table_points)
+                if homography is not None:
+                    observations = marker_observations(ids, corners, centers, homography, weight, corner_index)
+
+            stage_times = {'capture': detect_start - capture_start, 'detect': pose_start - detect_start,
+                           'pose': time.monotonic() - pose_start}
+            try:
+                output.put_nowait(('frame', name, capture_start, observations, stage_times))
+            except queue.Full:
+                pass  # Il processo principale è in ritardo: conta solo il frame più recente di ogni camera
+    finally:
+        cam.release()
+
+
+class MultiCameraVision:
+    """
+    Visione con più camere: ogni camera cattura e rileva i marker nel proprio processo (e sul proprio core),
+    con la propria omografia verso il sistema di riferimento comune del tavolo. Il processo principale fonde
+    le pose dello stesso marker viste da più camere con una media pesata dalla confidenza, così il tracciamento
+    continua finché almeno una camera vede il marker. Stessa interfaccia di Vision (run, set_targets, cleanup).
+    """
+
+    def __init__(self,
+                 cameras: List[Dict[str, Any]],
+                 aruco_dict_type: int = cv2.aruco.DICT_6X6_250,
+                 marker_corners_ids=None,
+                 px_windows_height: int = 600,
+                 width: float = 30.0,
+                 height: float = 30.0,
+                 robot=None,
+                 targets=None,
+                 visionStateUpdate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 visionMetricsUpdate: Optional[Callable[[Dict[str, float]], None]] = None,
+                 frameStream=None,
+                 display: bool = True,
+                 max_age: float = 0.25,
+                 max_disagreement: float = 0.05,
+                 startup_timeout: float = 15.0):
+        if marker_corners_ids is None:
+            marker_corners_ids = [10, 12, 14, 16]
+        if len(set(marker_corners_ids)) != 4:
+            raise ValueError("marker_corners_ids must be 4 unique IDs.")
+        self.marker_corners_ids = marker_corners_ids
+        self.width = width
+        self.height = height
+        self.max_age = max_age  # Secondi oltre i quali le pose di una camera non partecipano alla fusione
+        self.max_disagreement = max_disagreement  # Metri: osservazioni più lontane dalla più affidabile sono scartate
+        self.set_targets(robot or {"aruco": 18}, targets or {})
+
+        self.sendToRobot = visionStateUpdate
+        self.sendMetrics = visionMetricsUpdate
+        self.frame_stream = frameStream
+        self.display = display
+        self.fused_windowName = 'Fused View'
+        self.output_size = (int(px_windows_height * (self.width / self.height)), px_windows_height)
+
+        self.camera_names = [camera['name'] for camera in cameras]
+        self.latest = {}  # nome camera -> (istante di cattura, osservazioni)
+        self.ready = set()
+        self.failed = {}
+
+        # Un processo per camera, avviato con 'spawn' come i worker STT: nessuno stato OpenCV ereditato dal padre
+        ctx = multiprocessing.get_context('spawn')
+        self.output = ctx.Queue(maxsize=4 * len(cameras))
+        self.stop_event = ctx.Event()
+        self.processes = []
+        for camera in cameras:
+            process = ctx.Process(target=camera_worker, name=f"camera-{camera['name']}", daemon=True,
+                                  args=(camera, list(marker_corners_ids), width, height, aruco_dict_type, self.output, self.stop_event))
+            process.start()
+            self.processes.append(process)
+        self._wait_started(startup_timeout)
+
+    def _wait_started(self, timeout: float):
+        """Attende che ogni camera sia aperta o fallita, errore solo se non ne resta nessuna"""
+        deadline = time.monotonic() + timeout
+        while len(self.ready) + len(self.failed) < len(self.camera_names):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._handle(self.output.get(timeout=remaining))
+            except queue.Empty:
+                break
+        if not self.ready:
+            self.cleanup()
+            raise IOError(f"Cannot open any camera: {self.failed or 'timeout'}")
+        missing = [name for name in self.camera_names if name not in self.ready]
+        if missing:
+            log.warning("Visione avviata senza le camere %s", ', '.join(missing))
+
+    def set_targets(self, robot: Dict[str, Any], targets: Dict[str, Dict[str, Any]]):
+        """Come Vision.set_targets: tabelle ID ArUco -> (chiave, offset) sostituite in blocco"""
+        offsets = {marker["aruco"]: (key, MarkerPoseCalculator.offset_of(marker)) for key, marker in targets.items()}
+        self.robot_config = robot
+        self.macchinari_id_to_key = {marker_id: key for marker_id, (key, _) in offsets.items()}
+        self.marker_tables = ((robot.get("aruco"), MarkerPoseCalculator.offset_of(robot)), offsets)
+
+    def camera_ages(self) -> Dict[str, float]:
+        """Secondi dall'ultimo frame di ogni camera, per le metriche"""
+        now = time.monotonic()
+        return {name: now - self.latest[name][0] for name in self.camera_names if name in self.latest}
+
+    def _handle(self, message: tuple) -> Optional[Tuple[float, Dict[str, float]]]:
+        """Elabora un messaggio di un processo camera, restituisce istante e tempi delle fasi per i frame"""
+        kind, name = message[0], message[1]
+        if kind == 'frame':
+            _, _, stamp, observations, stage_times = message
+            self.latest[name] = (stamp, observations)
+            return stamp, stage_times
+        if kind == 'ready':
+            self.ready.add(name)
+            log.info("Camera '%s' avviata%s", name, " con omografia configurata" if message[2] else "")
+        elif kind == 'error':
+            self.failed[name] = message[2]
+            log.error("Camera '%s': %s", name, message[2])
+        else:
+            log.warning("Camera '%s': %s", name, message[2])
+        return None
+
+    def fuse(self, now: float) -> Dict[int, Tuple[float, float, float, List[str]]]:
+        """
+        Fonde le osservazioni recenti di tutte le camere: per ogni marker media pesata dalla confidenza
+        (media circolare per l'angolo) delle osservazioni coerenti con quella più affidabile.
+        """
+        by_marker = {}
+        for name, (stamp, observations) in list(self.latest.items()):
+            if now - stamp > self.max_age:
+                continue  # Camera ferma o in ritardo: le sue pose non sono più attuali
+            for marker_id, x, y, angle, confidence in observations:
+                by_marker.setdefault(marker_id, []).append((confidence, x, y, angle, name))
+
+        fused = {}
+        for marker_id, observations in by_marker.items():
+            best = max(observations)
+            agreeing = [o for o in observations if math.dist(o[1:3], best[1:3]) <= self.max_disagreement]
+            total = sum(o[0] for o in agreeing)
+            x = sum(o[0] * o[1] for o in agreeing) / total
+            y = sum(o[0] * o[2] for o in agreeing) / total
+            angle = math.atan2(sum(o[0] * math.sin(o[3]) for o in agreeing), sum(o[0] * math.cos(o[3]) for o in agreeing))
+            fused[marker_id] = (x, y, angle, [o[4] for o in agreeing])
+        return fused
+
+    def _draw(self, fused: Dict[int, Tuple[float, float, float, List[str]]]) -> np.ndarray:
+        """Vista dall'alto del tavolo con le pose fuse, per la finestra OpenCV e il video nel browser"""
+        canvas = np.full((self.output_size[1], self.output_size[0], 3), 40, dtype=np.uint8)
+        cv2.rectangle(canvas, (0, 0), (self.output_size[0] - 1, self.output_size[1] - 1), (0, 255, 0), 2)
+        scale_x = self.output_size[0] / self.width
+        scale_y = self.output_size[1] / self.height
+        for marker_id, (x, y, angle, _) in fused.items():
+            Visualizer.draw_marker_info(canvas, marker_id, x, y, angle, x * scale_x, (self.height - y) * scale_y,
+                                        self.robot_config, self.macchinari_id_to_key)
+        active = sum(age <= self.max_age for age in self.camera_ages().values())
+        cv2.putText(canvas, f"Camere attive: {active}/{len(self.camera_names)}", (10, self.output_size[1] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+        return canvas
+
+    def process_fused(self, stamp: float, stage_times: Dict[str, float]):
+        """Fonde le pose, le pubblica nella stessa forma di Vision e aggiorna finestra, video e metriche"""
+        fusion_start = time.monotonic()
+        fused = self.fuse(fusion_start)
+        (robot_id, robot_offset), marker_offsets = self.marker_tables
+
+        result = {'markers': {}, 'robot': None}
+        for marker_id, (x, y, angle, cameras) in fused.items():
+            if marker_id == robot_id:
+                x, y, angle = MarkerPoseCalculator.apply_offset(x, y, angle, robot_offset)
+                result['robot'] = {'id': marker_id, 'position': [x, y], 'angle': angle, 'cameras': cameras}
+                continue
+            key = f"unknown_{marker_id}"
+            if marker_id in marker_offsets:
+                key, offset = marker_offsets[marker_id]
+                x, y, angle = MarkerPoseCalculator.apply_offset(x, y, angle, offset)
+            result['markers'][key] = {'id': marker_id, 'position': [x, y], 'angle': angle, 'cameras': cameras}
+
+        streaming = self.frame_stream is not None and self.frame_stream.active
+        if self.display or streaming:
+            view = self._draw(fused)
+            if self.display:
+                cv2.imshow(self.fused_windowName, view)
+            if streaming:
+                self.frame_stream.offer(view)
+
+        stage_times = dict(stage_times, fusion=time.monotonic() - fusion_start)
+        if fused and self.sendToRobot:
+            callback_start = time.monotonic()
+            try:
+                self.sendToRobot(result)
+            except Exception as e:
+                log.error("Error calling sendToRobot callback: %s", e)
+            stage_times['callback'] = time.monotonic() - callback_start
+        if self.sendMetrics:
+            stage_times['frame'] = time.monotonic() - stamp  # Dalla cattura alla pubblicazione
+            self.sendMetrics(stage_times)
+
+    def run(self):
+        """Ciclo principale: raccoglie i frame delle camere e pubblica la fusione una volta per ogni gruppo di frame"""
+        try:
+            if self.display:
+                cv2.namedWindow(self.fused_windowName, cv2.WINDOW_NORMAL)
+                cv2.resizeWindow(self.fused_windowName, self.output_size[0], self.output_size[1])
+            latest = None
+            while not self.stop_event.is_set():
+                try:
+                    latest = self._handle(self.output.get(timeout=1.0)) or latest
+                    # Svuota la coda: ogni camera contribuisce con il suo frame più recente e la fusione avviene una volta sola
+                    while True:
+                        latest = self._handle(self.output.get_nowait()) or latest
+                except queue.Empty:
+                    pass
+                except KeyboardInterrupt:
+                    log.info("Interruzione da tastiera rilevata nel ciclo principale.")
+                    break
+                if latest is not None:
+                    self.process_fused(*latest)
+                    latest = None
+                if self.display and cv2.waitKey(1) & 0xFF == ord('q'):
+                    log.info("Exit key 'q' pressed.")
+                    break
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """Ferma i processi delle camere e chiude le finestre OpenCV."""
+        try:
+            log.info("Stopping camera processes and closing windows...")
+            self.stop_event.set()
+            for process in self.processes:
+                process.join(timeout=2.0)
+                if process.is_alive():
+                    process.terminate()
+            if self.display:
+                cv2.destroyAllWindows()
+            log.info("Cleanup complete.")
+        except Exception as e:
+            log.error("Errore durante la pulizia del sottosistema di visione: %s", e)
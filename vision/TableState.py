@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import atexit
+import logging
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Iterator
+
+log = logging.getLogger('ifab.table')
+
+# Formato binario compatto di uno snapshot, identico in memoria condivisa e nei datagrammi multicast:
+# intestazione (magic, versione, numero di sequenza, istante, numero di marker) e un record per marker
+_MAGIC = b'IFTS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBIdH')
+_RECORD = struct.Struct('<HBfffffB')  # id, flag, x, y, theta, x_px, y_px, lunghezza della chiave
+_FLAG_ROBOT = 1
+_FLAG_PX = 2
+
+# Memoria condivisa: contatore del seqlock e lunghezza dello snapshot, seguiti dallo snapshot
+_SHM_HEADER = struct.Struct('<II')
+SHM_SIZE = 16 * 1024
+DEFAULT_SHM_NAME = 'ifab_table_state'
+DEFAULT_MULTICAST = '239.255.42.42:4243'
+
+
+class TableSnapshot:
+    """
+    Pose dei marker di un frame della visione, nella forma prodotta da Vision:
+    state = {'robot': {...} | None, 'markers': {chiave: {'id', 'position', 'angle', 'position_px'}}}
+    È immutabile per convenzione: lo stesso oggetto viene consegnato a tutti i sottoscrittori, che non devono modificarlo.
+    La codifica binaria viene calcolata una sola volta, anche se la usano più destinazioni.
+    """
+    __slots__ = ('seq', 'timestamp', 'state', '_encoded')
+
+    def __init__(self, seq: int, timestamp: float, state: dict):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.state = state
+        self._encoded = None
+
+    def encode(self) -> bytes:
+        if self._encoded is None:
+            records = []
+            entries = ([(self.state['robot'], _FLAG_ROBOT, 'robot')] if self.state.get('robot') else []) + \
+                      [(marker, 0, key) for key, marker in self.state.get('markers', {}).items()]
+            for marker, flags, key in entries:
+                px = marker.get('position_px')
+                key_bytes = key.encode('utf-8')[:255]
+                records.append(_RECORD.pack(marker['id'], flags | (_FLAG_PX if px else 0), marker['position'][0], marker['position'][1],
+                                            marker['angle'], *(px or (0.0, 0.0)), len(key_bytes)) + key_bytes)
+            self._encoded = _HEADER.pack(_MAGIC, _VERSION, self.seq & 0xFFFFFFFF, self.timestamp, len(records)) + b''.join(records)
+        return self._encoded
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview) -> 'TableSnapshot':
+        magic, version, seq, timestamp, count = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Snapshot non riconosciuto (magic {magic!r}, versione {version})")
+        state = {'robot': None, 'markers': {}}
+        offset = _HEADER.size
+        for _ in range(count):
+            marker_id, flags, x, y, theta, x_px, y_px, key_len = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            key = bytes(data[offset:offset + key_len]).decode('utf-8')
+            offset += key_len
+            marker = {'id': marker_id, 'position': [x, y], 'angle': theta}
+            if flags & _FLAG_PX:
+                marker['position_px'] = [x_px, y_px]
+            if flags & _FLAG_ROBOT:
+                state['robot'] = marker
+            else:
+                state['markers'][key] = marker
+        snapshot = cls(seq, timestamp, state)
+        snapshot._encoded = bytes(data[:offset])
+        return snapshot
+
+
+class _Subscriber:
+    __slots__ = ('name', 'callback', 'last_seq', 'delivered', 'skipped', 'thread')
+
+    def __init__(self, name: str, callback: Callable[[TableSnapshot], None]):
+        self.name = name
+        self.callback = callback
+        self.last_seq = 0
+        self.delivered = 0
+        self.skipped = 0  # Snapshot superati da uno più recente prima che il sottoscrittore li leggesse
+        self.thread = None
+
+
+class TableStateBus:
+    """
+    Servizio publish/subscribe dello stato del tavolo.
+    La visione pubblica lo snapshot una volta per frame: publish() salva il riferimento e sveglia i sottoscrittori,
+    senza chiamarli, così il ciclo di cattura ha lo stesso costo con uno o dieci consumatori.
+    Ogni sottoscrittore ha un proprio thread e riceve sempre l'ultimo snapshot disponibile: un consumatore lento
+    salta i frame intermedi invece di accumulare ritardo o rallentare gli altri.
+    """
+
+    def __init__(self):
+        self._latest = None
+        self._seq = 0
+        self._condition = threading.Condition()
+        self._subscribers = []
+        self._running = True
+
+    def publish(self, state: dict) -> TableSnapshot:
+        """Chiamata dal ciclo della visione con le pose del frame"""
+        with self._condition:
+            self._seq += 1
+            snapshot = self._latest = TableSnapshot(self._seq, time.time(), state)
+            self._condition.notify_all()
+        return snapshot
+
+    def latest(self) -> TableSnapshot | None:
+        return self._latest
+
+    def subscribe(self, callback: Callable[[TableSnapshot], None], name: str | None = None) -> _Subscriber:
+        """Registra un consumatore, chiamato nel proprio thread con l'ultimo snapshot"""
+        subscriber = _Subscriber(name or getattr(callback, '__name__', 'subscriber'), callback)
+        subscriber.thread = threading.Thread(target=self._deliver, args=(subscriber,), daemon=True, name=f"table-{subscriber.name}")
+        self._subscribers.append(subscriber)
+        subscriber.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        with self._condition:
+            self._condition.notify_all()
+
+    def _deliver(self, subscriber: _Subscriber):
+        while self._running and subscriber in self._subscribers:
+            with self._condition:
+                self._condition.wait_for(lambda: not self._running or subscriber not in self._subscribers
+                                         or self._seq != subscriber.last_seq)
+                snapshot = self._latest
+            if snapshot is None or snapshot.seq == subscriber.last_seq:
+                continue
+            if subscriber.last_seq:
+                subscriber.skipped += snapshot.seq - subscriber.last_seq - 1
+            subscriber.last_seq = snapshot.seq
+            try:
+                subscriber.callback(snapshot)
+                subscriber.delivered += 1
+            except Exception as e:
+                log.error("Errore nel sottoscrittore dello stato del tavolo '%s': %s", subscriber.name, e)
+
+    def stats(self) -> dict:
+        """Snapshot pubblicati e, per ogni sottoscrittore, consegnati e saltati"""
+        return {'published': self._seq,
+                'subscribers': {s.name: {'delivered': s.delivered, 'skipped': s.skipped} for s in list(self._subscribers)}}
+
+    def stop(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+
+
+class SharedMemoryPublisher:
+    """
+    Scrive l'ultimo snapshot in un segmento di memoria condivisa protetto da un seqlock: il contatore è dispari
+    durante la scrittura e pari a scrittura conclusa. I processi locali lo leggono senza lock e senza socket,
+    e un lettore lento o bloccato non può mai fermare lo scrittore.
+    """
+
+    def __init__(self, name: str = DEFAULT_SHM_NAME, size: int = SHM_SIZE):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Segmento rimasto da un'esecuzione precedente terminata male: lo si riusa
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = name
+        self._counter = 0
+        _SHM_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+
+    def __call__(self, snapshot: TableSnapshot):
+        data = snapshot.encode()
+        if _SHM_HEADER.size + len(data) > self.shm.size:
+            log.warning("Snapshot di %d byte troppo grande per la memoria condivisa '%s'", len(data), self.name)
+            return
+        buf = self.shm.buf
+        self._counter += 1  # Dispari: scrittura in corso
+        struct.pack_into('<I', buf, 0, self._counter & 0xFFFFFFFF)
+        struct.pack_into('<I', buf, 4, len(data))
+        buf[_SHM_HEADER.size:_SHM_HEADER.size + len(data)] = data
+        self._counter += 1  # Pari: snapshot consistente
+        struct.pack_into('<I', buf, 0, self._counter & 0xFFFFFFFF)
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedMemoryReader:
+    """Lettore dello snapshot in memoria condivisa, da usare in un altro processo della stessa macchina"""
+
+    def __init__(self, name: str = DEFAULT_SHM_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Il segmento appartiene al processo della visione: il lettore non deve rimuoverlo alla propria uscita
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self._last_counter = None
+
+    def read(self, retries: int = 100) -> TableSnapshot | None:
+        """Snapshot più recente se è cambiato dall'ultima lettura, altrimenti None"""
+        buf = self.shm.buf
+        for _ in range(retries):
+            before, length = _SHM_HEADER.unpack_from(buf, 0)
+            if before & 1:
+                continue  # Scrittura in corso
+            if before == self._last_counter or length == 0:
+                return None
+            data = bytes(buf[_SHM_HEADER.size:_SHM_HEADER.size + length])
+            if struct.unpack_from('<I', buf, 0)[0] == before:
+                self._last_counter = before
+                return TableSnapshot.decode(data)
+        return None
+
+    def poll(self, interval: float = 0.005) -> Iterator[TableSnapshot]:
+        while True:
+            snapshot = self.read()
+            if snapshot is not None:
+                yield snapshot
+            else:
+                time.sleep(interval)
+
+    def close(self):
+        self.shm.close()
+
+
+def _parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+class MulticastPublisher:
+    """Invia ogni snapshot in un datagramma UDP multicast (poche centinaia di byte) ai dashboard sulla LAN"""
+
+    def __init__(self, address: str = DEFAULT_MULTICAST, ttl: int = 1, interface: str | None = None):
+        self.group, self.port = _parse_address(address)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        if interface:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        self.sock.setblocking(False)  # Con il buffer pieno il datagramma si perde, il prossimo snapshot lo sostituisce
+
+    def __call__(self, snapshot: TableSnapshot):
+        try:
+            self.sock.sendto(snapshot.encode(), (self.group, self.port))
+        except (BlockingIOError, OSError) as e:
+            log.warning("Invio multicast dello stato del tavolo non riuscito: %s", e)
+
+    def close(self):
+        self.sock.close()
+
+
+class MulticastReceiver:
+    """Riceve gli snapshot multicast, scartando quelli arrivati fuori ordine"""
+
+    def __init__(self, address: str = DEFAULT_MULTICAST, interface: str = '0.0.0.0'):
+        self.group, self.port = _parse_address(address)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', self.port))
+        membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self._last_seq = None
+
+    def recv(self, timeout: float | None = None) -> TableSnapshot | None:
+        self.sock.settimeout(timeout)
+        try:
+            data, _ = self.sock.recvfrom(65535)
+        except socket.timeout:
+            return None
+        snapshot = TableSnapshot.decode(data)
+        # Sequenza a 32 bit: un numero molto più basso indica un riavvio del publisher, non un pacchetto in ritardo
+        if self._last_seq is not None and self._last_seq - (1 << 16) < snapshot.seq <= self._last_seq:
+            return None
+        self._last_seq = snapshot.seq
+        return snapshot
+
+    def close(self):
+        self.sock.close()
+
+
+""" Utility function for Argvparser"""
+
+
+def tableState_argsAdd(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    tableParser = parser.add_argument_group("Table state service")
+    tableParser.add_argument('--table_shm', type=str, default=DEFAULT_SHM_NAME,
+                             help="Nome della memoria condivisa con lo stato del tavolo per i processi locali, '' per disabilitare [default '%(default)s']")
+    tableParser.add_argument('--table_multicast', type=str, default='',
+                             help=f"Gruppo:porta multicast su cui pubblicare lo stato del tavolo sulla LAN (es. {DEFAULT_MULTICAST}), '' per disabilitare [default '%(default)s']")
+    tableParser.add_argument('--table_multicast_ttl', type=int, default=1, help="TTL dei pacchetti multicast, 1 resta nella rete locale [default '%(default)s']")
+    return tableParser
+
+
+def tableState_useArgs(args: argparse.Namespace) -> TableStateBus:
+    """Crea il bus e registra come sottoscrittori le destinazioni esterne richieste"""
+    bus = TableStateBus()
+    if args.table_shm:
+        try:
+            publisher = SharedMemoryPublisher(args.table_shm)
+            atexit.register(publisher.close)  # Rimuove il segmento all'uscita
+            bus.subscribe(publisher, name='shm')
+            log.info("Stato del tavolo in memoria condivisa '%s'", args.table_shm)
+        except OSError as e:
+            log.error("Memoria condivisa '%s' non disponibile: %s", args.table_shm, e)
+    if args.table_multicast:
+        bus.subscribe(MulticastPublisher(args.table_multicast, ttl=args.table_multicast_ttl), name='multicast')
+        log.info("Stato del tavolo pubblicato in multicast su %s", args.table_multicast)
+    return bus
+
+
+if __name__ == '__main__':
+    # Monitor dello stato del tavolo: legge dalla memoria condivisa o dal multicast e stampa le pose ricevute
+    parser = argparse.ArgumentParser(description="Monitor dello stato del tavolo pubblicato dalla visione")
+    parser.add_argument('--shm', type=str, default=None, help=f"Nome della memoria condivisa (es. {DEFAULT_SHM_NAME})")
+    parser.add_argument('--multicast', type=str, default=None, help=f"Gruppo:porta multicast (es. {DEFAULT_MULTICAST})")
+    args = parser.parse_args()
+
+    def show(snapshot: TableSnapshot):
+        robot = snapshot.state['robot']
+        markers = ', '.join(f"{key} ({m['position'][0]:.2f}, {m['position'][1]:.2f})" for key, m in snapshot.state['markers'].items())
+        robot_text = f"robot ({robot['position'][0]:.2f}, {robot['position'][1]:.2f}, {robot['angle']:.2f} rad)" if robot else "robot non visto"
+        print(f"#{snapshot.seq} ritardo {(time.time() - snapshot.timestamp) * 1000:.1f} ms | {robot_text} | {markers}")
+
+    if args.multicast:
+        receiver = MulticastReceiver(args.multicast)
+        while True:
+            snapshot = receiver.recv(timeout=1.0)
+            if snapshot is not None:
+                show(snapshot)
+    else:
+        reader = SharedMemoryReader(args.shm or DEFAULT_SHM_NAME)
+        for snapshot in reader.poll():
+            show(snapshot)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import threading
+import time
+from typing import Callable, Iterator
+
+log = logging.getLogger('ifab.video')
+
+BOUNDARY = 'frame'
+
+
+class VideoStream:
+    """
+    Vista annotata della visione in MJPEG per il browser, senza sessione desktop sul PC della visione.
+    Il ciclo della visione offre il frame con offer(): senza spettatori ritorna subito (e Vision non disegna
+    neppure le annotazioni), altrimenti passa il riferimento ad un thread che lo ridimensiona e lo codifica in JPEG
+    al massimo 'fps' volte al secondo. Il JPEG viene codificato una sola volta e inviato a tutti gli spettatori.
+    """
+
+    boundary = BOUNDARY
+
+    def __init__(self, width: int = 640, fps: float = 10.0, quality: int = 70):
+        self.width = width  # Larghezza in pixel del video, 0 per la risoluzione della visione
+        self.min_interval = 1.0 / fps if fps > 0 else 0.0
+        self.quality = quality
+        self.viewers = 0
+        self.encoded = 0
+        self._pending = None
+        self._wakeup = threading.Event()
+        self._jpeg = None
+        self._seq = 0
+        self._last_offer = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def active(self) -> bool:
+        return self.viewers > 0
+
+    def offer(self, frame):
+        """Chiamata dal ciclo della visione con il frame annotato, non lo modifica e non attende la codifica"""
+        if not self.viewers:
+            return
+        now = time.perf_counter()
+        if now - self._last_offer < self.min_interval:
+            return
+        self._last_offer = now
+        self._pending = frame
+        self._wakeup.set()
+
+    def _encode_loop(self):
+        import cv2  # Come la visione: il modulo resta leggero finché nessuno guarda il video
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            frame, self._pending = self._pending, None
+            if frame is None:
+                continue
+            try:
+                if self.width and frame.shape[1] != self.width:
+                    height = round(frame.shape[0] * self.width / frame.shape[1])
+                    frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+                ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            except cv2.error as e:
+                log.warning("Codifica JPEG del video non riuscita: %s", e)
+                continue
+            if ok:
+                self._jpeg = (b'--' + BOUNDARY.encode() + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                              + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg.tobytes() + b'\r\n')
+                self._seq += 1
+                self.encoded += 1
+
+    def _start_encoder(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._encode_loop, daemon=True, name='video-encoder')
+                self._thread.start()
+
+    def frames(self, sleep: Callable[[float], None] = time.sleep) -> Iterator[bytes]:
+        """
+        Parti multipart per la risposta HTTP di uno spettatore. L'attesa usa la funzione sleep passata
+        (socketio.sleep), quella del server web in uso.
+        """
+        self._start_encoder()
+        with self._lock:
+            self.viewers += 1
+        last_seq = self._seq
+        poll = min(self.min_interval / 2, 0.05) if self.min_interval else 0.02
+        try:
+            if self._jpeg is not None:
+                yield self._jpeg  # L'ultimo frame disponibile, senza attendere il prossimo
+            while True:
+                if self._seq != last_seq:
+                    last_seq = self._seq
+                    yield self._jpeg
+                else:
+                    sleep(poll)
+        finally:
+            # Il browser ha chiuso la pagina: la connessione interrotta chiude il generatore
+            with self._lock:
+                self.viewers -= 1
+
+
+""" Utility function for Argvparser"""
+
+
+def videoStream_argsAdd(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    videoParser = parser.add_argument_group("Video stream")
+    videoParser.add_argument('--video_width', type=int, default=640, help="Larghezza in pixel del video MJPEG su /video, 0 per la risoluzione della visione [default '%(default)s']")
+    videoParser.add_argument('--video_fps', type=float, default=10.0, help="Frame al secondo del video MJPEG [default '%(default)s']")
+    videoParser.add_argument('--video_quality', type=int, default=70, help="Qualità JPEG del video, da 1 a 100 [default '%(default)s']")
+    return videoParser
+
+
+def videoStream_useArgs(args: argparse.Namespace) -> VideoStream:
+    return VideoStream(width=args.video_width, fps=args.video_fps, quality=args.video_quality)
@@ -1,6 +1,9 @@
 import atexit
+import logging
+import math
 import signal
 import sys
+import time
 import tkinter as tk
 from typing import Callable, Optional, Tuple, List, Dict, Any
 
@@ -8,6 +11,9 @@ import cv2
 import numpy as np
 from mergedeep import merge
 
+# Log della visione: gli errori ripetuti ad ogni frame vengono limitati dal logging del progetto, senza bloccare il ciclo
+log = logging.getLogger('ifab.vision')
+
 
 class ArUcoDetector:
     """Handles ArUco marker detection and related operations."""
@@ -65,8 +71,9 @@ class PerspectiveTransformer:
         return rect
 
     @staticmethod
-    def transform_perspective(frame: np.ndarray, corners: np.ndarray, wrapped_output_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
-        """Applies perspective transform to the frame based on detected corners."""
+    def transform_perspective(frame: np.ndarray, corners: np.ndarray, wrapped_output_size: Tuple[int, int],
+                              warp: bool = True) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """Applies perspective transform to the frame based on detected corners (only the matrix if warp is False)."""
 
         if corners is None:
             raise ValueError("Corners are None")
@@ -106,8 +113,8 @@ class PerspectiveTransformer:
         # Calculate perspective transform matrix
         matrix = cv2.getPerspectiveTransform(src_pts, dst_pts)
 
-        # Apply perspective transform
-        warped = cv2.warpPerspective(frame, matrix, wrapped_output_size)
+        # Apply perspective transform, the image is needed only for visualization: poses use the matrix
+        warped = cv2.warpPerspective(frame, matrix, wrapped_output_size) if warp else None
 
         return warped, matrix
 
@@ -164,15 +171,19 @@ class MarkerPoseCalculator:
         return pos_x, pos_y, transformed_angle_rad, transformed_x_px, transformed_y_px
 
     @staticmethod
-    def apply_offset(x: float, y: float, angle_rad: float, config: Dict[str, Any]) -> Tuple[float, float, float]:
-        """Applies configured offset to a pose."""
-        offset_x = config.get("x_offset", 0.0)
-        offset_y = config.get("y_offset", 0.0)
-        offset_theta = np.deg2rad(config.get("theta_offset", 0.0))
+    def offset_of(config: Dict[str, Any]) -> Tuple[float, float, float]:
+        """Offset (x, y in metri, theta in radianti) di un marker, calcolato una volta al caricamento della configurazione"""
+        return float(config.get("x_offset", 0.0)), float(config.get("y_offset", 0.0)), float(np.deg2rad(config.get("theta_offset", 0.0)))
+
+    @staticmethod
+    def apply_offset(x: float, y: float, angle_rad: float, offset: Tuple[float, float, float]) -> Tuple[float, float, float]:
+        """Applies a precomputed offset (see offset_of) to a pose."""
+        offset_x, offset_y, offset_theta = offset
 
         # Rotate offset vector by marker angle and add to position
-        final_x = x + offset_x * np.cos(angle_rad) - offset_y * np.sin(angle_rad)
-        final_y = y + offset_x * np.sin(angle_rad) + offset_y * np.cos(angle_rad)
+        cos_a, sin_a = math.cos(angle_rad), math.sin(angle_rad)
+        final_x = x + offset_x * cos_a - offset_y * sin_a
+        final_y = y + offset_x * sin_a + offset_y * cos_a
 
         # Add angle offset and normalize to [-pi, pi]
         final_angle = (angle_rad + offset_theta + 2 * np.pi) % (2 * np.pi)
@@ -265,6 +276,8 @@ class Vision:
                  robot=None,
                  targets=None,
                  visionStateUpdate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 visionMetricsUpdate: Optional[Callable[[Dict[str, float]], None]] = None,
+                 frameStream=None,
                  display: bool = True):
         """Initializes the ArUcoQuadrilateralTransformer."""
         # Real Fields parameters
@@ -283,10 +296,12 @@ class Vision:
 
         # OpenCV display data
         self.display = display  # Enable disable frame view
-        root = tk.Tk()  # Get current monitor information using tkinter
-        self.screen_width = root.winfo_screenwidth()
-        self.screen_height = root.winfo_screenheight()
-        root.destroy()
+        self.screen_width = self.screen_height = None
+        if self.display:  # Senza finestre (headless) non serve né è disponibile un desktop
+            root = tk.Tk()  # Get current monitor information using tkinter
+            self.screen_width = root.winfo_screenwidth()
+            self.screen_height = root.winfo_screenheight()
+            root.destroy()
 
         # Camera settings
         self.camera_index = camera_index
@@ -313,13 +328,31 @@ class Vision:
         self.marker_corners_ids = marker_corners_ids
 
         # Store configuration for robot and machines
-        self.robot_config = robot
-        self.macchinari_config = targets
-        self.macchinari_id_to_key = {mData["aruco"]: key for key, mData in targets.items()}
+        self.set_targets(robot, targets)
 
         self.sendToRobot = visionStateUpdate
         self.last_good_corners = None
 
+        # Durata in secondi delle fasi dell'ultimo frame, passata a visionMetricsUpdate una volta per frame
+        self.sendMetrics = visionMetricsUpdate
+        self.stage_times = {}
+
+        # Video annotato per il browser (VideoStream o simile con 'active' e offer(frame)), annotato solo se qualcuno guarda
+        self.frame_stream = frameStream
+
+    def set_targets(self, robot: Dict[str, Any], targets: Dict[str, Dict[str, Any]]):
+        """
+        Imposta robot e target, precalcolando la tabella ID ArUco -> (chiave, offset) usata ad ogni frame.
+        Può essere chiamata mentre la visione è in esecuzione (ricarica della configurazione): le tabelle
+        vengono sostituite in blocco con un solo assegnamento, il frame in corso usa ancora le precedenti.
+        """
+        offsets = {marker["aruco"]: (key, MarkerPoseCalculator.offset_of(marker)) for key, marker in targets.items()}
+        robot_offset = (robot.get("aruco"), MarkerPoseCalculator.offset_of(robot))
+        self.robot_config = robot
+        self.macchinari_config = targets
+        self.macchinari_id_to_key = {marker_id: key for marker_id, (key, _) in offsets.items()}
+        self.marker_tables = (robot_offset, offsets)
+
     def find_quadrilateral(self, frame: np.ndarray, display: bool = True) -> Optional[np.ndarray]:
         """Finds the quadrilateral defined by the specified ArUco corner markers."""
         corners, ids, rejected = self.aruco_detector.detect_markers(frame)
@@ -374,19 +407,25 @@ class Vision:
         # Capture frame if not provided
         if frame is None or not isinstance(frame, np.ndarray):
             raise ValueError("Invalid frame provided.")
+        # Le annotazioni servono alle finestre OpenCV o agli spettatori del video, altrimenti non si disegna nulla
+        streaming = self.frame_stream is not None and self.frame_stream.active
+        annotate = display or streaming
 
         # Calculate the perspective transform matrix
+        stage_start = time.perf_counter()
         try:
             # Find quadrilateral field_center_corners
             field_center_corners = self.find_quadrilateral(frame, display=display)
-            warped, matrix = PerspectiveTransformer.transform_perspective(frame, field_center_corners, self.warped_output_size)
+            warped, matrix = PerspectiveTransformer.transform_perspective(frame, field_center_corners, self.warped_output_size, warp=annotate)
             # Save the last good warped frame
-            self.last_good_warped = warped.copy()
+            if annotate:
+                self.last_good_warped = warped.copy()
+            self.stage_times['field'] = time.perf_counter() - stage_start
         except Exception as e:
-            if display:
-                if self.last_good_warped:
+            if annotate:
+                if self.last_good_warped is not None:
                     # Show the last good warped frame if available
-                    cv2.imshow(self.warped_windowName, self.last_good_warped)
+                    error_frame = self.last_good_warped
                 else:
                     # Add error text to original frame
                     error_frame = frame.copy()
@@ -405,12 +444,18 @@ class Vision:
                     # Aggiunge testo in giallo per alta visibilità
                     cv2.putText(error_frame, text, (text_x, text_y), font, font_scale, (0, 255, 255), thickness)
 
+                if display:
                     cv2.imshow(self.warped_windowName, error_frame)
+                if streaming:
+                    self.frame_stream.offer(error_frame)
             return
 
+        stage_start = time.perf_counter()
         all_corners, all_ids, rejected = self.aruco_detector.detect_markers(frame)
+        self.stage_times['detect'] = time.perf_counter() - stage_start
         if all_ids is None:
             raise ValueError("No markers detected.")
+        stage_start = time.perf_counter()
 
         # Prepare result structure
         result = {
@@ -419,6 +464,10 @@ class Vision:
         }
         newData = False
 
+        # Tabelle lette una sola volta per frame, coerenti anche se la configurazione viene ricaricata nel frattempo
+        (robot_id, robot_offset), marker_offsets = self.marker_tables
+        macchinari_id_to_key = self.macchinari_id_to_key
+
         # Process all detected markers
         for i, marker_id_np in enumerate(all_ids.flatten()):
             marker_id = int(marker_id_np)
@@ -434,19 +483,20 @@ class Vision:
             try:
                 pos_x, pos_y, angle_rad, trans_x_px, trans_y_px = self.pose_calculator.calculate_marker_pose(current_aruco_corners, matrix)
             except Exception as e:
-                print(f"Error calculating pose for marker {marker_id}: {e}")
+                log.warning("Error calculating pose for marker %s: %s", marker_id, e)
                 continue
 
             # Apply offsets based on marker type
             final_x, final_y, final_angle_rad = pos_x, pos_y, angle_rad
             is_robot = False
 
-            if marker_id == self.robot_config.get("aruco"):
-                final_x, final_y, final_angle_rad = MarkerPoseCalculator.apply_offset(pos_x, pos_y, angle_rad, self.robot_config)
+            marker_key = None
+            if marker_id == robot_id:
+                final_x, final_y, final_angle_rad = MarkerPoseCalculator.apply_offset(pos_x, pos_y, angle_rad, robot_offset)
                 is_robot = True
-            elif marker_id in self.macchinari_id_to_key:
-                machine_config = self.macchinari_config.get(self.macchinari_id_to_key[marker_id], {})
-                final_x, final_y, final_angle_rad = MarkerPoseCalculator.apply_offset(pos_x, pos_y, angle_rad, machine_config)
+            elif marker_id in marker_offsets:
+                marker_key, offset = marker_offsets[marker_id]
+                final_x, final_y, final_angle_rad = MarkerPoseCalculator.apply_offset(pos_x, pos_y, angle_rad, offset)
 
             # Store marker data
             marker_data = {
@@ -460,28 +510,32 @@ class Vision:
             if is_robot:
                 result['robot'] = marker_data
             else:
-                marker_key = self.macchinari_id_to_key.get(marker_id, f"unknown_{marker_id}")
-                result['markers'][marker_key] = marker_data
+                result['markers'][marker_key or f"unknown_{marker_id}"] = marker_data
 
-            # Draw marker information if display is enabled
-            if display:
+            # Draw marker information if display or streaming is enabled
+            if annotate:
                 # Show marker ID and position and associated target position (offsets)
                 # TODO: Mostrare anche l'offset calcolando la posizione del target a schermo
                 warped = Visualizer.draw_marker_info(warped, marker_id,
                                                      pos_x, pos_y, angle_rad, trans_x_px, trans_y_px,
                                                      # final_x, final_y, final_angle_rad,
-                                                     self.robot_config, self.macchinari_id_to_key)
+                                                     self.robot_config, macchinari_id_to_key)
 
         # Print final result of warped image with HUD information
         if display:
             cv2.imshow(self.warped_windowName, warped)
+        if streaming:
+            self.frame_stream.offer(warped)
+        self.stage_times['pose'] = time.perf_counter() - stage_start
 
         # Send data if new data was processed and callback exists
         if newData and self.sendToRobot:
+            stage_start = time.perf_counter()
             try:
                 self.sendToRobot(result)  # send infornation using callback
             except Exception as e:
-                print(f"Error calling sendToRobot callback: {e}")
+                log.error("Error calling sendToRobot callback: %s", e)
+            self.stage_times['callback'] = time.perf_counter() - stage_start
 
     def setup_windows(self):
         """Initializes and positions the OpenCV windows."""
@@ -506,14 +560,23 @@ class Vision:
                 self.setup_windows()
             while True:
                 try:
+                    frame_start = time.perf_counter()
+                    self.stage_times.clear()
                     frame = self.get_frame()
-                    self.process_frame(frame, display=self.display)
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == ord('q'):
-                        print("Exit key 'q' pressed.")
-                        break
+                    self.stage_times['capture'] = time.perf_counter() - frame_start
+                    try:
+                        self.process_frame(frame, display=self.display)
+                    finally:
+                        if self.sendMetrics:
+                            self.stage_times['frame'] = time.perf_counter() - frame_start
+                            self.sendMetrics(self.stage_times)
+                    if self.display:
+                        key = cv2.waitKey(1) & 0xFF
+                        if key == ord('q'):
+                            print("Exit key 'q' pressed.")
+                            break
                 except (IOError, ValueError) as e:
-                    print(f"Error getting frame: {type(e).__name__} - {e}")
+                    log.warning("Error getting frame: %s - %s", type(e).__name__, e)
                     continue
                 except KeyboardInterrupt:
                     print("Interruzione da tastiera rilevata nel ciclo principale.")
@@ -534,7 +597,9 @@ class Vision:
 
 
 # Setup del sottosistema di visione, avvia un thread per la visione della camera e ritorna il riferimento alla classe
-def vision_setup(conf: dict, visionStateUpdate: Optional[Callable[[Dict[str, Any]], None]] = None) -> Vision:
+def vision_setup(conf: dict, visionStateUpdate: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 visionMetricsUpdate: Optional[Callable[[Dict[str, float]], None]] = None,
+                 frameStream=None, display: bool = True) -> Vision:
     table = conf['table']
     aruco = table['aruco']
     corners_ids = [
@@ -543,12 +608,32 @@ def vision_setup(conf: dict, visionStateUpdate: Optional[Callable[[Dict[str, Any
     targetMachines = merge({}, conf['workZone'], conf['macchinari'])
 
     print("Avvio sottosistema di visione")
-    transformer = Vision(camera_index=conf["cameraIndex"],
-                         marker_corners_ids=corners_ids,
-                         width=table['width'], height=table['height'],
-                         robot=conf['robot'], targets=targetMachines,
-                         visionStateUpdate=visionStateUpdate,
-                         display=True)
+    cameras = conf.get('cameras') or []
+    # Anche una sola camera passa da MultiCameraVision se ha un'omografia calibrata o un'affinità di CPU:
+    # Vision userebbe solo l'indice e ignorerebbe il resto della configurazione
+    if len(cameras) > 1 or any(camera.get('homography') or camera.get('cpu') for camera in cameras):
+        # Un processo per camera e fusione delle pose, le finestre mostrano solo la vista fusa
+        try:
+            from .MultiCamera import MultiCameraVision
+        except ImportError:
+            from MultiCamera import MultiCameraVision
+        transformer = MultiCameraVision(cameras,
+                                        marker_corners_ids=corners_ids,
+                                        width=table['width'], height=table['height'],
+                                        robot=conf['robot'], targets=targetMachines,
+                                        visionStateUpdate=visionStateUpdate,
+                                        visionMetricsUpdate=visionMetricsUpdate,
+                                        frameStream=frameStream,
+                                        display=display)
+    else:
+        transformer = Vision(camera_index=conf["cameraIndex"],
+                             marker_corners_ids=corners_ids,
+                             width=table['width'], height=table['height'],
+                             robot=conf['robot'], targets=targetMachines,
+                             visionStateUpdate=visionStateUpdate,
+                             visionMetricsUpdate=visionMetricsUpdate,
+                             frameStream=frameStream,
+                             display=display)
 
     # Registra la funzione di cleanup con atexit
     atexit.register(transformer.cleanup)